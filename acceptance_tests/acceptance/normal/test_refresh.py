@@ -7,8 +7,33 @@ from c2cwsgiutils.acceptance.connection import CacheExpected, Connection
 
 
 def test_ok(app_connection: Connection) -> None:
-    answer = app_connection.get_json("1/refresh/test_git", headers={"X-Scm-Secret": "changeme"}, cors=False)
-    assert answer == {"status": 200}
+    answer = app_connection.get_json(
+        "1/refresh/test_git", expected_status=202, headers={"X-Scm-Secret": "changeme"}, cors=False
+    )
+    assert answer["status"] == 202
+    job = app_connection.get_json(
+        f"1/jobs/{answer['job']}?wait=60", headers={"X-Scm-Secret": "changeme"}, cors=False
+    )
+    assert job["status"] == "done"
+    assert job["phases"] == {"test_git": "refreshed"}
+
+
+def test_wait(app_connection: Connection) -> None:
+    answer = app_connection.get_json(
+        "1/refresh/test_git?wait=60", headers={"X-Scm-Secret": "changeme"}, cors=False
+    )
+    assert answer["status"] == 200
+    assert "ignored" not in answer
+
+
+def test_unknown_job(app_connection: Connection) -> None:
+    app_connection.get(
+        "1/jobs/unknown",
+        headers={"X-Scm-Secret": "changeme"},
+        expected_status=404,
+        cache_expected=CacheExpected.DONT_CARE,
+        cors=False,
+    )
 
 
 def test_no_auth(app_connection: Connection) -> None:
@@ -32,10 +57,17 @@ def test_bad_id(app_connection: Connection) -> None:
     )
 
 
-def _trigger(app_connection: Connection, url: str, json: dict[str, Any], headers: dict[str, str]):
+def _trigger(
+    app_connection: Connection,
+    url: str,
+    json: dict[str, Any],
+    headers: dict[str, str],
+    expected_status: int = 200,
+):
     json = json_module.dumps(json).encode("utf-8")
     return app_connection.post_json(
         url,
+        expected_status=expected_status,
         data=json,
         headers={
             "Content-Type": "application/json",
@@ -60,9 +92,11 @@ def test_webhook(app_connection: Connection) -> None:
             # the rest is ignored
         },
         headers={"X-GitHub-Event": "push"},
+        expected_status=202,
     )
 
-    assert answer == {"status": 200}
+    assert answer["status"] == 202
+    assert "job" in answer
 
 
 def test_webhook_other_branch(app_connection: Connection) -> None:
@@ -94,18 +128,30 @@ def test_webhook_not_push(app_connection: Connection) -> None:
 
 
 def test_all(app_connection: Connection) -> None:
-    answer = app_connection.get_json("1/refresh", headers={"X-Scm-Secret": "changeme"}, cors=False)
-    assert answer == {"status": 200, "nb_refresh": 1}
+    answer = app_connection.get_json("1/refresh?wait=60", headers={"X-Scm-Secret": "changeme"}, cors=False)
+    assert answer["status"] == 200
+    assert answer["nb_refresh"] == 1
 
 
 def test_all_webhook(app_connection: Connection) -> None:
     answer = _trigger(
         app_connection,
-        "1/refresh",
+        "1/refresh?wait=60",
         json={"ref": "refs/heads/master"},
         headers={"X-GitHub-Event": "push"},
     )
-    assert answer == {"status": 200, "nb_refresh": 1}
+    assert answer["status"] == 200
+    assert answer["nb_refresh"] == 1
+
+
+def test_all_webhook_no_source(app_connection: Connection) -> None:
+    answer = _trigger(
+        app_connection,
+        "1/refresh",
+        json={"ref": "refs/heads/other"},
+        headers={"X-GitHub-Event": "push"},
+    )
+    assert answer == {"status": 200, "nb_refresh": 0}
 
 
 def test_all_no_auth(app_connection: Connection) -> None:
@@ -13,6 +13,58 @@ def test_ok(app_connection: Connection) -> None:
         subprocess.check_call(["tar", "--test-label", "--verbose", "--file", temp.name])
 
 
+def test_zstd(app_connection: Connection) -> None:
+    r = app_connection.get_raw(
+        "1/tarball/test_git",
+        headers={"X-Scm-Secret": "changeme", "Accept": "application/zstd, application/x-gtar;q=0.5"},
+        cors=False,
+    )
+    assert r.headers["Content-Type"] == "application/zstd"
+    # zstd magic number
+    assert r.content[:4] == b"\x28\xb5\x2f\xfd"
+
+
+def test_not_modified(app_connection: Connection) -> None:
+    r = app_connection.get_raw("1/tarball/test_git", headers={"X-Scm-Secret": "changeme"}, cors=False)
+    etag = r.headers["ETag"]
+    app_connection.get_raw(
+        "1/tarball/test_git",
+        headers={"X-Scm-Secret": "changeme", "If-None-Match": etag},
+        expected_status=304,
+        cache_expected=CacheExpected.DONT_CARE,
+        cors=False,
+    )
+
+
+def test_not_modified_zstd(app_connection: Connection) -> None:
+    accept = "application/zstd, application/x-gtar;q=0.5"
+    r = app_connection.get_raw("1/tarball/test_git", headers={"X-Scm-Secret": "changeme"}, cors=False)
+    gzip_etag = r.headers["ETag"]
+    r = app_connection.get_raw(
+        "1/tarball/test_git",
+        headers={"X-Scm-Secret": "changeme", "Accept": accept, "If-None-Match": gzip_etag},
+        cors=False,
+    )
+    assert r.headers["ETag"] != gzip_etag
+    app_connection.get_raw(
+        "1/tarball/test_git",
+        headers={"X-Scm-Secret": "changeme", "Accept": accept, "If-None-Match": r.headers["ETag"]},
+        expected_status=304,
+        cache_expected=CacheExpected.DONT_CARE,
+        cors=False,
+    )
+
+
+def test_head(app_connection: Connection) -> None:
+    r = app_connection.session.head(
+        app_connection.base_url + "1/tarball/test_git",
+        headers={"X-Scm-Secret": "changeme", "Accept": "application/zstd"},
+    )
+    assert r.status_code == 200
+    assert r.headers["Content-Type"] == "application/zstd"
+    assert r.headers["ETag"].endswith('-zst"')
+
+
 def test_bad_key(app_connection: Connection) -> None:
     app_connection.get(
         "1/tarball/test_git",
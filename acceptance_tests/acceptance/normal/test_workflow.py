@@ -52,7 +52,9 @@ def git_source(app_connection: Connection):
     master_hash = get_hash("/repos/master")
     other_hash = get_hash("/repos/other")
 
-    response = requests.get("http://api:8080/scm/1/refresh/master", headers={"X-Scm-Secret": "changeme"})
+    response = requests.get(
+        "http://api:8080/scm/1/refresh/master?wait=60", headers={"X-Scm-Secret": "changeme"}
+    )
     assert response.ok
 
     wait_sync(app_connection, "master", master_hash)
@@ -73,7 +75,7 @@ def git_source(app_connection: Connection):
     )
     time.sleep(0.1)
 
-    app_connection.get_json("1/refresh/master", headers={"X-Scm-Secret": "changeme"}, cors=False)
+    app_connection.get_json("1/refresh/master?wait=60", headers={"X-Scm-Secret": "changeme"}, cors=False)
     wait_sync(app_connection, "other", None)
     time.sleep(0.1)
 
@@ -103,7 +105,7 @@ def test_ok(app_connection, git_source) -> None:  # pylint: disable=redefined-ou
     time.sleep(0.1)
 
     hash_ = get_hash(git_source)
-    app_connection.get_json("1/refresh/other", headers={"X-Scm-Secret": "changeme"}, cors=False)
+    app_connection.get_json("1/refresh/other?wait=60", headers={"X-Scm-Secret": "changeme"}, cors=False)
     wait_sync(app_connection, "other", hash_)
     time.sleep(0.1)
 
@@ -1,37 +1,107 @@
 # Copyright (c) 2026, Camptocamp SA
 import asyncio
 import logging
+import pathlib
 import re
-import shlex
 import subprocess
 from typing import TYPE_CHECKING, Annotated, cast
 
 from c2casgiutils import broadcast
 from fastapi import Depends, FastAPI, Header, HTTPException, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
-from shared_config_manager import broadcast_status, slave_status
+from shared_config_manager import (
+    blocks,
+    broadcast_status,
+    config,
+    jobs,
+    manifest,
+    repositories,
+    scheduler,
+    slave_status,
+    tarball,
+)
 from shared_config_manager.security import User, get_identity
 from shared_config_manager.sources import registry
 
 if TYPE_CHECKING:
-    from collections.abc import AsyncGenerator
-
+    from anyio import Path
     from c2casgiutils.broadcast import types as broadcast_types
 
     from shared_config_manager.sources import git
+    from shared_config_manager.sources.base import BaseSource
 
 app = FastAPI()
 
 _LOG = logging.getLogger(__name__)
 __BRANCH_NAME_SANITIZER = re.compile(r"[^0-9a-zA-Z-_]")
+_COMMIT_RE = re.compile(r"^[0-9a-f]{40}(?:[0-9a-f]{24})?$")
+# GitHub sends at most 20 commits in the push payloads
+_MAX_PAYLOAD_COMMITS = 20
+
+
+class PushCommit(BaseModel):
+    """Commit of a push webhook payload."""
+
+    added: list[str] = []
+    removed: list[str] = []
+    modified: list[str] = []
+
+
+class PushRepository(BaseModel):
+    """Repository of a push webhook payload (GitHub and GitLab)."""
+
+    clone_url: str | None = None
+    ssh_url: str | None = None
+    git_url: str | None = None
+    git_http_url: str | None = None
+    git_ssh_url: str | None = None
+
+    def get_urls(self) -> set[str]:
+        """Get the normalized URLs of the repository."""
+        urls = [self.clone_url, self.ssh_url, self.git_url, self.git_http_url, self.git_ssh_url]
+        return {repositories.normalize_url(url) for url in urls if url}
+
+    def matches(self, url: str) -> bool:
+        """Check if the repository has the given URL, whatever the protocol."""
+        return repositories.normalize_url(url) in self.get_urls()
+
+
+def _get_sha(value: str | None) -> str | None:
+    """Get a commit hash, None if invalid or null (created or deleted branch)."""
+    if value is None or not _COMMIT_RE.match(value) or not value.strip("0"):
+        return None
+    return value
 
 
 class SourceRefPayload(BaseModel):
     """GitHub webhook payload model."""
 
     ref: str | None = None
+    # The previous and the new heads of the branch
+    before: str | None = None
+    after: str | None = None
+    commits: list[PushCommit] | None = None
+    # GitLab
+    total_commits_count: int | None = None
+    repository: PushRepository | None = None
+
+    def get_commit(self) -> str | None:
+        """Get the pushed commit, None if unknown or if the branch was deleted."""
+        return _get_sha(self.after)
+
+    def get_changed_paths(self) -> set[str] | None:
+        """Get the paths changed by the push, None if unknown (e.g. truncated payload)."""
+        if (
+            not self.commits
+            or len(self.commits) >= _MAX_PAYLOAD_COMMITS
+            or (self.total_commits_count or 0) > len(self.commits)
+        ):
+            return None
+        return {
+            path for commit in self.commits for path in (*commit.added, *commit.removed, *commit.modified)
+        }
 
 
 class RefreshResponse(BaseModel):
@@ -40,6 +110,7 @@ class RefreshResponse(BaseModel):
     status: int
     ignored: bool | None = None
     reason: str | None = None
+    job: str | None = None
 
 
 class RefreshAllResponse(BaseModel):
@@ -49,6 +120,35 @@ class RefreshAllResponse(BaseModel):
     nb_refresh: int = 0
     ignored: bool | None = None
     reason: str | None = None
+    job: str | None = None
+
+
+class JobResponse(BaseModel):
+    """Response model for job endpoint."""
+
+    id: str
+    status: jobs.Status
+    duration: float
+    phases: dict[str, str]
+    nb_refresh: int
+    ignored: dict[str, str]
+    errors: dict[str, str]
+
+
+class ManifestResponse(BaseModel):
+    """Response model for manifest endpoint."""
+
+    version: str
+    entries: manifest.Manifest
+
+
+class BlocksPayload(BaseModel):
+    """Payload model for blocks endpoint."""
+
+    version: str
+    path: str
+    # The indexes of the missing blocks
+    blocks: list[int]
 
 
 class StatusResponse(BaseModel):
@@ -72,24 +172,28 @@ async def startup(app: FastAPI) -> None:
 @app.get("/refresh/{source_id}", response_model_exclude_none=True)
 async def _refresh_view(
     request: Request,
+    response: Response,
     source_id: str,
     identity: Annotated[User | None, Depends(get_identity)],
+    wait: float = 0,
 ) -> RefreshResponse:
     source, _ = await registry.get_source_check_auth(source_id=source_id, identity=identity, request=request)
     if source is None:
         message = f"Unknown id {source_id}"
         raise HTTPException(status_code=404, detail=message)
     await source.validate_auth(identity, request, access_type="write")
-    return await _refresh(source_id, identity, request)
+    return await _refresh(request, response, source, wait, scheduler.Priority.MANUAL)
 
 
 @app.post("/refresh/{source_id}", response_model_exclude_none=True)
 async def _refresh_webhook(
     request: Request,
+    response: Response,
     source_id: str,
     payload: SourceRefPayload,
     identity: Annotated[User | None, Depends(get_identity)],
     x_github_event: Annotated[str | None, Header()] = None,
+    wait: float = 0,
 ) -> RefreshResponse:
     source, _ = await registry.get_source_check_auth(source_id=source_id, identity=identity, request=request)
     if source is None:
@@ -121,48 +225,196 @@ async def _refresh_webhook(
         branch = __BRANCH_NAME_SANITIZER.sub("", source_git.get_branch())
         return RefreshResponse(status=200, ignored=True, reason=f"Not {branch} branch")
 
-    return await _refresh(source_id, identity, request)
+    return await _refresh(request, response, source, wait, scheduler.Priority.WEBHOOK, payload)
+
+
+async def _is_touched(
+    source: git.GitSource, payload: SourceRefPayload, diffs: dict[str, asyncio.Task[set[str]]]
+) -> bool:
+    """
+    Check if the push changed files of the source, True if unknown.
+
+    The changed paths are taken from the payload, or from a diff between the two commits if the payload is
+    truncated, the diffs are shared between the sources of a repository.
+    """
+    if payload.repository is None or not payload.repository.matches(source.get_repo()):
+        return True
+    paths = payload.get_changed_paths()
+    if paths is None:
+        before = _get_sha(payload.before)
+        after = payload.get_commit()
+        if before is None or after is None:
+            return True
+        if source.get_repo() not in diffs:
+            diffs[source.get_repo()] = asyncio.create_task(
+                scheduler.run(
+                    scheduler.Priority.WEBHOOK,
+                    lambda: repositories.get_changed_paths(
+                        source.get_repo(), source.get_branch(), before, after
+                    ),
+                )
+            )
+        try:
+            paths = await diffs[source.get_repo()]
+        except subprocess.CalledProcessError:
+            _LOG.warning(
+                "Failed to get the files changed by the push on %s", source.get_repo(), exc_info=True
+            )
+            return True
+    return source.is_touched(paths)
+
+
+def _start_job(
+    sources: list[BaseSource], priority: scheduler.Priority, payload: SourceRefPayload | None = None
+) -> jobs.Job:
+    """
+    Start a job refreshing the sources.
+
+    With the payload of a push webhook, the sources are refreshed to the pushed commit, only if the push
+    changed their files.
+    """
+    sources_by_id = {source.get_id(): source for source in sources}
+    diffs: dict[str, asyncio.Task[set[str]]] = {}
+
+    async def refresh(source_id: str) -> str | None:
+        source = sources_by_id[source_id]
+        commit = None
+        if payload is not None:
+            if not await _is_touched(cast("git.GitSource", source), payload, diffs):
+                _LOG.info("Ignoring webhook notif not touching the files of %s", source_id)
+                return "Files not changed"
+            commit = payload.get_commit()
+        _LOG.info("Reloading the %s config", source_id)
+        if not await registry.refresh_source(source, commit, priority):
+            return "Already up to date"
+        return None
+
+    return jobs.start(list(sources_by_id), refresh)
+
+
+async def _wait_job(request: Request, response: Response, job: jobs.Job, wait: float) -> bool:
+    """Wait for the end of the job, on timeout the response is a 202 pointing to the job."""
+    if await job.wait(wait):
+        return True
+    response.status_code = 202
+    response.headers["Location"] = str(request.url_for("_job", job_id=job.id))
+    return False
+
+
+def _raise_errors(job: jobs.Job) -> None:
+    """Raise the error of a finished job, preferably an `HTTPException`."""
+    errors = list(job.errors.values())
+    for error in errors:
+        if isinstance(error, HTTPException):
+            raise error
+    if errors:
+        raise errors[0]
+
+
+async def _refresh(
+    request: Request,
+    response: Response,
+    source: BaseSource,
+    wait: float,
+    priority: scheduler.Priority,
+    payload: SourceRefPayload | None = None,
+) -> RefreshResponse:
+    job = _start_job([source], priority, payload)
+    if not await _wait_job(request, response, job, wait):
+        return RefreshResponse(status=202, job=job.id)
+    _raise_errors(job)
+    if source.get_id() in job.ignored:
+        return RefreshResponse(status=200, ignored=True, reason=job.ignored[source.get_id()], job=job.id)
+    return RefreshResponse(status=200, job=job.id)
+
+
+@app.get("/jobs/{job_id}", response_model_exclude_none=True)
+async def _job(
+    request: Request,
+    job_id: str,
+    identity: Annotated[User | None, Depends(get_identity)],
+    wait: float = 0,
+) -> JobResponse:
+    if not registry.MASTER_SOURCE:
+        message = "Master source not initialized"
+        raise HTTPException(status_code=500, detail=message)
+    await registry.MASTER_SOURCE.validate_auth(identity, request)
+    job = jobs.get(job_id)
+    if job is None:
+        message = f"Unknown job {job_id}"
+        raise HTTPException(status_code=404, detail=message)
+    await job.wait(wait)
+    return JobResponse(
+        id=job.id,
+        status=job.get_status(),
+        duration=job.get_duration(),
+        phases=job.get_phases(),
+        nb_refresh=len(job.refreshed),
+        ignored=job.ignored,
+        errors={source_id: str(error) for source_id, error in job.errors.items()},
+    )
 
 
-async def _refresh(source_id: str, identity: User | None, request: Request) -> RefreshResponse:
-    await registry.refresh(source_id=source_id, identity=identity, request=request)
+@app.post("/rollback/{source_id}", response_model_exclude_none=True)
+async def _rollback(
+    request: Request,
+    source_id: str,
+    identity: Annotated[User | None, Depends(get_identity)],
+    generation: str | None = None,
+) -> RefreshResponse:
+    source, _ = await registry.get_source_check_auth(source_id=source_id, identity=identity, request=request)
+    if source is None:
+        message = f"Unknown id {source_id}"
+        raise HTTPException(status_code=404, detail=message)
+    await source.validate_auth(identity, request, access_type="write")
+    await registry.rollback(source_id, generation)
     return RefreshResponse(status=200)
 
 
+async def _refresh_all_sources(
+    request: Request,
+    response: Response,
+    sources: list[BaseSource],
+    wait: float,
+    priority: scheduler.Priority,
+    payload: SourceRefPayload | None = None,
+) -> RefreshAllResponse:
+    job = _start_job(sources, priority, payload)
+    if not await _wait_job(request, response, job, wait):
+        return RefreshAllResponse(status=202, job=job.id)
+    _raise_errors(job)
+    return RefreshAllResponse(status=200, nb_refresh=len(job.refreshed), job=job.id)
+
+
 @app.get("/refresh", response_model_exclude_none=True)
 async def _refresh_all(
     request: Request,
+    response: Response,
     identity: Annotated[User | None, Depends(get_identity)],
+    wait: float = 0,
 ) -> RefreshAllResponse:
     if not registry.MASTER_SOURCE:
         message = "Master source not initialized"
         raise HTTPException(status_code=500, detail=message)
     await registry.MASTER_SOURCE.validate_auth(identity, request, access_type="write")
-    source_ids = list(registry.get_sources())
-    results = await asyncio.gather(
-        *[registry.refresh(source_id=sid, identity=identity, request=request) for sid in source_ids],
-        return_exceptions=True,
-    )
-    errors: list[Exception] = []
-    for sid, result in zip(source_ids, results, strict=True):
-        if isinstance(result, Exception):
-            _LOG.error("Error refreshing source %s", sid, exc_info=result)
-            errors.append(result)
-    if errors:
-        # Prefer propagating an HTTPException if any, otherwise the first generic exception.
-        for err in errors:
-            if isinstance(err, HTTPException):
-                raise err
-        raise errors[0]
-    return RefreshAllResponse(status=200, nb_refresh=len(source_ids))
+    sources = []
+    for source_id in registry.get_sources():
+        source, _ = await registry.get_source_check_auth(
+            source_id=source_id, identity=identity, request=request
+        )
+        assert source is not None
+        sources.append(source)
+    return await _refresh_all_sources(request, response, sources, wait, scheduler.Priority.MANUAL)
 
 
 @app.post("/refresh", response_model_exclude_none=True)
 async def _refresh_all_webhook(
     request: Request,
+    response: Response,
     payload: SourceRefPayload,
     identity: Annotated[User | None, Depends(get_identity)],
     x_github_event: Annotated[str | None, Header()] = None,
+    wait: float = 0,
 ) -> RefreshAllResponse:
     if not registry.MASTER_SOURCE:
         message = "Master source not initialized"
@@ -178,38 +430,21 @@ async def _refresh_all_webhook(
         message = "Webhook is missing the ref"
         raise HTTPException(status_code=500, detail=message)
 
-    matching_source_ids = []
-    for source_id, source in registry.get_sources().items():
-        if not source or source.get_type() != "git":
-            continue
-
-        source_git = cast("git.GitSource", source)
-
-        if ref != "refs/heads/" + source_git.get_branch():
-            _LOG.info(
-                "Ignoring webhook notif for non-matching branch %s!=refs/heads/%s on %s",
-                ref,
-                source_git.get_branch(),
-                source_id,
-            )
-            continue
-        matching_source_ids.append(source_id)
-
-    results = await asyncio.gather(
-        *[registry.refresh(source_id=sid, identity=identity, request=request) for sid in matching_source_ids],
-        return_exceptions=True,
+    if not ref.startswith("refs/heads/"):
+        _LOG.info("Ignoring webhook notif for the non-branch ref %s", ref)
+        return RefreshAllResponse(status=200, ignored=True, reason="Not a branch")
+    # Without the repository in the payload, all the sources of the branch
+    repository_urls = payload.repository.get_urls() if payload.repository is not None else None
+    sources: list[BaseSource] = list(
+        registry.get_git_sources(ref.removeprefix("refs/heads/"), repository_urls or None)
     )
-    errors: list[Exception] = []
-    for sid, result in zip(matching_source_ids, results, strict=True):
-        if isinstance(result, Exception):
-            _LOG.error("Error refreshing source %s", sid, exc_info=result)
-            errors.append(result)
-    if errors:
-        for err in errors:
-            if isinstance(err, HTTPException):
-                raise err
-        raise errors[0]
-    return RefreshAllResponse(status=200, nb_refresh=len(matching_source_ids))
+    _LOG.info("The webhook notif for %s matches the sources %s", ref, [source.get_id() for source in sources])
+    for source in sources:
+        await source.validate_auth(identity, request)
+    if not sources:
+        return RefreshAllResponse(status=200, nb_refresh=0)
+
+    return await _refresh_all_sources(request, response, sources, wait, scheduler.Priority.WEBHOOK, payload)
 
 
 @app.get("/status", response_model_exclude_none=True)
@@ -254,12 +489,11 @@ async def _source_stats(
     return SourceStatusResponse(statuses=statuses)
 
 
-@app.get("/tarball/{source_id}")
-async def _tarball(
+async def _get_source_tarball(
     request: Request,
     source_id: str,
-    identity: Annotated[User | None, Depends(get_identity)],
-) -> StreamingResponse:
+    identity: User | None,
+) -> tuple[BaseSource, tarball.Tarball]:
     source, filtered = await registry.get_source_check_auth(
         source_id=source_id,
         identity=identity,
@@ -281,37 +515,148 @@ async def _tarball(
         message = "Not loaded yet: path didn't exists"
         raise HTTPException(status_code=404, detail=message)
 
-    files = [file.name async for file in path.iterdir()]
-    gitstats_filename = ".gitstats"
-    if gitstats_filename in files:
-        # put .gitstats at the end, that way, it is updated last at the destination
-        files.remove(gitstats_filename)
-        files.append(gitstats_filename)
-
-    async def tarball_generator() -> AsyncGenerator[bytes]:
-        args = [
-            "tar",
-            "--create",
-            "--gzip",
-            *files,
-        ]
-        proc = await asyncio.create_subprocess_exec(  # pylint: disable=consider-using-with
-            *args,
-            cwd=str(path),
-            stdout=subprocess.PIPE,
-        )
-        if proc.stdout:
-            while True:
-                block = await proc.stdout.read(4096)
-                if not block:
-                    break
-                yield block
-        if await proc.wait() != 0:
-            _LOG.error(
-                "Error building the tarball with '%s'",
-                shlex.join(args),
-            )
-            message = "Error building the tarball"
-            raise HTTPException(status_code=500, detail=message)
+    try:
+        return source, await tarball.get_or_build(source.get_id(), path, await source.get_version())
+    except subprocess.CalledProcessError as exception:
+        message = "Error building the tarball"
+        raise HTTPException(status_code=500, detail=message) from exception
+
+
+def _version_headers(source_tarball: tarball.Tarball, compression: str = "gzip") -> dict[str, str]:
+    # The version of the source (with the compression) is used as ETag, that way the slaves and the
+    # proxies can revalidate their copy without downloading it again.
+    return {
+        "ETag": tarball.get_etag(source_tarball.version, compression),
+        "Vary": "X-Scm-Secret, Cookie, Accept",
+    }
+
+
+def _get_compression(accept: str | None) -> str:
+    """Get the compression of the tarballs preferred by the client, gzip by default."""
+    qualities: dict[str, float] = {}
+    for value in (accept or "").split(","):
+        media_type, *params = (part.strip() for part in value.split(";"))
+        quality = 1.0
+        for param in params:
+            name, _, param_value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(param_value)
+                except ValueError:
+                    quality = 0
+        qualities[media_type.lower()] = quality
+    # On a tie, the first one (gzip) is preferred, for the older slaves
+    return max(
+        tarball.MEDIA_TYPES,
+        key=lambda compression: qualities.get(tarball.MEDIA_TYPES[compression], 0),
+    )
+
+
+async def _file_response(
+    request: Request, source_id: str, path: Path, compression: str, headers: dict[str, str]
+) -> FileResponse:
+    if request.method != "HEAD":
+        tarball.count_sent(source_id, compression, (await path.stat()).st_size)
+    return FileResponse(path, media_type=tarball.MEDIA_TYPES[compression], headers=headers)
+
+
+@app.api_route("/tarball/{source_id}", methods=["GET", "HEAD"])
+async def _tarball(
+    request: Request,
+    source_id: str,
+    identity: Annotated[User | None, Depends(get_identity)],
+    if_none_match: Annotated[str | None, Header()] = None,
+    accept: Annotated[str | None, Header()] = None,
+) -> Response:
+    _, source_tarball = await _get_source_tarball(request, source_id, identity)
+    compression = _get_compression(accept)
+    headers = _version_headers(source_tarball, compression)
+    if if_none_match is not None and _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    if request.method == "HEAD":
+        # Without transcoding the tarball
+        path = tarball.get_compressed_path(source_tarball, compression)
+        if not await path.is_file():
+            return Response(headers=headers, media_type=tarball.MEDIA_TYPES[compression])
+        return await _file_response(request, source_id, path, compression, headers)
+    try:
+        path = await tarball.get_compressed(source_id, source_tarball, compression)
+    except subprocess.CalledProcessError as exception:
+        message = "Error compressing the tarball"
+        raise HTTPException(status_code=500, detail=message) from exception
+    return await _file_response(request, source_id, path, compression, headers)
+
+
+@app.get("/manifest/{source_id}")
+async def _manifest(
+    request: Request,
+    source_id: str,
+    identity: Annotated[User | None, Depends(get_identity)],
+) -> ManifestResponse:
+    _, source_tarball = await _get_source_tarball(request, source_id, identity)
+    source_manifest = await tarball.get_manifest(source_id, source_tarball.version)
+    if source_manifest is None:
+        message = "Manifest not available"
+        raise HTTPException(status_code=404, detail=message)
+    return ManifestResponse(version=source_tarball.version, entries=source_manifest)
+
+
+@app.get("/delta/{source_id}")
+async def _delta(
+    request: Request,
+    source_id: str,
+    base: str,
+    identity: Annotated[User | None, Depends(get_identity)],
+    accept: Annotated[str | None, Header()] = None,
+) -> Response:
+    source, source_tarball = await _get_source_tarball(request, source_id, identity)
+    if not tarball.is_version(base):
+        message = f"Invalid base version {base}"
+        raise HTTPException(status_code=400, detail=message)
+    compression = _get_compression(accept)
+    headers = _version_headers(source_tarball, compression)
+    if base == source_tarball.version:
+        return Response(status_code=304, headers=headers)
+    path = await tarball.get_or_build_delta(source_id, source.get_path(), base, source_tarball, compression)
+    if path is None:
+        message = f"Unknown base version {base}"
+        raise HTTPException(status_code=404, detail=message)
+    return await _file_response(request, source_id, path, compression, headers)
+
+
+@app.post("/blocks/{source_id}")
+async def _blocks(
+    request: Request,
+    source_id: str,
+    payload: BlocksPayload,
+    identity: Annotated[User | None, Depends(get_identity)],
+) -> StreamingResponse:
+    source, source_tarball = await _get_source_tarball(request, source_id, identity)
+    if payload.version != source_tarball.version:
+        message = f"The current version is {source_tarball.version}"
+        raise HTTPException(status_code=409, detail=message)
+    source_manifest = await tarball.get_manifest(source_id, source_tarball.version)
+    entry = None if source_manifest is None else source_manifest.get(payload.path)
+    if entry is None or "blocks" not in entry:
+        message = f"No blocks for {payload.path}"
+        raise HTTPException(status_code=404, detail=message)
+    if any(index < 0 or index >= len(entry["blocks"]) for index in payload.blocks):
+        message = f"Invalid block indexes for {payload.path}"
+        raise HTTPException(status_code=400, detail=message)
+    return StreamingResponse(
+        # The path is safe, it comes from the manifest
+        blocks.stream(
+            pathlib.Path(source.get_path() / payload.path),
+            entry["size"],
+            config.settings.tarball.block_size,
+            payload.blocks,
+        ),
+        media_type="application/octet-stream",
+        headers=_version_headers(source_tarball),
+    )
+
 
-    return StreamingResponse(tarball_generator(), media_type="application/x-gtar")
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    return any(value.strip().removeprefix("W/") == etag for value in if_none_match.split(","))
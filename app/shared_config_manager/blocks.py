@@ -0,0 +1,156 @@
+# Copyright (c) 2026, Camptocamp SA
+"""
+Block level transfer of the large files.
+
+The new version of a file is split in fixed size blocks, each one identified by a weak rolling checksum
+(Adler-32) and a strong hash, computed once by the master in the manifest. The slave looks for these blocks
+at any offset of its old copy by rolling the weak checksum over it, like zsync, and fetches only the blocks it
+didn't find. That way an insertion or a deletion only costs the blocks around it.
+
+The blocks at their offset in the new version, the common case of a file modified in place, are first
+compared directly, at the speed of the hash functions, and the rolling jumps over them.
+
+To bound the CPU spent on the heavily changed files, a run of offsets without any matching block is rolled
+over two blocks (enough to find the next unchanged block after a change smaller than a block), then some
+blocks of offsets are skipped. After a change, the following unchanged blocks are found at every block size,
+so at most the skipped blocks are fetched again. The number of rolled offsets by file is also limited, past it
+the remaining blocks are fetched.
+"""
+
+import bisect
+import hashlib
+import mmap
+import zlib
+from typing import TYPE_CHECKING, BinaryIO
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from pathlib import Path
+
+# Modulo of the Adler-32 checksum
+_ADLER_MOD = 65521
+# Number of blocks of offsets rolled without any match before skipping some
+_ROLLED_BLOCKS = 2
+# Number of blocks of offsets skipped after the rolled ones
+_SKIPPED_BLOCKS = 4
+# Maximum number of offsets rolled by file (in pure Python)
+_MAX_ROLLED_OFFSETS = 1024 * 1024
+
+
+def block_hash(block: bytes) -> str:
+    """Get the signature of a block: its weak checksum followed by its strong hash."""
+    return f"{zlib.adler32(block):08x}{hashlib.blake2b(block, digest_size=16).hexdigest()}"
+
+
+def signatures(file: BinaryIO, block_size: int) -> list[str]:
+    """Get the signatures of all the blocks of a file (blocking)."""
+    result = []
+    while block := file.read(block_size):
+        result.append(block_hash(block))
+    return result
+
+
+def block_length(size: int, block_size: int, index: int) -> int:
+    """Get the length of a block of a file."""
+    return min(block_size, size - index * block_size)
+
+
+def match(old_path: Path, size: int, block_size: int, new_signatures: list[str]) -> list[int]:
+    """
+    Find the blocks of the new version of a file in an old copy (blocking).
+
+    Returns for each block its offset in the old copy, or -1 if it's missing.
+    """
+    offsets = [-1] * len(new_signatures)
+    if not old_path.is_file() or old_path.is_symlink():
+        return offsets
+    old_size = old_path.stat().st_size
+    if old_size == 0 or not new_signatures:
+        return offsets
+    # The full blocks by weak checksum
+    weak_blocks: dict[int, list[int]] = {}
+    for index, signature in enumerate(new_signatures):
+        if block_length(size, block_size, index) == block_size:
+            weak_blocks.setdefault(int(signature[:8], 16), []).append(index)
+
+    with old_path.open("rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        # The last block can be shorter, it's looked for at the end of the old copy
+        last = len(new_signatures) - 1
+        last_length = block_length(size, block_size, last)
+        if (
+            last_length < block_size
+            and old_size >= last_length
+            and block_hash(data[old_size - last_length :]) == new_signatures[last]
+        ):
+            offsets[last] = old_size - last_length
+
+        # The blocks at their own offset
+        matched: list[int] = []
+        for index, signature in enumerate(new_signatures):
+            offset = index * block_size
+            if offset + block_size > old_size:
+                break
+            block = data[offset : offset + block_size]
+            if block_length(size, block_size, index) == block_size and block_hash(block) == signature:
+                offsets[index] = offset
+                matched.append(offset)
+                _remove(weak_blocks, signature, index)
+        # The other blocks with the same content
+        offsets_by_signature = {new_signatures[offset // block_size]: offset for offset in matched}
+        for index, signature in enumerate(new_signatures):
+            if offsets[index] < 0 and signature in offsets_by_signature:
+                offsets[index] = offsets_by_signature[signature]
+                _remove(weak_blocks, signature, index)
+
+        budget = _MAX_ROLLED_OFFSETS
+        offset = 0
+        while weak_blocks and budget > 0 and offset + block_size <= old_size:
+            next_matched = bisect.bisect_left(matched, offset)
+            if next_matched < len(matched) and matched[next_matched] == offset:
+                offset += block_size
+                continue
+            checksum = zlib.adler32(data[offset : offset + block_size])
+            weak_sum, weak_sum2 = checksum & 0xFFFF, checksum >> 16
+            start = offset
+            end = min(offset + _ROLLED_BLOCKS * block_size, old_size - block_size + 1, offset + budget)
+            if next_matched < len(matched):
+                end = min(end, matched[next_matched])
+            while True:
+                indexes = weak_blocks.get(weak_sum | weak_sum2 << 16)
+                if indexes is not None:
+                    signature = block_hash(data[offset : offset + block_size])
+                    found = [index for index in indexes if new_signatures[index] == signature]
+                    if found:
+                        for index in found:
+                            offsets[index] = offset
+                            _remove(weak_blocks, signature, index)
+                        budget -= offset - start
+                        offset += block_size
+                        break
+                offset += 1
+                if offset >= end:
+                    budget -= offset - start
+                    if next_matched >= len(matched) or offset != matched[next_matched]:
+                        offset += _SKIPPED_BLOCKS * block_size
+                    break
+                out_byte, in_byte = data[offset - 1], data[offset + block_size - 1]
+                weak_sum = (weak_sum - out_byte + in_byte) % _ADLER_MOD
+                weak_sum2 = (weak_sum2 - block_size * out_byte + weak_sum - 1) % _ADLER_MOD
+    return offsets
+
+
+def _remove(weak_blocks: dict[int, list[int]], signature: str, index: int) -> None:
+    weak = int(signature[:8], 16)
+    indexes = weak_blocks.get(weak, [])
+    if index in indexes:
+        indexes.remove(index)
+        if not indexes:
+            del weak_blocks[weak]
+
+
+def stream(path: Path, size: int, block_size: int, indexes: list[int]) -> Iterator[bytes]:
+    """Stream the given blocks of a file (blocking)."""
+    with path.open("rb") as file:
+        for index in indexes:
+            file.seek(index * block_size)
+            yield file.read(block_length(size, block_size, index))
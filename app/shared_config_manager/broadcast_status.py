@@ -13,6 +13,7 @@ class SourceStatus(BaseModel):
     filtered: bool | None = None
     template_engines: list[configuration.TemplateEnginesStatus] = []
     hash: str | None = None
+    tree: str | None = None
     auth: AuthConfig | None = None
     branch: str | None = None
     repo: str | None = None
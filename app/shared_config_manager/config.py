@@ -2,7 +2,8 @@
 """The configuration environment variables."""
 
 import logging
-from typing import Annotated
+import tempfile
+from typing import Annotated, Literal
 
 from anyio import Path
 from pydantic import BaseModel, ConfigDict, field_validator, model_validator
@@ -42,6 +43,17 @@ class SlaveSettings(BaseModel):
     """Filter sources by tag on slave nodes. Only sources with this tag will be synced."""
     requests_timeout: float = 30
     """Timeout in seconds for HTTP requests made by the shared config manager."""
+    idle_timeout: float = 60
+    """Timeout in seconds without receiving data, for the streamed downloads from the master."""
+    buffer_size: int = 4 * 1024 * 1024
+    """Size in bytes of the buffer between the network and the extraction of the downloads."""
+    generations: int = 0
+    """
+    Number of previous generations kept for the rollback, 0 to disable the generations.
+
+    With the generations, each fetch lands in a new directory, published by atomically replacing the
+    target directory by a symbolic link.
+    """
 
     @field_validator("api_base_url")
     @classmethod
@@ -65,17 +77,135 @@ class SlaveSettings(BaseModel):
         return self
 
 
+class TarballSettings(BaseModel):
+    """Tarball related settings."""
+
+    model_config = ConfigDict(validate_assignment=True, arbitrary_types_allowed=True)
+
+    cache_dir: _AnyioPath = Path(tempfile.gettempdir()) / "tarballs"
+    """Directory where the master stores the prebuilt tarballs of the sources."""
+    cache_max_size: int = 1024 * 1024 * 1024
+    """Maximum size in bytes of the tarball cache, the oldest versions are evicted first."""
+    block_size: int = 128 * 1024
+    """Size in bytes of the blocks used to transfer the large files."""
+    block_threshold: int = 16 * 1024 * 1024
+    """Size in bytes above which a changed file is transferred by blocks."""
+    zstd_level: int = 3
+    """Compression level of the zstd tarballs, from 1 to 19."""
+    threads: int = 0
+    """Number of threads used to compress the tarballs, 0 for the number of available cores."""
+
+
+class CommandSettings(BaseModel):
+    """External commands related settings."""
+
+    model_config = ConfigDict(validate_assignment=True)
+
+    concurrency: int = 8
+    """Maximum number of external commands (git, rsync, rclone, tar, ...) running concurrently."""
+    timeout: float = 600
+    """Default timeout in seconds of the external commands."""
+    max_output_size: int = 1024 * 1024
+    """Maximum size in bytes of the captured output of a command, only the end is kept."""
+
+    @field_validator("concurrency")
+    @classmethod
+    def validate_concurrency(cls, value: int) -> int:
+        if value < 1:
+            return 1
+        return value
+
+
+class TemplateSettings(BaseModel):
+    """Template engines related settings."""
+
+    model_config = ConfigDict(validate_assignment=True, arbitrary_types_allowed=True)
+
+    module_dir: _AnyioPath | None = Path(tempfile.gettempdir()) / "mako_modules"
+    """
+    Directory where the compiled Mako templates are cached, reused across the refreshes and the restarts,
+    None to compile the templates on each evaluation.
+    """
+    processes: int = 0
+    """Number of processes rendering the Mako templates, 0 for the number of available cores."""
+
+    @field_validator("processes")
+    @classmethod
+    def validate_processes(cls, value: int) -> int:
+        if value < 0:
+            return 0
+        return value
+
+
+class SchedulerSettings(BaseModel):
+    """Refresh scheduler related settings."""
+
+    model_config = ConfigDict(validate_assignment=True)
+
+    network_concurrency: int = 4
+    """Maximum number of network stages (fetches, downloads) running concurrently."""
+    disk_concurrency: int = 4
+    """Maximum number of disk stages (checkouts, copies) running concurrently."""
+    cpu_concurrency: int = 0
+    """
+    Maximum number of CPU stages (template evaluations, tarball builds) running concurrently, 0 for the
+    number of available cores.
+    """
+
+    @field_validator("network_concurrency", "disk_concurrency")
+    @classmethod
+    def validate_concurrency(cls, value: int) -> int:
+        if value < 1:
+            return 1
+        return value
+
+    @field_validator("cpu_concurrency")
+    @classmethod
+    def validate_cpu_concurrency(cls, value: int) -> int:
+        if value < 0:
+            return 0
+        return value
+
+
 class Settings(BaseSettings, extra="ignore"):
     """The configuration settings."""
 
     slave: SlaveSettings = SlaveSettings()
     """Group containing all slave related configuration."""
+    tarball: TarballSettings = TarballSettings()
+    """Group containing all tarball related configuration."""
+    command: CommandSettings = CommandSettings()
+    """Group containing all external commands related configuration."""
+    template: TemplateSettings = TemplateSettings()
+    """Group containing all template engines related configuration."""
+    scheduler: SchedulerSettings = SchedulerSettings()
+    """Group containing all refresh scheduler related configuration."""
+    copy_mode: Literal["copy", "reflink", "hardlink"] = "reflink"
+    """
+    How the changed files of the local sources are copied to the target directory, "reflink" clones them on
+    the filesystems supporting it, "hardlink" also falls back to hard links, both fall back to a plain copy.
+    """
+    index_dir: _AnyioPath = Path(tempfile.gettempdir()) / "indexes"
+    """
+    Writable directory where the indexes of the files copied to the target directories and the render caches
+    of the templates are kept.
+    """
     secret: str | None = None
     """Shared secret for internal authentication between master and slave nodes."""
     master_target: _AnyioPath = Path("/master_config")
     """Target directory where configuration is deployed on the master node."""
     watch_source_interval: int = 600
     """Interval in seconds to check and refresh source configurations."""
+    refresh_debounce: float = 1
+    """
+    Delay in seconds before a refresh triggered by a webhook, the refresh requests of a source received during
+    this delay or during a running refresh are collapsed in one refresh.
+    """
+    git_poll_interval: int = 0
+    """
+    Interval in seconds to poll the heads of the git repositories (with one `git ls-remote` per repository),
+    the sources are refreshed only if their branch moved, 0 to disable.
+    """
     api_master: bool = False
     """
     Whether this instance exposes the shared config manager API as the master node.
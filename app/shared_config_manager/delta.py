@@ -0,0 +1,204 @@
+# Copyright (c) 2026, Camptocamp SA
+"""Delta archives, containing only the changes between two versions of a source."""
+
+import io
+import json
+import os
+import shutil
+import stat
+import tarfile
+import uuid
+from pathlib import Path
+from typing import Any, BinaryIO
+
+DELTA_MEMBER = ".scm-delta.json"
+_GITSTATS = ".gitstats"
+_TARFILE_COMPRESSIONS = {"gzip": "gz", "zstd": "zst"}
+_CHUNK_SIZE = 64 * 1024
+
+
+def build(
+    root: Path,
+    dest: Path,
+    info: dict[str, Any],
+    changed: list[str],
+    compression: str = "gzip",
+    zstd_level: int = 3,
+    threads: int = 1,
+) -> None:
+    """
+    Build a delta archive (blocking).
+
+    The first member contains the given information, including the deleted paths, followed by the
+    added or changed entries.
+    """
+    changed = sorted(changed, key=lambda path: (path == _GITSTATS, path))
+    options: dict[str, Any] = {}
+    if compression == "zstd":
+        from compression.zstd import CompressionParameter  # noqa: PLC0415
+
+        options["options"] = {
+            CompressionParameter.compression_level: zstd_level,
+            CompressionParameter.nb_workers: threads,
+        }
+    with tarfile.open(
+        dest, f"w:{_TARFILE_COMPRESSIONS[compression]}", format=tarfile.GNU_FORMAT, **options
+    ) as tar:
+        content = json.dumps(info).encode("utf-8")
+        member = tarfile.TarInfo(DELTA_MEMBER)
+        member.size = len(content)
+        tar.addfile(member, io.BytesIO(content))
+        for path in changed:
+            member = tar.gettarinfo(root / path, arcname=path)
+            member.uid = member.gid = member.mtime = 0
+            member.uname = member.gname = ""
+            if member.isreg():
+                with (root / path).open("rb") as file:
+                    tar.addfile(member, file)
+            else:
+                tar.addfile(member)
+
+
+def read_info(archive: Path) -> dict[str, Any]:
+    """Read the information contained in the first member of a delta archive (blocking)."""
+    with tarfile.open(archive, "r:*") as tar:
+        return _read_info(tar, archive)
+
+
+def _read_info(tar: tarfile.TarFile, archive: Path) -> dict[str, Any]:
+    first = tar.next()
+    if first is None or first.name != DELTA_MEMBER:
+        message = f"The archive {archive} is not a delta"
+        raise ValueError(message)
+    info_file = tar.extractfile(first)
+    assert info_file is not None
+    info: dict[str, Any] = json.load(info_file)
+    return info
+
+
+def apply(archive: Path, dest: Path) -> dict[str, Any]:
+    """
+    Apply a delta archive on a directory (blocking).
+
+    The patched files should already be up to date. Returns the information contained in the first
+    member.
+    """
+    with tarfile.open(archive, "r:*") as tar:
+        info = _read_info(tar, archive)
+
+        for path in info["deleted"]:
+            _remove(dest / path)
+
+        for member in tar:
+            if member.name == DELTA_MEMBER:
+                continue
+            _apply_member(tar, member, dest)
+    return info
+
+
+def extract(
+    file: BinaryIO, dest: Path, compression: str = "gzip", keep: set[str] | None = None
+) -> dict[str, int]:
+    """
+    Extract a full archive from a stream on a directory, differentially (blocking).
+
+    Only the changed entries are written, the unchanged files keep their inode and mtime, and the entries
+    missing in the archive are deleted, except the kept paths (relative). Returns the number of written,
+    unchanged and deleted entries.
+    """
+    stats = {"written": 0, "unchanged": 0, "deleted": 0}
+    paths: set[Path] = set()
+    kept_paths = {Path(path) for path in keep or set()}
+    # The parent directories of the kept paths
+    kept_dirs = {parent for path in kept_paths for parent in path.parents}
+    dest.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(fileobj=file, mode=f"r|{_TARFILE_COMPRESSIONS[compression]}") as tar:
+        for member in tar:
+            path = Path(member.name)
+            paths.add(path)
+            paths.update(path.parents)
+            stats["written" if _apply_member(tar, member, dest) else "unchanged"] += 1
+
+    for dirpath, dirnames, filenames in os.walk(dest):
+        for name in [*dirnames, *filenames]:
+            full_path = Path(dirpath) / name
+            relative = full_path.relative_to(dest)
+            if relative in paths or relative in kept_paths or relative in kept_dirs:
+                continue
+            _remove(full_path)
+            stats["deleted"] += 1
+            if name in dirnames:
+                dirnames.remove(name)
+    return stats
+
+
+def _apply_member(tar: tarfile.TarFile, member: tarfile.TarInfo, dest: Path) -> bool:
+    """Apply an archive member on a directory, returns False if it was already up to date."""
+    member = _filter(member, str(dest))
+    target = dest / member.name
+    if member.isdir():
+        if target.is_dir() and not target.is_symlink():
+            return False
+        _remove(target)
+        target.mkdir(parents=True)
+        return True
+    if member.isreg():
+        source = tar.extractfile(member)
+        assert source is not None
+        target.parent.mkdir(parents=True, exist_ok=True)
+        return _update_file(source, target, member.size, member.mode)
+    if member.issym() and target.is_symlink() and str(target.readlink()) == member.linkname:
+        return False
+    if member.islnk() and target.exists() and target.samefile(dest / member.linkname):
+        return False
+    _remove(target)
+    tar.extract(member, dest, filter=_filter)
+    return True
+
+
+def _update_file(source: BinaryIO, target: Path, size: int, mode: int | None) -> bool:
+    """Write the file only if its content or mode changed, returns False if it was already up to date."""
+    same_length = 0
+    chunk = b""
+    if not target.is_symlink() and target.is_file() and target.stat().st_size == size:
+        with target.open("rb") as current:
+            while chunk := source.read(_CHUNK_SIZE):
+                if current.read(len(chunk)) != chunk:
+                    break
+                same_length += len(chunk)
+            else:
+                if mode is None or stat.S_IMODE(target.stat().st_mode) == mode:
+                    return False
+
+    # Written next to the target and renamed, to never expose a partial file, and never modified in place,
+    # it can be shared (hard linked) with another generation
+    tmp_path = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with tmp_path.open("wb") as new:
+            if same_length:
+                # Copy the identical beginning from the current file
+                with target.open("rb") as current:
+                    while same_length:
+                        same_length -= new.write(current.read(min(same_length, _CHUNK_SIZE)))
+            new.write(chunk)
+            shutil.copyfileobj(source, new, _CHUNK_SIZE)
+        if mode is not None:
+            tmp_path.chmod(mode)
+        if target.is_dir() and not target.is_symlink():
+            _remove(target)
+        tmp_path.replace(target)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return True
+
+
+def _filter(member: tarfile.TarInfo, path: str) -> tarfile.TarInfo:
+    # Same as tar --no-same-owner --no-same-permissions --touch
+    return tarfile.data_filter(member, path).replace(mtime=None, deep=False)
+
+
+def _remove(path: Path) -> None:
+    if path.is_symlink() or path.is_file():
+        path.unlink()
+    elif path.is_dir():
+        shutil.rmtree(path)
@@ -0,0 +1,171 @@
+# Copyright (c) 2026, Camptocamp SA
+"""
+Generations of the content of a source on the slaves.
+
+The target path of the source is a symbolic link to the current generation directory. A new generation
+is prepared next to the current one, sharing the unchanged files with hard links, and published by
+atomically replacing the symbolic link. The previous generations are kept for a rollback.
+"""
+
+import asyncio
+import ctypes
+import errno
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path as SyncPath
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from anyio import Path
+
+_LOG = logging.getLogger(__name__)
+_WIDTH = 6
+# For renameat2
+_AT_FDCWD = -100
+_RENAME_EXCHANGE = 2
+
+
+def get_dir(path: Path) -> Path:
+    """Get the directory containing the generations of a target path."""
+    return path.parent / f".{path.name}.generations"
+
+
+async def get_names(path: Path) -> list[str]:
+    """Get the names of the generations, oldest first."""
+    generations_dir = get_dir(path)
+    if not await generations_dir.is_dir():
+        return []
+    return sorted([child.name async for child in generations_dir.iterdir() if child.name.isdigit()])
+
+
+async def get_current(path: Path) -> str | None:
+    """Get the name of the published generation."""
+    if not await path.is_symlink():
+        return None
+    return (await path.readlink()).name
+
+
+async def create(path: Path) -> Path:
+    """
+    Create a new generation, with hard links to the files of the current content.
+
+    The files of the generations are only replaced, never written in place.
+    """
+    generations_dir = get_dir(path)
+    await generations_dir.mkdir(parents=True, exist_ok=True)
+    if await path.is_dir() and not await path.is_symlink():
+        await _migrate(path)
+
+    names = await get_names(path)
+    generation = generations_dir / f"{int(names[-1]) + 1 if names else 1:0{_WIDTH}}"
+    if await path.is_dir():
+        await asyncio.to_thread(_link_tree, SyncPath(path), SyncPath(generation))
+    else:
+        await generation.mkdir()
+    return generation
+
+
+async def publish(path: Path, generation: Path) -> None:
+    """Publish a generation by atomically replacing the symbolic link."""
+    tmp_link = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    await tmp_link.symlink_to(generation.relative_to(path.parent))
+    try:
+        await tmp_link.rename(path)
+    except BaseException:
+        await tmp_link.unlink(missing_ok=True)
+        raise
+    _LOG.info("Published the generation %s on %s", generation.name, path)
+
+
+async def _migrate(path: Path) -> None:
+    """
+    Migrate a content extracted in place, it becomes the first generation.
+
+    The directory is exchanged with the symbolic link in one step, that way the path always exists.
+    """
+    first = get_dir(path) / f"{0:0{_WIDTH}}"
+    if await first.exists():
+        # Left by an interrupted migration
+        await asyncio.to_thread(shutil.rmtree, first)
+    await asyncio.to_thread(_link_tree, SyncPath(path), SyncPath(first))
+    tmp_link = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    await tmp_link.symlink_to(first.relative_to(path.parent))
+    try:
+        await asyncio.to_thread(_exchange, SyncPath(tmp_link), SyncPath(path))
+    except OSError as exception:
+        if exception.errno not in (errno.EINVAL, errno.ENOSYS):
+            await tmp_link.unlink(missing_ok=True)
+            raise
+        # Not supported by the file system, the path is missing between the two renames
+        _LOG.warning("Cannot exchange %s atomically: %s", path, exception)
+        await tmp_link.unlink()
+        await path.rename(tmp_link)
+        await publish(path, first)
+    await asyncio.to_thread(shutil.rmtree, tmp_link)
+    _LOG.info("Migrated %s to the generation %s", path, first.name)
+
+
+async def prune(path: Path, keep: int) -> None:
+    """Delete the oldest generations, keeping the given number of generations besides the published one."""
+    current = await get_current(path)
+    old_names = [name for name in await get_names(path) if name != current]
+    for name in old_names[: max(len(old_names) - keep, 0)]:
+        _LOG.debug("Deleting the generation %s of %s", name, path)
+        await asyncio.to_thread(shutil.rmtree, get_dir(path) / name)
+
+
+async def rollback(path: Path, name: str | None = None) -> str:
+    """Publish a kept generation, by default the one preceding the published one."""
+    names = await get_names(path)
+    current = await get_current(path)
+    if name is None:
+        previous = [other for other in names if current is None or other < current]
+        if not previous:
+            message = f"No generation to roll back to for {path}"
+            raise ValueError(message)
+        name = previous[-1]
+    elif name not in names:
+        message = f"Unknown generation {name} for {path}"
+        raise ValueError(message)
+    await publish(path, get_dir(path) / name)
+    return name
+
+
+async def delete(path: Path) -> None:
+    """Delete the symbolic link and all the generations."""
+    if await path.is_symlink():
+        await path.unlink()
+    generations_dir = get_dir(path)
+    if await generations_dir.is_dir():
+        await asyncio.to_thread(shutil.rmtree, generations_dir)
+
+
+def _link_tree(src: SyncPath, dest: SyncPath) -> None:
+    dest.mkdir()
+    for dirpath, dirnames, filenames in os.walk(src):
+        relative_dir = SyncPath(dirpath).relative_to(src)
+        for name in dirnames:
+            relative = relative_dir / name
+            if (src / relative).is_symlink():
+                # Not followed by os.walk
+                (dest / relative).symlink_to((src / relative).readlink())
+            else:
+                (dest / relative).mkdir()
+        for name in filenames:
+            relative = relative_dir / name
+            if (src / relative).is_symlink():
+                (dest / relative).symlink_to((src / relative).readlink())
+            else:
+                (dest / relative).hardlink_to(src / relative)
+
+
+def _exchange(first: SyncPath, second: SyncPath) -> None:
+    """Exchange two paths atomically (Linux)."""
+    renameat2 = getattr(ctypes.CDLL(None, use_errno=True), "renameat2", None)
+    if renameat2 is None:
+        raise OSError(errno.ENOSYS, "renameat2 is not available", str(first), None, str(second))
+    if renameat2(_AT_FDCWD, os.fsencode(first), _AT_FDCWD, os.fsencode(second), _RENAME_EXCHANGE) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error), str(first), None, str(second))
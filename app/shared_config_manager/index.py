@@ -0,0 +1,305 @@
+# Copyright (c) 2026, Camptocamp SA
+"""
+Persistent index of the files copied from a source to its target directory.
+
+For each copied file, the index contains the state (size, mtime, inode) of the source file, its git object
+id when known, the state of the copied file and the hash of its content. That way the copy decides what
+changed from the metadata, without reading the unchanged files, and the hashes can be reused to build the
+manifest.
+"""
+
+import errno
+import fcntl
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Literal, TypedDict
+
+from shared_config_manager import config
+
+_LOG = logging.getLogger(__name__)
+# Errors of the reflinks and hard links meaning that they are not supported between the two paths
+_UNSUPPORTED_ERRNOS = {errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EPERM, errno.EMLINK}
+
+CopyMode = Literal["copy", "reflink", "hardlink"]
+
+
+class Entry(TypedDict, total=False):
+    """An entry of the index."""
+
+    # Size, mtime (ns) and inode of the source file
+    source: list[int]
+    # Git object id of the source file
+    oid: str
+    # Size, mtime (ns) and inode of the copied file
+    target: list[int]
+    # sha256 of the content
+    hash: str
+
+
+Index = dict[str, Entry]
+
+
+@dataclass
+class Changes:
+    """The changes done by a copy."""
+
+    changed: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+
+
+def get_path(source_id: str) -> Path:
+    """Get the path of the index of the target directory of a source, in the writable index directory."""
+    return Path(config.settings.index_dir) / f"{source_id}.json"
+
+
+def read(path: Path) -> Index:
+    """Read an index (blocking)."""
+    if not path.is_file():
+        return {}
+    try:
+        with path.open(encoding="utf-8") as file:
+            index: Index = json.load(file)
+            return index
+    except ValueError:
+        _LOG.warning("Ignoring the corrupted index %s", path)
+        return {}
+
+
+def write(path: Path, index: Index) -> None:
+    """Write an index (blocking)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with tmp_path.open("w", encoding="utf-8") as file:
+            json.dump(index, file)
+        tmp_path.replace(path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def delete(path: Path) -> None:
+    """Delete an index (blocking)."""
+    path.unlink(missing_ok=True)
+
+
+def get_hashes(path: Path) -> dict[str, tuple[list[int], str]]:
+    """Get the known hashes of the copied files of an index, with the state of the file (blocking)."""
+    return {
+        file_path: (entry["target"], entry["hash"])
+        for file_path, entry in read(path).items()
+        if "hash" in entry
+    }
+
+
+def copy(
+    source: Path,
+    target: Path,
+    index_path: Path,
+    excludes: list[str],
+    oids: dict[str, str] | None = None,
+    mode: CopyMode = "copy",
+) -> Changes:
+    """
+    Copy a directory, like `rsync --recursive --links --delete --checksum` (blocking).
+
+    The unchanged files (from the index and the git object ids) are not read, the changed files are written
+    next to the target and renamed. The excluded paths (rsync like patterns) are neither copied nor deleted.
+
+    With the "reflink" mode the files are cloned, sharing their data until one of them is written, and with
+    the "hardlink" mode they can also be hard linked: the files of the target must then only be replaced,
+    never written in place.
+    """
+    old_index = read(index_path)
+    index: Index = {}
+    changes = Changes()
+    seen: set[str] = set()
+    target.mkdir(parents=True, exist_ok=True)
+
+    for dirpath, dirnames, filenames in os.walk(source):
+        relative_dir = Path(dirpath).relative_to(source)
+        for name in list(dirnames):
+            path = (relative_dir / name).as_posix()
+            if is_excluded(path, excludes, is_dir=True):
+                dirnames.remove(name)
+                continue
+            seen.add(path)
+            if (source / path).is_symlink():
+                # Not followed by os.walk
+                if _copy_link(source / path, target / path):
+                    changes.changed.append(path)
+            elif not (target / path).is_dir() or (target / path).is_symlink():
+                _remove(target / path)
+                (target / path).mkdir()
+                changes.changed.append(path)
+        for name in filenames:
+            path = (relative_dir / name).as_posix()
+            if is_excluded(path, excludes, is_dir=False):
+                continue
+            seen.add(path)
+            source_stat = (source / path).lstat()
+            if stat.S_ISLNK(source_stat.st_mode):
+                if _copy_link(source / path, target / path):
+                    changes.changed.append(path)
+            elif stat.S_ISREG(source_stat.st_mode):
+                entry, changed = _copy_file(
+                    source / path,
+                    target / path,
+                    source_stat,
+                    old_index.get(path),
+                    None if oids is None else oids.get(path),
+                    mode,
+                )
+                index[path] = entry
+                if changed:
+                    changes.changed.append(path)
+            else:
+                _LOG.warning("Ignoring the special file %s", source / path)
+
+    for dirpath, dirnames, filenames in os.walk(target):
+        relative_dir = Path(dirpath).relative_to(target)
+        for name in [*dirnames, *filenames]:
+            path = (relative_dir / name).as_posix()
+            is_dir = name in dirnames
+            if path in seen:
+                continue
+            if is_dir:
+                dirnames.remove(name)
+            if not is_excluded(path, excludes, is_dir=is_dir):
+                _remove(target / path)
+                changes.deleted.append(path)
+
+    write(index_path, index)
+    return changes
+
+
+def _copy_file(
+    source: Path,
+    target: Path,
+    source_stat: os.stat_result,
+    old: Entry | None,
+    oid: str | None,
+    mode: CopyMode,
+) -> tuple[Entry, bool]:
+    """Copy a file if it changed, returns the new entry and if the file was written."""
+    source_state = [source_stat.st_size, source_stat.st_mtime_ns, source_stat.st_ino]
+    target_state = _state(target)
+    target_ok = old is not None and target_state is not None and old.get("target") == target_state
+    entry: Entry = {"source": source_state}
+    if oid is not None:
+        entry["oid"] = oid
+    if (
+        old is not None
+        and target_ok
+        and ((oid is not None and old.get("oid") == oid) or old.get("source") == source_state)
+    ):
+        return {**old, **entry}, False
+
+    hash_ = _hash(source)
+    if target_state is not None and target_state[0] == source_state[0]:
+        target_hash = old.get("hash") if old is not None and target_ok else _hash(target)
+        if target_hash == hash_:
+            # Only the metadata changed
+            return {**entry, "target": target_state, "hash": hash_}, False
+
+    tmp_path = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        _materialize(source, tmp_path, mode)
+        if target.is_dir() and not target.is_symlink():
+            _remove(target)
+        tmp_path.replace(target)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    new_state = _state(target)
+    assert new_state is not None
+    return {**entry, "target": new_state, "hash": hash_}, True
+
+
+def _materialize(source: Path, dest: Path, mode: CopyMode) -> None:
+    """Create the destination file with the content of the source, as cheaply as the mode allows."""
+    if mode != "copy":
+        if _reflink(source, dest):
+            shutil.copymode(source, dest)
+            return
+        if mode == "hardlink":
+            try:
+                dest.hardlink_to(source)
+            except OSError as error:
+                if error.errno not in _UNSUPPORTED_ERRNOS:
+                    raise
+            else:
+                return
+    shutil.copyfile(source, dest)
+    shutil.copymode(source, dest)
+
+
+def _reflink(source: Path, dest: Path) -> bool:
+    """Clone the file with the FICLONE ioctl, returns False if not supported."""
+    with source.open("rb") as source_file, dest.open("wb") as dest_file:
+        try:
+            fcntl.ioctl(dest_file.fileno(), fcntl.FICLONE, source_file.fileno())
+        except OSError as error:
+            if error.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+        else:
+            return True
+    dest.unlink()
+    return False
+
+
+def _hash(path: Path) -> str:
+    with path.open("rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+
+def _copy_link(source: Path, target: Path) -> bool:
+    link = source.readlink()
+    if target.is_symlink() and target.readlink() == link:
+        return False
+    _remove(target)
+    target.symlink_to(link)
+    return True
+
+
+def _state(path: Path) -> list[int] | None:
+    try:
+        path_stat = path.lstat()
+    except FileNotFoundError:
+        return None
+    if not stat.S_ISREG(path_stat.st_mode):
+        return None
+    return [path_stat.st_size, path_stat.st_mtime_ns, path_stat.st_ino]
+
+
+def is_excluded(path: str, excludes: list[str], *, is_dir: bool) -> bool:
+    """Check if a path matches one of the rsync like exclude patterns."""
+    for exclude in excludes:
+        if exclude.endswith("/") and not is_dir:
+            continue
+        pattern = exclude.rstrip("/")
+        if pattern.startswith("/"):
+            # Anchored to the root
+            if fnmatch.fnmatchcase(path, pattern[1:]):
+                return True
+        elif "/" in pattern:
+            # Matches the end of the path
+            if fnmatch.fnmatchcase(path, pattern) or fnmatch.fnmatchcase(path, f"*/{pattern}"):
+                return True
+        elif fnmatch.fnmatchcase(path.rsplit("/", 1)[-1], pattern):
+            return True
+    return False
+
+
+def _remove(path: Path) -> None:
+    if path.is_symlink() or path.is_file():
+        path.unlink()
+    elif path.is_dir():
+        shutil.rmtree(path)
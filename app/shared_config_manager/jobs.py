@@ -0,0 +1,111 @@
+# Copyright (c) 2026, Camptocamp SA
+"""
+The refresh jobs of the API, running in the background.
+
+A job refreshes some sources, its status and the phase of each source can be polled until it's finished.
+The jobs are kept in memory, the oldest finished ones are evicted.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from typing import TYPE_CHECKING, Literal
+
+from shared_config_manager import scheduler
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+_LOG = logging.getLogger(__name__)
+_MAX_JOBS = 1000
+
+type Status = Literal["running", "done", "error"]
+
+
+class Job:
+    """
+    A background refresh of some sources.
+
+    The function refreshing a source returns None if it was refreshed, or the reason why it was ignored.
+    """
+
+    def __init__(self, source_ids: list[str], function: Callable[[str], Awaitable[str | None]]) -> None:
+        self.id = uuid.uuid4().hex
+        self.source_ids = source_ids
+        self.created = time.time()
+        self.finished: float | None = None
+        self.refreshed: set[str] = set()
+        self.ignored: dict[str, str] = {}
+        self.errors: dict[str, Exception] = {}
+        # Not cancelled with the request
+        self.task = asyncio.create_task(self._run(function))
+
+    async def _run(self, function: Callable[[str], Awaitable[str | None]]) -> None:
+        async def refresh(source_id: str) -> None:
+            try:
+                reason = await function(source_id)
+            except Exception as exception:  # noqa: BLE001
+                # Reported by the job status, the refreshes of the other sources go on
+                _LOG.error("Error refreshing source %s", source_id, exc_info=exception)
+                self.errors[source_id] = exception
+                return
+            if reason is None:
+                self.refreshed.add(source_id)
+            else:
+                self.ignored[source_id] = reason
+
+        try:
+            await asyncio.gather(*[refresh(source_id) for source_id in self.source_ids])
+        finally:
+            self.finished = time.time()
+
+    def get_status(self) -> Status:
+        if self.finished is None:
+            return "running"
+        return "error" if self.errors else "done"
+
+    def get_duration(self) -> float:
+        """Get the duration in seconds, until now if it's running."""
+        return (self.finished or time.time()) - self.created
+
+    def get_phases(self) -> dict[str, str]:
+        """Get the phase of each source, 'pending' before its refresh is scheduled (e.g. debounced)."""
+        phases = {}
+        for source_id in self.source_ids:
+            if source_id in self.errors:
+                phases[source_id] = "error"
+            elif source_id in self.ignored:
+                phases[source_id] = "ignored"
+            elif source_id in self.refreshed:
+                phases[source_id] = "refreshed"
+            else:
+                phases[source_id] = scheduler.get_phase(source_id) or "pending"
+        return phases
+
+    async def wait(self, max_duration: float) -> bool:
+        """Wait for the end of the job, up to the given number of seconds, returns False on timeout."""
+        if max_duration > 0:
+            await asyncio.wait([self.task], timeout=max_duration)
+        return self.task.done()
+
+
+_JOBS: dict[str, Job] = {}
+
+
+def start(source_ids: list[str], function: Callable[[str], Awaitable[str | None]]) -> Job:
+    """Start a job refreshing the sources with the function."""
+    job = Job(source_ids, function)
+    _JOBS[job.id] = job
+    if len(_JOBS) > _MAX_JOBS:
+        # In creation order
+        for job_id in [job_id for job_id, job_ in _JOBS.items() if job_.finished is not None]:
+            del _JOBS[job_id]
+            if len(_JOBS) <= _MAX_JOBS:
+                break
+    return job
+
+
+def get(job_id: str) -> Job | None:
+    """Get a job by id."""
+    return _JOBS.get(job_id)
@@ -1,5 +1,6 @@
 # Copyright (c) 2026, Camptocamp SA
 import asyncio
+import functools
 import logging
 import os
 import re
@@ -14,17 +15,24 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.responses import RedirectResponse
-from prometheus_client import start_http_server
+from prometheus_client import Counter, start_http_server
 from prometheus_fastapi_instrumentator import Instrumentator
 
-from shared_config_manager import api, config, slave_status, ui
-from shared_config_manager.sources import base, registry
+from shared_config_manager import api, config, repositories, scheduler, slave_status, ui
+from shared_config_manager.sources import base, git, registry
+from shared_config_manager.template_engines import mako
 
 if TYPE_CHECKING:
     from collections.abc import AsyncGenerator
 
 _LOGGER = logging.getLogger(__name__)
 _WATCH_SOURCE_TASK: asyncio.Task[None] | None = None
+_POLL_GIT_SOURCES_TASK: asyncio.Task[None] | None = None
+_POLL_REFRESH_COUNTER = Counter(
+    "sharedconfigmanager_source_poll_refresh",
+    "Number of refreshes triggered by the poll of the git repositories",
+    ["source"],
+)
 
 
 async def _source_needs_refresh(source_id: str) -> bool:
@@ -69,8 +77,7 @@ async def _refresh_source_if_needed(key: str, source: base.BaseSource) -> None:
     if source.is_master():
         return
     if await _source_needs_refresh(key):
-        await source.refresh()
-        await broadcast.broadcast("slave_fetch", params={"source_id": key})
+        await registry.refresh_source(source, priority=scheduler.Priority.PERIODIC)
 
 
 async def _watch_source() -> None:
@@ -97,6 +104,61 @@ async def _watch_source() -> None:
         await asyncio.sleep(config.settings.watch_source_interval)
 
 
+async def _get_remote_heads(sources: list[git.GitSource]) -> dict[tuple[str, str], str]:
+    """Get the heads of the branches used by the sources, with one `git ls-remote` per repository."""
+    branches: dict[str, set[str]] = {}
+    for source in sources:
+        branches.setdefault(source.get_repo(), set()).add(source.get_branch())
+    urls = list(branches)
+    results = await asyncio.gather(
+        *[repositories.get_remote_heads(url, branches[url]) for url in urls], return_exceptions=True
+    )
+    heads: dict[tuple[str, str], str] = {}
+    for url, result in zip(urls, results, strict=True):
+        if isinstance(result, BaseException):
+            _LOGGER.warning("Error while polling the repository %s", url, exc_info=result)
+            continue
+        heads.update({(url, branch): hash_ for branch, hash_ in result.items()})
+    return heads
+
+
+async def _refresh_source_if_moved(
+    key: str, source: git.GitSource, heads: dict[tuple[str, str], str]
+) -> None:
+    """Refresh a git source if the head of its branch moved."""
+    head = heads.get((source.get_repo(), source.get_branch()))
+    if head is None or head == await source.get_commit():
+        return
+    _LOGGER.info("The branch of the source %s moved to %s -> refresh.", key, head)
+    if await registry.refresh_source(source, head, scheduler.Priority.PERIODIC):
+        _POLL_REFRESH_COUNTER.labels(key).inc()
+
+
+async def _poll_git_sources() -> None:
+    """Poll the git repositories, to refresh the sources even if a webhook was missed."""
+    while True:
+        await asyncio.sleep(config.settings.git_poll_interval)
+        _LOGGER.debug("Polling the git sources")
+        try:
+            sources = {
+                key: source
+                for key, source in registry.get_sources().items()
+                if isinstance(source, git.GitSource) and not source.is_master()
+            }
+            heads = await scheduler.run(
+                scheduler.Priority.PERIODIC, functools.partial(_get_remote_heads, list(sources.values()))
+            )
+            results = await asyncio.gather(
+                *[_refresh_source_if_moved(key, source, heads) for key, source in sources.items()],
+                return_exceptions=True,
+            )
+            for key, result in zip(sources, results, strict=True):
+                if isinstance(result, BaseException):
+                    _LOGGER.warning("Error while refreshing the polled source %s", key, exc_info=result)
+        except Exception:
+            _LOGGER.exception("Error while polling the git sources")
+
+
 # Initialize Sentry if the URL is provided
 if c2casgiutils.config.settings.sentry.dsn or "SENTRY_DSN" in os.environ:
     _LOGGER.info(
@@ -130,9 +192,14 @@ async def _lifespan(main_app: FastAPI) -> AsyncGenerator[None]:
 
     if not config.settings.slave.enabled:
         await registry.init(slave=False)
+        if config.settings.git_poll_interval > 0:
+            global _POLL_GIT_SOURCES_TASK  # noqa: PLW0603
+            _POLL_GIT_SOURCES_TASK = asyncio.create_task(_poll_git_sources())
 
     yield
 
+    await asyncio.to_thread(mako.shutdown)
+
 
 # Core Application Instance
 app = FastAPI(title="Shared config manager", lifespan=_lifespan)
@@ -196,6 +263,14 @@ app.add_middleware(
             },
             "status_code": 200,
         },
+        "api_tarball": {
+            # The tarballs can be stored by the proxies, but should be revalidated with the ETag
+            "path_match": rf"^{_route_prefix_regex_base}1/tarball/.*",
+            "headers": {
+                "Cache-Control": "max-age=0, no-cache",
+            },
+            "status_code": 200,
+        },
     },
 )
 
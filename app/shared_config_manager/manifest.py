@@ -0,0 +1,122 @@
+# Copyright (c) 2026, Camptocamp SA
+"""Manifest of the content of a source version."""
+
+import hashlib
+import json
+import os
+import stat
+from pathlib import Path
+from typing import TYPE_CHECKING, Literal, TypedDict
+
+from shared_config_manager import blocks
+
+if TYPE_CHECKING:
+    from collections.abc import Mapping
+
+
+class Entry(TypedDict, total=False):
+    """An entry of the manifest."""
+
+    type: Literal["file", "dir", "link"]
+    mode: int
+    size: int
+    # sha256 for the files, destination for the links
+    hash: str
+    # Signatures (weak checksum and strong hash) of the blocks, for the large files
+    blocks: list[str]
+
+
+Manifest = dict[str, Entry]
+
+
+def build(
+    root: Path,
+    block_size: int | None = None,
+    block_threshold: int = 0,
+    known_hashes: Mapping[str, tuple[list[int], str]] | None = None,
+    previous: Manifest | None = None,
+) -> Manifest:
+    """
+    Build the manifest of a directory (blocking).
+
+    If a block size is given, the signatures of the blocks of the files larger than the threshold are
+    also computed. The known hashes (e.g. from the copy index) are reused for the files with the same
+    size, mtime and inode, with the signatures of their blocks from the previous manifest.
+    """
+    known_hashes = known_hashes or {}
+    previous = previous or {}
+    manifest: Manifest = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            full_path = Path(dirpath) / name
+            path = full_path.relative_to(root).as_posix()
+            file_stat = full_path.lstat()
+            if stat.S_ISLNK(file_stat.st_mode):
+                manifest[path] = {"type": "link", "hash": str(full_path.readlink())}
+            elif stat.S_ISDIR(file_stat.st_mode):
+                manifest[path] = {"type": "dir", "mode": stat.S_IMODE(file_stat.st_mode)}
+            elif stat.S_ISREG(file_stat.st_mode):
+                entry: Entry = {
+                    "type": "file",
+                    "mode": stat.S_IMODE(file_stat.st_mode),
+                    "size": file_stat.st_size,
+                }
+                known = known_hashes.get(path)
+                with_blocks = block_size is not None and file_stat.st_size >= block_threshold
+                file_state = [file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino]
+                if known is not None and known[0] == file_state:
+                    previous_entry = previous.get(path, {})
+                    if not with_blocks:
+                        entry["hash"] = known[1]
+                        manifest[path] = entry
+                        continue
+                    assert block_size is not None
+                    previous_blocks = previous_entry.get("blocks", [])
+                    # Not with the blocks of another block size
+                    nb_blocks = -(-file_stat.st_size // block_size)
+                    if previous_entry.get("hash") == known[1] and len(previous_blocks) == nb_blocks:
+                        entry["hash"] = known[1]
+                        entry["blocks"] = previous_blocks
+                        manifest[path] = entry
+                        continue
+                with full_path.open("rb") as file:
+                    if with_blocks:
+                        assert block_size is not None
+                        digest = hashlib.sha256()
+                        entry["blocks"] = []
+                        while block := file.read(block_size):
+                            digest.update(block)
+                            entry["blocks"].append(blocks.block_hash(block))
+                        entry["hash"] = digest.hexdigest()
+                    else:
+                        entry["hash"] = hashlib.file_digest(file, "sha256").hexdigest()
+                manifest[path] = entry
+    return dict(sorted(manifest.items()))
+
+
+def diff(base: Manifest, current: Manifest) -> tuple[list[str], list[str]]:
+    """
+    Get the differences between two manifests.
+
+    Returns the added or changed paths, and the deleted paths (without the content of the deleted
+    directories).
+    """
+    changed = [path for path, entry in current.items() if base.get(path) != entry]
+    deleted: list[str] = []
+    for path in sorted(set(base) - set(current)):
+        if not deleted or not path.startswith(deleted[-1] + "/"):
+            deleted.append(path)
+    return changed, deleted
+
+
+def write(manifest: Manifest, path: Path) -> None:
+    """Write a manifest (blocking)."""
+    with path.open("w", encoding="utf-8") as file:
+        json.dump(manifest, file)
+
+
+def read(path: Path) -> Manifest:
+    """Read a manifest (blocking)."""
+    with path.open(encoding="utf-8") as file:
+        manifest: Manifest = json.load(file)
+        return manifest
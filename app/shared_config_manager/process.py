@@ -0,0 +1,197 @@
+# Copyright (c) 2026, Camptocamp SA
+"""
+Non-blocking execution of the external commands.
+
+The commands run as asyncio subprocesses, with a global concurrency limit, a timeout and a bounded
+capture of their output. On timeout or cancellation the whole process group is killed.
+"""
+
+import asyncio
+import logging
+import os
+import shlex
+import signal
+import subprocess
+from typing import TYPE_CHECKING
+
+from prometheus_client import Gauge, Summary
+
+from shared_config_manager import config
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from anyio import Path
+
+_LOG = logging.getLogger(__name__)
+_COMMAND_SUMMARY = Summary("sharedconfigmanager_command", "Number of external commands", ["command"])
+_WAITING_GAUGE = Gauge(
+    "sharedconfigmanager_command_waiting", "Number of external commands waiting for a free slot"
+)
+
+_CHUNK_SIZE = 64 * 1024
+_SEMAPHORE: asyncio.Semaphore | None = None
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _SEMAPHORE  # noqa: PLW0603
+    if _SEMAPHORE is None:
+        _SEMAPHORE = asyncio.Semaphore(config.settings.command.concurrency)
+    return _SEMAPHORE
+
+
+async def run(
+    *args: str | os.PathLike[str],
+    cwd: str | Path | None = None,
+    input_: bytes | None = None,
+    max_duration: float | None = None,
+    max_output_size: int | None = None,
+) -> str:
+    """
+    Run a command and get its output (stdout and stderr), stripped.
+
+    Raises a `subprocess.CalledProcessError` if the command fails and a `subprocess.TimeoutExpired`
+    if it doesn't finish in time (`max_duration` in seconds, defaults to `SCM__COMMAND__TIMEOUT`).
+    Only the end of the output is kept (defaults to `SCM__COMMAND__MAX_OUTPUT_SIZE`).
+    """
+    return await run_pipeline(
+        args, cwd=cwd, input_=input_, max_duration=max_duration, max_output_size=max_output_size
+    )
+
+
+async def run_pipeline(
+    *commands: Sequence[str | os.PathLike[str]],
+    cwd: str | Path | None = None,
+    input_: bytes | None = None,
+    max_duration: float | None = None,
+    max_output_size: int | None = None,
+) -> str:
+    """
+    Run commands with the output of each one piped to the input of the next one, like `run`.
+
+    The pipeline takes one slot and the timeout applies to the whole pipeline. The output is the one of
+    the last command, with the errors (stderr) of the other ones.
+    """
+    commands_ = [[str(arg) for arg in args] for args in commands]
+    if max_duration is None:
+        max_duration = config.settings.command.timeout
+    if max_output_size is None:
+        max_output_size = config.settings.command.max_output_size
+    semaphore = _get_semaphore()
+    _WAITING_GAUGE.inc()
+    try:
+        await semaphore.acquire()
+    finally:
+        _WAITING_GAUGE.dec()
+    try:
+        _LOG.debug("Running: %s", _join(commands_))
+        with _COMMAND_SUMMARY.labels(os.path.basename(commands_[-1][0])).time():  # noqa: PTH119
+            return await _run(commands_, cwd, input_, max_duration, max_output_size)
+    finally:
+        semaphore.release()
+
+
+async def _run(
+    commands: list[list[str]],
+    cwd: str | Path | None,
+    input_: bytes | None,
+    max_duration: float,
+    max_output_size: int,
+) -> str:
+    procs: list[asyncio.subprocess.Process] = []
+    outputs = [bytearray() for _ in commands]
+    try:
+        stdin: int = subprocess.DEVNULL if input_ is None else subprocess.PIPE
+        for index, args in enumerate(commands):
+            last = index == len(commands) - 1
+            read_fd, write_fd = (-1, -1) if last else os.pipe()
+            try:
+                procs.append(
+                    await asyncio.create_subprocess_exec(
+                        *args,
+                        cwd=None if cwd is None else str(cwd),
+                        stdin=stdin,
+                        stdout=subprocess.PIPE if last else write_fd,
+                        stderr=subprocess.STDOUT if last else subprocess.PIPE,
+                        env=dict(os.environ),
+                        # To be able to kill the sub processes (e.g. git remote helpers)
+                        start_new_session=True,
+                    )
+                )
+            except BaseException:
+                if not last:
+                    os.close(read_fd)
+                raise
+            finally:
+                if index > 0:
+                    os.close(stdin)
+                if not last:
+                    os.close(write_fd)
+            stdin = read_fd
+
+        async with asyncio.timeout(max_duration):
+            await asyncio.gather(
+                _write(procs[0], input_),
+                *(
+                    _read(proc.stdout if proc is procs[-1] else proc.stderr, output, max_output_size)
+                    for proc, output in zip(procs, outputs, strict=True)
+                ),
+            )
+            returncodes = [await proc.wait() for proc in procs]
+    except TimeoutError:
+        await _kill(procs)
+        output = b"".join(outputs)
+        _LOG.warning("Timeout running: %s\n%s", _join(commands), _decode(output))
+        raise subprocess.TimeoutExpired(_get_cmd(commands), max_duration, output) from None
+    except BaseException:
+        await _kill(procs)
+        raise
+
+    # The last failing command, the previous ones may be killed by a broken pipe
+    for args, returncode, output in reversed(list(zip(commands, returncodes, outputs, strict=True))):
+        if returncode != 0:
+            _LOG.warning(_decode(output))
+            raise subprocess.CalledProcessError(returncode, args, bytes(output))
+    decoded = _decode(b"".join(outputs))
+    if decoded and len(decoded) <= config.settings.command.max_output_size:
+        _LOG.debug(decoded)
+    return decoded
+
+
+async def _write(proc: asyncio.subprocess.Process, input_: bytes | None) -> None:
+    if input_ is not None:
+        assert proc.stdin is not None
+        proc.stdin.write(input_)
+        await proc.stdin.drain()
+        proc.stdin.close()
+
+
+async def _read(stream: asyncio.StreamReader | None, output: bytearray, max_output_size: int) -> None:
+    assert stream is not None
+    while chunk := await stream.read(_CHUNK_SIZE):
+        output += chunk
+        # Keep only the end of the output, where the errors are
+        del output[:-max_output_size]
+
+
+def _join(commands: list[list[str]]) -> str:
+    return " | ".join(shlex.join(args) for args in commands)
+
+
+def _get_cmd(commands: list[list[str]]) -> list[str] | str:
+    return commands[0] if len(commands) == 1 else _join(commands)
+
+
+async def _kill(procs: list[asyncio.subprocess.Process]) -> None:
+    for proc in procs:
+        if proc.returncode is not None:
+            continue
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    await asyncio.shield(asyncio.gather(*(proc.wait() for proc in procs)))
+
+
+def _decode(output: bytes | bytearray) -> str:
+    return output.decode("utf-8", errors="replace").strip()
@@ -0,0 +1,286 @@
+# Copyright (c) 2026, Camptocamp SA
+"""
+Cache of the git repositories.
+
+Each remote repository has one bare object store, fetched incrementally, and a worktree per branch and
+sparse directory, shared by the sources using them. The concurrent fetches of a repository are collapsed
+in one fetch.
+
+The stores are blobless partial clones: the fetches get only the commits and the trees, the blobs are
+fetched by the checkouts, only for the (cone mode) sparse directory of the worktree.
+"""
+
+import asyncio
+import base64
+import contextlib
+import hashlib
+import logging
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import TYPE_CHECKING
+
+from anyio import Path
+from prometheus_client import Counter, Summary
+
+from shared_config_manager import process, scheduler
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Iterable
+
+_LOG = logging.getLogger(__name__)
+_TEMP_DIR = Path(tempfile.gettempdir())
+STORES_DIR = _TEMP_DIR / "repositories"
+WORKTREES_DIR = _TEMP_DIR / "worktrees"
+_FETCH_COMMAND = ("git", "fetch", "--depth=1", "--filter=blob:none", "origin")
+_URL_RE = re.compile(r"^(?:[a-z+]+://)?(?:[^@/]+@)?([^/:]+)(?::[0-9]+)?[:/](.+)$")
+
+_FETCH_SUMMARY = Summary(
+    "sharedconfigmanager_repository_fetch", "Number of seconds spent fetching the repositories"
+)
+_FETCH_REQUESTS_COUNTER = Counter(
+    "sharedconfigmanager_repository_fetch_requests",
+    "Number of fetch requests, including the ones collapsed with another fetch",
+)
+
+
+class _Repository:
+    """The object store of a remote repository."""
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.path = STORES_DIR / f"{_encode(url)}.git"
+        self._lock = asyncio.Lock()
+        self._refspecs: set[str] = set()
+        self._next_fetch: asyncio.Task[None] | None = None
+
+    async def fetch(self, branch: str, commit: str | None = None) -> None:
+        """
+        Fetch a branch, and a given commit of it.
+
+        The requests received while a fetch is running are collapsed in one following fetch.
+        """
+        _FETCH_REQUESTS_COUNTER.inc()
+        self._refspecs.add(f"+refs/heads/{branch}:refs/remotes/origin/{branch}")
+        if commit is not None:
+            self._refspecs.add(commit)
+        if self._next_fetch is None:
+            self._next_fetch = asyncio.create_task(self._fetch())
+        # Not cancelled with one of the waiting sources
+        await asyncio.shield(self._next_fetch)
+
+    async def _fetch(self) -> None:
+        async with self._lock:
+            self._next_fetch = None
+            refspecs = sorted(self._refspecs)
+            self._refspecs.clear()
+            _LOG.info("Fetching %s (%s)", self.url, ", ".join(refspecs))
+            async with scheduler.stage("network"):
+                with _FETCH_SUMMARY.time():
+                    try:
+                        await self._init()
+                        await process.run(*_FETCH_COMMAND, *refspecs, cwd=self.path)
+                    except subprocess.CalledProcessError:
+                        _LOG.warning("Failed to fetch %s, repairing the store", self.url)
+                        await self._repair()
+                        await process.run(*_FETCH_COMMAND, *refspecs, cwd=self.path)
+
+    async def _init(self) -> None:
+        if not await (self.path / "HEAD").is_file():
+            _LOG.info("Creating the store of %s", self.url)
+            await self.path.mkdir(parents=True, exist_ok=True)
+            await process.run("git", "init", "--bare", "--quiet", cwd=self.path)
+        for key, value in (
+            ("remote.origin.url", self.url),
+            ("remote.origin.promisor", "true"),
+            ("remote.origin.partialclonefilter", "blob:none"),
+            ("extensions.partialclone", "origin"),
+        ):
+            await process.run("git", "config", key, value, cwd=self.path)
+
+    async def _repair(self) -> None:
+        """Remove the locks left by an interrupted command, or recreate a corrupted store."""
+        # The locks of the worktrees (in worktrees/) are not concerned
+        for pattern in ("*.lock", "refs/**/*.lock"):
+            async for lock_path in self.path.glob(pattern):
+                _LOG.warning("Removing the stale lock %s", lock_path)
+                await lock_path.unlink(missing_ok=True)
+        try:
+            await process.run("git", "rev-parse", "--git-dir", cwd=self.path)
+        except subprocess.CalledProcessError:
+            _LOG.warning("Recreating the corrupted store of %s", self.url)
+            await asyncio.to_thread(shutil.rmtree, self.path, ignore_errors=True)
+        await self._init()
+
+
+_REPOSITORIES: dict[str, _Repository] = {}
+_WORKTREE_LOCKS: dict[Path, asyncio.Lock] = {}
+# Number of sources using each worktree
+_WORKTREE_USERS: dict[Path, int] = {}
+
+
+def _get_repository(url: str) -> _Repository:
+    if url not in _REPOSITORIES:
+        _REPOSITORIES[url] = _Repository(url)
+    return _REPOSITORIES[url]
+
+
+def _get_worktree_lock(path: Path) -> asyncio.Lock:
+    if path not in _WORKTREE_LOCKS:
+        _WORKTREE_LOCKS[path] = asyncio.Lock()
+    return _WORKTREE_LOCKS[path]
+
+
+def _encode(url: str) -> str:
+    return base64.urlsafe_b64encode(url.encode("utf-8")).decode("utf-8")
+
+
+def normalize_url(url: str) -> str:
+    """Normalize the URL of a repository, to compare the URLs whatever the protocol (HTTPS, SSH, ...)."""
+    url = url.removesuffix("/").removesuffix(".git")
+    match = _URL_RE.match(url)
+    if match is None:
+        return url
+    return f"{match.group(1)}/{match.group(2)}".lower()
+
+
+def get_worktree_path(url: str, branch: str, sparse_dir: str | None = None) -> Path:
+    """Get the path of the worktree of a branch, with only the sparse directory if given."""
+    key = hashlib.sha256(f"{branch}\0{sparse_dir or ''}".encode()).hexdigest()[:16]
+    return WORKTREES_DIR / _encode(url) / key
+
+
+async def fetch(url: str, branch: str, commit: str | None = None) -> None:
+    """Fetch a branch, and a given commit of it, in the store of the repository."""
+    await _get_repository(url).fetch(branch, commit)
+
+
+async def get_head(url: str, branch: str) -> str:
+    """Get the fetched head commit of a branch."""
+    return await process.run(
+        "git", "rev-parse", f"refs/remotes/origin/{branch}", cwd=_get_repository(url).path
+    )
+
+
+def get_tree_rev(commit: str, sub_dir: str | None = None) -> str:
+    """Get the revision of the tree of a sub directory of a commit (of the root if None)."""
+    sub_dir = (sub_dir or "").strip("/")
+    return f"{commit}:{sub_dir}" if sub_dir else f"{commit}^{{tree}}"
+
+
+async def get_tree(url: str, commit: str, sub_dir: str | None = None) -> str | None:
+    """Get the id of the tree of a sub directory of a fetched commit, None if it doesn't exist."""
+    try:
+        return await process.run(
+            "git", "rev-parse", "--verify", get_tree_rev(commit, sub_dir), cwd=_get_repository(url).path
+        )
+    except subprocess.CalledProcessError:
+        return None
+
+
+async def get_tags(url: str, commit: str) -> list[str]:
+    """Get the tags pointing at a fetched commit."""
+    output = await process.run("git", "tag", "--points-at", commit, cwd=_get_repository(url).path)
+    return output.split("\n") if output else []
+
+
+async def get_changed_paths(url: str, branch: str, before: str, after: str) -> set[str]:
+    """Get the paths changed between two commits of a branch, only the commits and the trees are fetched."""
+    repository = _get_repository(url)
+    # Collapsed in one fetch
+    await asyncio.gather(repository.fetch(branch, before), repository.fetch(branch, after))
+    output = await process.run(
+        "git",
+        "diff",
+        "--name-only",
+        "--no-renames",
+        "-z",
+        before,
+        after,
+        cwd=repository.path,
+        max_output_size=sys.maxsize,
+    )
+    return {path for path in output.split("\0") if path}
+
+
+@contextlib.asynccontextmanager
+async def checkout(
+    url: str, branch: str, sparse_dir: str | None = None, commit: str | None = None, fetch: bool = True
+) -> AsyncIterator[Path]:
+    """
+    Fetch a branch and update its worktree, which is locked until the end of the context.
+
+    If a commit is given, it's checked out instead of the head of the branch. Without fetch, the commit
+    should already be in the store.
+    """
+    repository = _get_repository(url)
+    if fetch:
+        await repository.fetch(branch, commit)
+    path = get_worktree_path(url, branch, sparse_dir)
+    ref = commit or f"refs/remotes/origin/{branch}"
+    async with _get_worktree_lock(path):
+        # Mostly writing the files, the stage isn't held during the context
+        async with scheduler.stage("disk"):
+            try:
+                await _update_worktree(repository, path, ref, sparse_dir)
+            except subprocess.CalledProcessError:
+                # Recreated from the store, only the missing blobs are fetched
+                _LOG.warning("Failed to update the worktree %s, recreating it", path)
+                await _remove_worktree(repository, path)
+                await _update_worktree(repository, path, ref, sparse_dir)
+        yield path
+
+
+def use_worktree(url: str, branch: str, sparse_dir: str | None = None) -> None:
+    """Register a source using the worktree of a branch, released by `remove_worktree`."""
+    path = get_worktree_path(url, branch, sparse_dir)
+    _WORKTREE_USERS[path] = _WORKTREE_USERS.get(path, 0) + 1
+
+
+async def remove_worktree(url: str, branch: str, sparse_dir: str | None = None) -> None:
+    """Release the worktree of a branch, removed when no other source uses it, the store is kept."""
+    path = get_worktree_path(url, branch, sparse_dir)
+    users = _WORKTREE_USERS.pop(path, 0) - 1
+    if users > 0:
+        _WORKTREE_USERS[path] = users
+        return
+    async with _get_worktree_lock(path):
+        # A new source may have started using it in the meantime
+        if path not in _WORKTREE_USERS:
+            await _remove_worktree(_get_repository(url), path)
+
+
+async def _update_worktree(repository: _Repository, path: Path, ref: str, sparse_dir: str | None) -> None:
+    if not await (path / ".git").is_file():
+        await _remove_worktree(repository, path)
+        await path.parent.mkdir(parents=True, exist_ok=True)
+        await process.run(
+            "git", "worktree", "add", "--no-checkout", "--detach", path, ref, cwd=repository.path
+        )
+        if sparse_dir is not None:
+            # The cone mode also includes the files of the parent directories
+            await process.run("git", "sparse-checkout", "set", "--cone", sparse_dir.strip("/"), cwd=path)
+    # Only the changed files are written, the missing blobs of the sparse directory are fetched
+    await process.run("git", "checkout", "--force", "--detach", ref, cwd=path)
+
+
+async def _remove_worktree(repository: _Repository, path: Path) -> None:
+    if await path.exists():
+        await asyncio.to_thread(shutil.rmtree, path)
+    if await repository.path.is_dir():
+        await process.run("git", "worktree", "prune", cwd=repository.path)
+
+
+async def get_remote_heads(url: str, branches: Iterable[str]) -> dict[str, str]:
+    """Get the commit hashes of the heads of the remote branches, with one `git ls-remote`."""
+    async with scheduler.stage("network"):
+        output = await process.run(
+            "git", "ls-remote", "--heads", url, *[f"refs/heads/{branch}" for branch in sorted(branches)]
+        )
+    heads = {}
+    for line in output.splitlines():
+        hash_, ref = line.split("\t", 1)
+        heads[ref.removeprefix("refs/heads/")] = hash_
+    return heads
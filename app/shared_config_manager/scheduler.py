@@ -0,0 +1,178 @@
+# Copyright (c) 2026, Camptocamp SA
+"""
+Scheduling of the refresh work.
+
+Each refresh runs as a job with a priority class (webhook > manual > periodic > startup). The stages of the
+jobs run in bounded pools, one per resource: the network (fetches, downloads), the disk (checkouts,
+copies) and the CPU (template evaluations, tarball builds). That way the checkout of a source overlaps with
+the template evaluation of another, and the free slots of a pool are given to the waiting stages with the
+highest priority first.
+
+The work outside of a job (e.g. the fetches triggered by the events on the slaves) has the manual priority.
+
+The phase of the running job of each source (e.g. waiting for the network, network, ...) is tracked, to be
+reported by the jobs API.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import enum
+import heapq
+import itertools
+import os
+import time
+from typing import TYPE_CHECKING, Literal
+
+from prometheus_client import Gauge, Summary
+
+from shared_config_manager import config
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Awaitable, Callable
+
+type Stage = Literal["network", "disk", "cpu"]
+
+
+class Priority(enum.IntEnum):
+    """The priority classes of the jobs, the lowest value first."""
+
+    WEBHOOK = 0
+    MANUAL = 1
+    PERIODIC = 2
+    STARTUP = 3
+
+
+_PRIORITY: contextvars.ContextVar[Priority] = contextvars.ContextVar("priority", default=Priority.MANUAL)
+_SOURCE: contextvars.ContextVar[str | None] = contextvars.ContextVar("source", default=None)
+_PHASES: dict[str, str] = {}
+
+_JOBS_GAUGE = Gauge("sharedconfigmanager_scheduler_jobs", "Number of running jobs", ["priority"])
+_QUEUE_GAUGE = Gauge(
+    "sharedconfigmanager_scheduler_queue_depth",
+    "Number of stages waiting for a free slot in their pool",
+    ["stage", "priority"],
+)
+_RUNNING_GAUGE = Gauge("sharedconfigmanager_scheduler_running", "Number of running stages", ["stage"])
+_WAIT_SUMMARY = Summary(
+    "sharedconfigmanager_scheduler_wait",
+    "Number of seconds spent by the stages waiting for a free slot in their pool",
+    ["stage", "priority"],
+)
+
+
+class _Pool:
+    """A bounded pool, the free slots are given to the waiting stages by priority, then in arrival order."""
+
+    def __init__(self, stage: Stage, size: int) -> None:
+        self._stage = stage
+        self._free = size
+        self._waiters: list[tuple[Priority, int, asyncio.Future[None]]] = []
+        self._counter = itertools.count()
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        priority = _PRIORITY.get()
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+        else:
+            await self._wait(priority)
+        _RUNNING_GAUGE.labels(self._stage).inc()
+        try:
+            yield
+        finally:
+            _RUNNING_GAUGE.labels(self._stage).dec()
+            self._release()
+
+    async def _wait(self, priority: Priority) -> None:
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        queue_gauge = _QUEUE_GAUGE.labels(self._stage, priority.name.lower())
+        queue_gauge.inc()
+        start = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was given just before the cancellation
+                self._release()
+            raise
+        finally:
+            queue_gauge.dec()
+            _WAIT_SUMMARY.labels(self._stage, priority.name.lower()).observe(time.monotonic() - start)
+
+    def _release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            # The cancelled waiters are skipped
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free += 1
+
+
+_POOLS: dict[Stage, _Pool] = {}
+
+
+def _get_pool(stage_: Stage) -> _Pool:
+    if stage_ not in _POOLS:
+        settings = config.settings.scheduler
+        size = {
+            "network": settings.network_concurrency,
+            "disk": settings.disk_concurrency,
+            "cpu": settings.cpu_concurrency or os.process_cpu_count() or 1,
+        }[stage_]
+        _POOLS[stage_] = _Pool(stage_, size)
+    return _POOLS[stage_]
+
+
+def get_priority() -> Priority:
+    """Get the priority of the current job."""
+    return _PRIORITY.get()
+
+
+def set_phase(phase: str) -> None:
+    """Set the phase of the current job, if it's the running job of a source."""
+    source_id = _SOURCE.get()
+    # Not for the shared tasks outliving their job
+    if source_id is not None and source_id in _PHASES:
+        _PHASES[source_id] = phase
+
+
+def get_phase(source_id: str) -> str | None:
+    """Get the phase of the running job of a source, None if there is none."""
+    return _PHASES.get(source_id)
+
+
+async def run[T](priority: Priority, function: Callable[[], Awaitable[T]], source_id: str | None = None) -> T:
+    """Run a job, of a source if given, its stages wait for a free slot in their pool by priority."""
+    priority_token = _PRIORITY.set(priority)
+    source_token = _SOURCE.set(source_id)
+    jobs_gauge = _JOBS_GAUGE.labels(priority.name.lower())
+    jobs_gauge.inc()
+    if source_id is not None:
+        _PHASES[source_id] = "running"
+    try:
+        return await function()
+    finally:
+        jobs_gauge.dec()
+        if source_id is not None:
+            _PHASES.pop(source_id, None)
+        _SOURCE.reset(source_token)
+        _PRIORITY.reset(priority_token)
+
+
+@contextlib.asynccontextmanager
+async def stage(stage_: Stage) -> AsyncIterator[None]:
+    """
+    Run a stage of the current job in the pool of its resource.
+
+    The stages must not be nested, a stage mustn't wait for another one while holding its slot.
+    """
+    set_phase(f"waiting_{stage_}")
+    async with _get_pool(stage_).acquire():
+        set_phase(stage_)
+        try:
+            yield
+        finally:
+            set_phase("running")
@@ -0,0 +1,50 @@
+# Copyright (c) 2026, Camptocamp SA
+"""
+Collapse the concurrent calls of a function.
+
+Only one run of the function is running at a time, the calls received while it's running are collapsed in
+exactly one following run, and the calls received during the debounce delay before a run are collapsed in
+it. A call without debounce delay starts the waiting run without waiting for the end of the delay. All the
+collapsed calls get the result of the same run.
+"""
+
+import asyncio
+import contextlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+
+class SingleFlight[A, T]:
+    """Collapse the concurrent calls of a function, called with the list of the arguments of the calls."""
+
+    def __init__(self, function: Callable[[list[A]], Awaitable[T]]) -> None:
+        self._function = function
+        self._lock = asyncio.Lock()
+        self._arguments: list[A] = []
+        self._next: asyncio.Task[T] | None = None
+        self._undelayed = asyncio.Event()
+
+    def is_pending(self) -> bool:
+        """Check if a call will be collapsed with a waiting run."""
+        return self._next is not None
+
+    async def __call__(self, argument: A, debounce: float = 0) -> T:
+        self._arguments.append(argument)
+        if debounce <= 0:
+            self._undelayed.set()
+        if self._next is None:
+            self._next = asyncio.create_task(self._run(debounce))
+        # Not cancelled with one of the callers
+        return await asyncio.shield(self._next)
+
+    async def _run(self, debounce: float) -> T:
+        if debounce > 0:
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(self._undelayed.wait(), debounce)
+        async with self._lock:
+            self._next = None
+            self._undelayed.clear()
+            arguments, self._arguments = self._arguments, []
+            return await self._function(arguments)
@@ -1,21 +1,37 @@
 # Copyright (c) 2026, Camptocamp SA
 import asyncio
 import copy
+import functools
+import hashlib
+import json
 import logging
-import os
+import pathlib
 import shutil
-import subprocess
+import tempfile
 import urllib.parse
+import uuid
 from typing import Any, Protocol
 
 import aiohttp
-from aiohttp import ClientTimeout
 from anyio import Path
 from c2casgiutils import broadcast
 from fastapi import HTTPException, Request
 from prometheus_client import Counter, Gauge, Summary
 
-from shared_config_manager import broadcast_status, config, template_engines
+from shared_config_manager import (
+    blocks,
+    broadcast_status,
+    config,
+    delta,
+    generations,
+    index,
+    manifest,
+    process,
+    scheduler,
+    streaming,
+    tarball,
+    template_engines,
+)
 from shared_config_manager.configuration import SourceConfig, TemplateEnginesStatus
 from shared_config_manager.security import Allowed, User, permits
 from shared_config_manager.sources import mode
@@ -52,6 +68,9 @@ _DO_FETCH_ERROR_COUNTER = Counter(
 )
 _COPY_SUMMARY = Summary("sharedconfigmanager_source_copy", "Number of source copies", ["source"])
 
+# List of the files created by the template engines, relative to the root of the source
+_RENDERED = ".scm-rendered.json"
+
 
 class BaseSource:
     """Base class for sources."""
@@ -61,6 +80,10 @@ class BaseSource:
         self._config = config
         self._is_master = is_master
         self._is_loaded = False
+        self._fetched_version: str | None = None
+        self._next_generation: Path | None = None
+        # The changes of the last copy, if known
+        self._changes: index.Changes | None = None
         self._template_engines = [
             template_engines.create_engine(self.get_id(), engine_conf)
             for engine_conf in config.get("template_engines", [])
@@ -76,9 +99,23 @@ class BaseSource:
         _LOG.info("Doing a refresh of %s", self.get_id())
         try:
             self._is_loaded = False
+            self._changes = None
             with _REFRESH_SUMMARY.labels(self.get_id()).time():
                 await self._do_refresh()
-            await self._eval_templates()
+            await self._eval_templates(self._changes)
+            version = await self.get_version()
+            current = tarball.get(self.get_id())
+            if (
+                self._changes is not None
+                and not self._changes.changed
+                and not self._changes.deleted
+                and current is not None
+                and version in (None, current.version)
+            ):
+                _LOG.info("The files of the source %s didn't change, keeping its tarball", self.get_id())
+            else:
+                async with scheduler.stage("cpu"):
+                    await tarball.build(self.get_id(), self.get_path(), version)
             await _set_refresh_success(source=self.get_id())
         except Exception:
             _LOG.warning("Error with source %s", self.get_id(), exc_info=True)
@@ -88,20 +125,62 @@ class BaseSource:
         finally:
             self._is_loaded = True
 
-    async def _eval_templates(self) -> None:
+    async def _eval_templates(self, changes: index.Changes | None = None) -> None:
+        """
+        Evaluate the templates.
+
+        With the changes of the copy, the hashes of the unchanged copied files are taken from the index.
+        """
         if mode.is_master_with_slaves():
             # masters with slaves don't need to evaluate templates
             return
         # We get the list of files only once to avoid consecutive template engines eating the output of
-        # the previous template engines. This method is always called with a root_dir that is clean from
-        # all the files that are created by template engines (see the --delete rsync flag in
-        # BaseSource._copy).
-        root_dir = self.get_path()
-        files = [p.relative_to(root_dir) async for p in root_dir.glob("**/*")]
-
-        for engine in self._template_engines:
-            with _TEMPLATE_SUMMARY.labels(self.get_id(), engine.get_type()).time():
-                await engine.evaluate(root_dir, files)
+        # the previous template engines. The files created by a previous evaluation are excluded, they
+        # are kept by the copies, the fetches and in the new generations.
+        root_dir = await self._get_work_path()
+        previous = await _read_rendered(root_dir)
+        files = []
+        async for file_path in root_dir.glob("**/*"):
+            path = file_path.relative_to(root_dir)
+            if path.as_posix() not in previous and path.as_posix() != _RENDERED:
+                files.append(path)
+
+        # The unchanged templates are not evaluated again, the caches are kept outside the target directory
+        caches_path = _get_templates_cache_path(self.get_id())
+        caches: dict[str, template_engines.base.RenderCache] = {}
+        if await caches_path.is_file():
+            caches = json.loads(await caches_path.read_text(encoding="utf-8"))
+        known_hashes: dict[str, str] = {}
+        if changes is not None and self._template_engines:
+            changed = set(changes.changed) | previous
+            known_hashes = {
+                path: hash_
+                for path, (_, hash_) in (
+                    await asyncio.to_thread(index.get_hashes, index.get_path(self.get_id()))
+                ).items()
+                if path not in changed
+            }
+        rendered: set[str] = set()
+        async with scheduler.stage("cpu"):
+            for engine_index, engine in enumerate(self._template_engines):
+                cache = caches.setdefault(str(engine_index), {})
+                with _TEMPLATE_SUMMARY.labels(self.get_id(), engine.get_type()).time():
+                    outputs = await engine.evaluate(root_dir, files, cache, known_hashes)
+                rendered.update(output.relative_to(root_dir).as_posix() for output in outputs)
+                # Possibly read by the following engines
+                for output in rendered:
+                    known_hashes.pop(output, None)
+        caches = {key: value for key, value in caches.items() if int(key) < len(self._template_engines)}
+        if caches or await caches_path.exists():
+            await caches_path.parent.mkdir(parents=True, exist_ok=True)
+            await caches_path.write_text(json.dumps(caches), encoding="utf-8")
+
+        for stale in previous - rendered:
+            stale_path = root_dir / stale
+            if await stale_path.is_symlink() or await stale_path.is_file():
+                await stale_path.unlink()
+        if rendered or previous:
+            await (root_dir / _RENDERED).write_text(json.dumps(sorted(rendered)), encoding="utf-8")
 
     async def fetch(self) -> None:
         try:
@@ -110,54 +189,65 @@ class BaseSource:
                 _FETCH_SUMMARY.labels(self.get_id()).time(),
                 _FETCH_ERROR_COUNTER.labels(self.get_id()).count_exceptions(),
             ):
-                await self._do_fetch()
-            await self._eval_templates()
+                # Always evaluate the templates on the first fetch, the environment may have changed
+                first_fetch = self._fetched_version is None
+                async with scheduler.stage("network"):
+                    changed = await self._do_fetch()
+            if changed or first_fetch:
+                await self._eval_templates()
+            if self._next_generation is not None:
+                await generations.publish(self.get_path(), self._next_generation)
+                self._next_generation = None
+                await generations.prune(self.get_path(), config.settings.slave.generations)
             await _set_fetch_success(source=self.get_id())
         except Exception:
             _LOG.warning("Error with source %s", self.get_id(), exc_info=True)
             _FETCH_ERROR_GAUGE.labels(self.get_id()).set(1)
             raise
         finally:
+            if self._next_generation is not None:
+                # Not published
+                await asyncio.to_thread(shutil.rmtree, self._next_generation, ignore_errors=True)
+                self._next_generation = None
             self._is_loaded = True
 
+    async def _get_work_path(self, new: bool = False) -> Path:
+        """
+        Get the path where the fetched content is written.
+
+        With the generations enabled and `new`, a new generation is prepared, published at the end of the
+        fetch.
+        """
+        if new and self._next_generation is None and config.settings.slave.generations > 0:
+            self._next_generation = await generations.create(self.get_path())
+        return self._next_generation or self.get_path()
+
+    async def rollback(self, generation: str | None = None) -> str:
+        """Publish back a kept generation, by default the previous one, without any download."""
+        name = await generations.rollback(self.get_path(), generation)
+        # Fetch the next version from the version of the published generation
+        self._fetched_version = None
+        _LOG.info("Rolled back the source %s to the generation %s", self.get_id(), name)
+        return name
+
     async def _do_refresh(self) -> None:
         pass
 
-    async def _do_fetch(self) -> None:
+    async def _do_fetch(self) -> bool:
+        """Fetch the content from the master, returns False if the content didn't change."""
         path = self.get_path()
         url = mode.get_fetch_url(self.get_id())
+        version = self._fetched_version or await self.get_version()
+        if not await path.is_dir():
+            version = None
 
         for i in list(range(config.settings.slave.retry_number))[::-1]:
             try:
                 _LOG.info("Doing a fetch of %s, on %s", self.get_id(), url)
-                async with (
-                    aiohttp.ClientSession() as session,
-                    session.get(
-                        url,
-                        headers={"X-Scm-Secret": config.settings.secret or ""},
-                        timeout=ClientTimeout(total=config.settings.slave.requests_timeout),
-                    ) as response,
-                ):
-                    response.raise_for_status()
-                    if await path.exists():
-                        shutil.rmtree(path)
-                    await path.mkdir(parents=True, exist_ok=True)
-                    tar = await asyncio.create_subprocess_exec(
-                        "tar",
-                        "--extract",
-                        "--gzip",
-                        "--no-same-owner",
-                        "--no-same-permissions",
-                        "--touch",
-                        "--no-overwrite-dir",
-                        cwd=path,
-                        stdin=asyncio.subprocess.PIPE,
-                    )
-                    if tar.stdin is not None:
-                        async for chunk in response.content.iter_chunked(8192):
-                            tar.stdin.write(chunk)
-                        tar.stdin.close()
-                    assert await tar.wait() == 0
+                async with aiohttp.ClientSession() as session:
+                    changed = None if version is None else await self._fetch_delta(session, version)
+                    if changed is None:
+                        changed = await self._fetch_tarball(session, version)
             except Exception as exception:  # pylint: disable=broad-exception-caught
                 if not isinstance(exception, aiohttp.ClientConnectorError):
                     _LOG.exception("Unexpected error while fetching the source from url %s", url)
@@ -174,9 +264,200 @@ class BaseSource:
                 else:
                     raise
             else:
-                return
+                return changed
+        return False
+
+    @staticmethod
+    def _fetch_headers() -> dict[str, str]:
+        # The tarball is already compressed, zstd is preferred and gzip is the fallback
+        return {
+            "X-Scm-Secret": config.settings.secret or "",
+            "Accept": f"{tarball.MEDIA_TYPES['zstd']}, {tarball.MEDIA_TYPES['gzip']};q=0.5",
+            "Accept-Encoding": "identity",
+        }
+
+    async def _fetch_delta(self, session: aiohttp.ClientSession, version: str) -> bool | None:
+        """Fetch and apply the changes since the given version, returns None if not available."""
+        async with session.get(
+            mode.get_delta_url(self.get_id()),
+            params={"base": version},
+            headers=self._fetch_headers(),
+            timeout=streaming.get_timeout(),
+        ) as response:
+            if response.status == 304:
+                _LOG.info("The source %s didn't change (version %s)", self.get_id(), version)
+                self._fetched_version = version
+                return False
+            if response.status == 404:
+                _LOG.info(
+                    "No delta from the version %s of the source %s, fetching the full tarball",
+                    version,
+                    self.get_id(),
+                )
+                return None
+            response.raise_for_status()
+            path = await self._get_work_path(new=True)
+
+            archive = Path(tempfile.gettempdir()) / f"{uuid.uuid4().hex}.delta.tar"
+            try:
+                await streaming.consume(
+                    self.get_id(),
+                    response.content,
+                    functools.partial(streaming.save, dest=pathlib.Path(archive)),
+                )
+                info = await asyncio.to_thread(delta.read_info, pathlib.Path(archive))
+                # Patch the large files before applying the archive, to have the .gitstats updated last
+                for patched_path, entry in info.get("patched", {}).items():
+                    await self._fetch_blocks(session, info, patched_path, entry)
+                await asyncio.to_thread(delta.apply, pathlib.Path(archive), pathlib.Path(path))
+            finally:
+                await archive.unlink(missing_ok=True)
+        _LOG.info(
+            "Applied the delta of the source %s from the version %s to %s, %i patched, %i deleted",
+            self.get_id(),
+            version,
+            info["version"],
+            len(info.get("patched", {})),
+            len(info["deleted"]),
+        )
+        self._fetched_version = info["version"]
+        return True
+
+    async def _fetch_blocks(
+        self,
+        session: aiohttp.ClientSession,
+        info: dict[str, Any],
+        path: str,
+        entry: manifest.Entry,
+    ) -> None:
+        """Update a large file by fetching only the blocks not found in the current copy."""
+        target = await self._get_work_path() / path
+        block_size = info["block_size"]
+        offsets = await asyncio.to_thread(
+            blocks.match, pathlib.Path(target), entry["size"], block_size, entry["blocks"]
+        )
+        missing = [block_index for block_index, offset in enumerate(offsets) if offset < 0]
+
+        async with session.post(
+            mode.get_blocks_url(self.get_id()),
+            json={"version": info["version"], "path": path, "blocks": missing},
+            headers={"X-Scm-Secret": config.settings.secret or ""},
+            timeout=streaming.get_timeout(),
+        ) as response:
+            response.raise_for_status()
+            tmp_target = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+            try:
+                digest = hashlib.sha256()
+                async with await tmp_target.open("wb") as new_file:
+                    old_file = await target.open("rb") if len(missing) < len(offsets) else None
+                    try:
+                        for block_index, offset in enumerate(offsets):
+                            length = blocks.block_length(entry["size"], block_size, block_index)
+                            if offset < 0:
+                                block = await response.content.readexactly(length)
+                            else:
+                                assert old_file is not None
+                                await old_file.seek(offset)
+                                block = await old_file.read(length)
+                            digest.update(block)
+                            await new_file.write(block)
+                    finally:
+                        if old_file is not None:
+                            await old_file.aclose()
+                if digest.hexdigest() != entry["hash"]:
+                    message = f"Wrong hash after patching the file {target}"
+                    raise ValueError(message)
+                await tmp_target.chmod(entry["mode"])
+                await tmp_target.rename(target)
+            finally:
+                await tmp_target.unlink(missing_ok=True)
+        _LOG.info(
+            "Patched the file %s of the source %s, %i/%i blocks reused",
+            path,
+            self.get_id(),
+            len(offsets) - len(missing),
+            len(offsets),
+        )
+
+    async def _fetch_tarball(self, session: aiohttp.ClientSession, version: str | None) -> bool:
+        """Fetch and extract the full tarball, returns False if the content didn't change."""
+        headers = self._fetch_headers()
+        if version is not None:
+            # The content is the same whatever the compression
+            headers["If-None-Match"] = ", ".join(
+                tarball.get_etag(version, compression) for compression in tarball.MEDIA_TYPES
+            )
+        async with session.get(
+            mode.get_fetch_url(self.get_id()),
+            headers=headers,
+            timeout=streaming.get_timeout(),
+        ) as response:
+            response.raise_for_status()
+            if response.status == 304:
+                _LOG.info("The source %s didn't change (version %s)", self.get_id(), version)
+                self._fetched_version = version
+                return False
+            path = await self._get_work_path(new=True)
+            if await path.exists() and not await path.is_dir():
+                await path.unlink()
+            compression = "zstd" if response.content_type == tarball.MEDIA_TYPES["zstd"] else "gzip"
+            # Applied on the current content, to write only the changed files, the files created by the
+            # template engines are kept
+            stats = await streaming.consume(
+                self.get_id(),
+                response.content,
+                functools.partial(
+                    delta.extract,
+                    dest=pathlib.Path(path),
+                    compression=compression,
+                    keep=await _read_rendered(path) | {_RENDERED},
+                ),
+            )
+            etag = response.headers.get("ETag")
+            self._fetched_version = tarball.get_etag_version(etag) if etag else None
+        _LOG.info(
+            "Extracted the source %s, %i written, %i unchanged, %i deleted",
+            self.get_id(),
+            stats["written"],
+            stats["unchanged"],
+            stats["deleted"],
+        )
+        return stats["written"] > 0 or stats["deleted"] > 0
+
+    async def _copy(self, source: Path, excludes: list[str] | None = None) -> index.Changes | None:
+        """
+        Copy the source directory to the target directory, returns the changes, if known.
+
+        The changes are passed to the template evaluation and to the tarball build by `refresh`.
+        """
+        # The files created by the template engines are neither copied nor deleted
+        rendered = [f"/{path}" for path in await _read_rendered(self.get_path()) | {_RENDERED}]
+        all_excludes = [*(excludes or []), *self._config.get("excludes", []), *rendered]
+        with _COPY_SUMMARY.labels(self.get_id()).time():
+            if _is_remote(str(source)):
+                async with scheduler.stage("network"):
+                    await self._rsync(str(source), all_excludes)
+                return None
+            oids = await self._get_oids()
+            async with scheduler.stage("disk"):
+                changes = await asyncio.to_thread(
+                    index.copy,
+                    pathlib.Path(source),
+                    pathlib.Path(self.get_path()),
+                    index.get_path(self.get_id()),
+                    all_excludes,
+                    oids,
+                    config.settings.copy_mode,
+                )
+        _LOG.info(
+            "Copied the source %s, %i changed, %i deleted",
+            self.get_id(),
+            len(changes.changed),
+            len(changes.deleted),
+        )
+        return changes
 
-    async def _copy(self, source: Path, excludes: list[str] | None = None) -> None:
+    async def _rsync(self, source: str, excludes: list[str]) -> None:
         await self.get_path().mkdir(parents=True, exist_ok=True)
         cmd = [
             "rsync",
@@ -188,18 +469,22 @@ class BaseSource:
             "--verbose",
             "--checksum",
         ]
-        if excludes is not None:
-            cmd += ["--exclude=" + exclude for exclude in excludes]
-        if "excludes" in self._config:
-            cmd += ["--exclude=" + exclude for exclude in self._config["excludes"]]
-        cmd += [str(source) + "/", str(self.get_path())]
-        with _COPY_SUMMARY.labels(self.get_id()).time():
-            self._exec(*cmd)
+        cmd += ["--exclude=" + exclude for exclude in excludes]
+        cmd += [source + "/", str(self.get_path())]
+        await process.run(*cmd)
+
+    async def _get_oids(self) -> dict[str, str] | None:
+        """Get the git object ids of the files to copy, relative to the copied directory."""
+        return None
 
     async def delete_target_dir(self) -> None:
         dest = self.get_path()
         _LOG.info("Deleting target dir %s", dest)
-        if await dest.is_dir():
+        await asyncio.to_thread(index.delete, index.get_path(self.get_id()))
+        await _get_templates_cache_path(self.get_id()).unlink(missing_ok=True)
+        if await dest.is_symlink():
+            await generations.delete(dest)
+        elif await dest.is_dir():
             shutil.rmtree(dest)
 
     def get_path(self) -> Path:
@@ -219,6 +504,15 @@ class BaseSource:
     def get_id(self) -> str:
         return self._id
 
+    async def get_version(self) -> str | None:
+        """Get the version of the content of the source, if known."""
+        return None
+
+    def _get_inputs_digest(self) -> str:
+        """Get the digest of the inputs besides the files: the config and the data of the template engines."""
+        inputs = [self._config, [engine.get_data() for engine in self._template_engines]]
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
     async def validate_auth(
         self,
         identity: User | None,
@@ -274,31 +568,7 @@ class BaseSource:
 
     async def delete(self) -> None:
         await self.delete_target_dir()
-
-    @staticmethod
-    def _exec(*args: Any, **kwargs: Any) -> str:
-        try:
-            args_ = list(map(str, args))
-            _LOG.debug("Running: %s", " ".join(args_))
-            output: str = (
-                subprocess.run(  # noqa: S603
-                    args_,
-                    check=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    env=dict(os.environ),
-                    **kwargs,
-                )
-                .stdout.decode("utf-8")
-                .strip()
-            )
-            if output:
-                _LOG.debug(output)
-        except subprocess.CalledProcessError as exception:
-            _LOG.warning(exception.output.decode("utf-8").strip())
-            raise
-        else:
-            return output
+        await tarball.delete(self.get_id())
 
     def is_loaded(self) -> bool:
         return self._is_loaded
@@ -313,6 +583,23 @@ class BaseSource:
                 data[key] = "•••"
 
 
+def _is_remote(source: str) -> bool:
+    """Check if the source is a remote rsync location (host:path or rsync://)."""
+    return source.startswith("rsync://") or ":" in source.split("/", 1)[0]
+
+
+def _get_templates_cache_path(source_id: str) -> Path:
+    """Get the path of the render caches of the template engines of a source, by index of the engine."""
+    return config.settings.index_dir / "templates" / f"{source_id}.json"
+
+
+async def _read_rendered(root_dir: Path) -> set[str]:
+    rendered_path = root_dir / _RENDERED
+    if not await rendered_path.is_file():
+        return set()
+    return set(json.loads(await rendered_path.read_text(encoding="utf-8")))
+
+
 class _SetRefreshSuccessProto(Protocol):
     """Protocol for _set_refresh_success function."""
 
@@ -1,74 +1,121 @@
 # Copyright (c) 2026, Camptocamp SA
-import base64
+import hashlib
 import json
 import logging
-import os
-import subprocess
-import tempfile
-from typing import TYPE_CHECKING
-
-from anyio import Path
+import sys
+from typing import TYPE_CHECKING, Any
 
+from shared_config_manager import index, process, repositories
 from shared_config_manager.sources import mode
 from shared_config_manager.sources.ssh import SshBaseSource
 
 if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from anyio import Path
+
     from shared_config_manager import broadcast_status
+    from shared_config_manager.configuration import SourceConfig
 
-TEMP_DIR = Path(tempfile.gettempdir())
 LOG = logging.getLogger(__name__)
 
 
 class GitSource(SshBaseSource):
     """Source that get files with git."""
 
+    def __init__(self, id_: str, config: SourceConfig, is_master: bool) -> None:
+        super().__init__(id_, config, is_master)
+        # The pushed commit to check out instead of the head of the branch
+        self._commit: str | None = None
+        self._uses_worktree = False
+
+    def use_worktree(self) -> None:
+        """Register the use of the shared worktree, once the source is registered, released by `delete`."""
+        if mode.is_master() and not self._uses_worktree:
+            repositories.use_worktree(self.get_repo(), self.get_branch(), self._get_sparse_dir())
+            self._uses_worktree = True
+
+    async def refresh_to(self, commit: str) -> bool:
+        """
+        Refresh to a pushed commit.
+
+        The fetched head of the branch is the truth: if the branch moved since the push, the source is
+        refreshed to its head instead. That way a redelivered or out of order webhook never moves the source
+        backwards, and a branch reset to an older commit (force push) is followed.
+
+        Returns False if the source is already at this commit or at the head of the branch.
+        """
+        current = await self.get_commit()
+        if current == commit:
+            LOG.info("The source %s is already at the commit %s", self.get_id(), commit)
+            return False
+        await repositories.fetch(self.get_repo(), self.get_branch())
+        head = await repositories.get_head(self.get_repo(), self.get_branch())
+        if head != commit:
+            LOG.info("The branch of the source %s moved from %s to %s", self.get_id(), commit, head)
+            commit = head
+            if current == commit:
+                return False
+        tree = await repositories.get_tree(self.get_repo(), commit, self._config.get("sub_dir"))
+        if tree is not None and self._get_version(tree) == await self.get_version():
+            # Only recorded, no copy, no template evaluation and no new tarball, the tarball of the tree keeps
+            # the stats of the commit it was built from
+            LOG.info("The files of the source %s didn't change in the commit %s", self.get_id(), commit)
+            await self._write_stats(
+                {
+                    "hash": commit,
+                    "tree": tree,
+                    "version": self._get_version(tree),
+                    "tags": await repositories.get_tags(self.get_repo(), commit),
+                }
+            )
+            return False
+        LOG.info("Refreshing the source %s to the commit %s", self.get_id(), commit)
+        self._commit = commit
+        try:
+            await self.refresh()
+        finally:
+            self._commit = None
+        return True
+
     async def _do_refresh(self) -> None:
-        await self._checkout()
-        await self._copy(self._copy_dir(), excludes=[".git"])
-        stats = {"hash": self._get_hash(), "tags": self._get_tags()}
+        # The commit from refresh_to was just fetched
+        async with repositories.checkout(
+            self.get_repo(),
+            self.get_branch(),
+            self._get_sparse_dir(),
+            self._commit,
+            fetch=self._commit is None,
+        ):
+            # The stats are written after the copy
+            self._changes = await self._copy(self._copy_dir(), excludes=[".git", "/.gitstats"])
+            tree = await self._get_tree()
+            stats = {
+                "hash": await self._get_hash(),
+                "tree": tree,
+                "version": self._get_version(tree),
+                "tags": await self._get_tags(),
+            }
+        await self._write_stats(stats)
+
+    async def _write_stats(self, stats: dict[str, Any]) -> None:
         async with await (self.get_path() / ".gitstats").open("w", encoding="utf-8") as gitstats:
             await gitstats.write(json.dumps(stats))
 
-    async def _checkout(self) -> None:
-        cwd = self._clone_dir()
-        repo = self._get_repo()
-        branch = self.get_branch()
-        git_dir = cwd / ".git"
-        if await git_dir.is_dir():
-            LOG.info("Fetching a new version of %s", repo)
-            try:
-                self._exec("git", "fetch", "--depth=1", "origin", branch, cwd=cwd)
-                self._exec("git", "checkout", branch, cwd=cwd)
-                self._exec("git", "reset", "--hard", f"origin/{branch}", cwd=cwd)
-            except subprocess.CalledProcessError:
-                LOG.warning("Failed to fetch a new version of %s, retry checkout", repo)
-                self._exec("rm", "-rf", git_dir)
-                await self._checkout()
-        elif self._do_sparse():
-            LOG.info("Cloning %s (sparse)", repo)
-            self._exec("git-sparse-clone", repo, branch, cwd, self._config["sub_dir"], cwd=TEMP_DIR)
-        else:
-            LOG.info("Cloning %s", repo)
-            if await cwd.exists():
-                os.removedirs(cwd)
-            await cwd.parent.mkdir(parents=True, exist_ok=True)
-            command = ["git", "clone", f"--branch={branch}", "--depth=1", repo, cwd.name]
-            self._exec(*command, cwd=TEMP_DIR)
-
-    def _get_repo(self) -> str:
-        return self._config["repo"]
+    def get_repo(self) -> str:
+        return str(self._config["repo"])
 
     def _clone_dir(self) -> Path:
-        if self._do_sparse():
-            return TEMP_DIR / self.get_id()
-        # The directory we clone into is not fct(id), but in function of the repository and the
-        # branch. That way, if two sources are other sub-dirs of the same repo, we clone it only once.
-        encoded_repo = base64.urlsafe_b64encode(self._get_repo().encode("utf-8")).decode("utf-8")
-        return TEMP_DIR / encoded_repo
+        # The worktree is in function of the repository, the branch and the sparse directory. That way, if
+        # two sources are other sub-dirs of the same repo, it's checked out only once.
+        return repositories.get_worktree_path(self.get_repo(), self.get_branch(), self._get_sparse_dir())
 
     def _do_sparse(self) -> bool:
         return "sub_dir" in self._config and self._config.get("sparse", True)
 
+    def _get_sparse_dir(self) -> str | None:
+        return self._config["sub_dir"] if self._do_sparse() else None
+
     def _copy_dir(self) -> Path:
         sub_dir = self._config.get("sub_dir")
         if sub_dir is None:
@@ -77,23 +124,84 @@ class GitSource(SshBaseSource):
 
     async def get_stats(self) -> broadcast_status.SourceStatus:
         stats = await super().get_stats()
+        for key, value in (await self._read_stats()).items():
+            setattr(stats, key, value)
+        return stats
+
+    async def get_version(self) -> str | None:
+        # Written by the master, the slaves read it from the fetched content
+        stats = await self._read_stats()
+        version: str | None = stats.get("version", stats.get("tree", stats.get("hash")))
+        return version
+
+    def _get_version(self, tree: str) -> str:
+        # The tree of the sub directory, unchanged by the commits touching only other directories, with the
+        # config and the template data (e.g. the environment variables), that also change the content
+        return hashlib.sha256(f"{tree}\0{self._get_inputs_digest()}".encode()).hexdigest()
+
+    async def get_commit(self) -> str | None:
+        """Get the hash of the commit currently copied."""
+        hash_: str | None = (await self._read_stats()).get("hash")
+        return hash_
+
+    async def _read_stats(self) -> dict[str, Any]:
         stats_path = self.get_path() / ".gitstats"
-        if await stats_path.is_file():
-            for key, value in json.loads(await stats_path.read_text(encoding="utf-8")).items():
-                setattr(stats, key, value)
+        if not await stats_path.is_file():
+            return {}
+        stats: dict[str, Any] = json.loads(await stats_path.read_text(encoding="utf-8"))
         return stats
 
-    def _get_hash(self) -> str:
-        return self._exec("git", "rev-parse", "HEAD", cwd=self._clone_dir())
+    async def _get_hash(self) -> str:
+        return await process.run("git", "rev-parse", "HEAD", cwd=self._clone_dir())
 
-    def _get_tags(self) -> list[str]:
-        out = self._exec("git", "tag", "--points-at", "HEAD", cwd=self._clone_dir())
+    async def _get_tree(self) -> str:
+        tree_rev = repositories.get_tree_rev("HEAD", self._config.get("sub_dir"))
+        return await process.run("git", "rev-parse", tree_rev, cwd=self._clone_dir())
+
+    async def _get_tags(self) -> list[str]:
+        out = await process.run("git", "tag", "--points-at", "HEAD", cwd=self._clone_dir())
         return out.split("\n") if out else []
 
+    async def _get_oids(self) -> dict[str, str]:
+        sub_dir = self._config.get("sub_dir")
+        args = ["git", "ls-tree", "-r", "-z", "HEAD"]
+        if sub_dir is not None:
+            args += ["--", sub_dir]
+        out = await process.run(*args, cwd=self._clone_dir(), max_output_size=sys.maxsize)
+        prefix = f"{sub_dir.strip('/')}/" if sub_dir is not None else ""
+        oids = {}
+        # Each entry is "<mode> <type> <oid>\t<path>"
+        for entry in out.split("\0"):
+            if not entry:
+                continue
+            info, path = entry.split("\t", 1)
+            _, type_, oid = info.split(" ")
+            if type_ == "blob" and path.startswith(prefix):
+                oids[path[len(prefix) :]] = oid
+        return oids
+
+    def is_touched(self, paths: Iterable[str]) -> bool:
+        """Check if one of the changed paths of the repository is copied by the source."""
+        sub_dir = self._config.get("sub_dir", "").strip("/")
+        excludes = [".git", *self._config.get("excludes", [])]
+        prefix = f"{sub_dir}/" if sub_dir else ""
+        for path in paths:
+            if not path.startswith(prefix):
+                continue
+            parts = path.removeprefix(prefix).split("/")
+            # The excludes also apply to the parent directories
+            if not any(
+                index.is_excluded("/".join(parts[: i + 1]), excludes, is_dir=i < len(parts) - 1)
+                for i in range(len(parts))
+            ):
+                return True
+        return False
+
     def get_branch(self) -> str:
         return str(self._config.get("branch", "master"))
 
     async def delete(self) -> None:
         await super().delete()
-        if mode.is_master():
-            self._exec("rm", "-rf", self._clone_dir())
+        if self._uses_worktree:
+            self._uses_worktree = False
+            await repositories.remove_worktree(self.get_repo(), self.get_branch(), self._get_sparse_dir())
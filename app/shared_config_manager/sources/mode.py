@@ -23,3 +23,13 @@ def is_master_with_slaves() -> bool:
 def get_fetch_url(id_: str) -> str:
     """Get the URL to fetch the tarball."""
     return f"{config.settings.slave.api_base_url}1/tarball/{id_}"
+
+
+def get_delta_url(id_: str) -> str:
+    """Get the URL to fetch the delta tarball."""
+    return f"{config.settings.slave.api_base_url}1/delta/{id_}"
+
+
+def get_blocks_url(id_: str) -> str:
+    """Get the URL to fetch the blocks of a large file."""
+    return f"{config.settings.slave.api_base_url}1/blocks/{id_}"
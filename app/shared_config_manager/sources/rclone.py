@@ -4,6 +4,7 @@ from typing import TYPE_CHECKING
 
 from anyio import Path
 
+from shared_config_manager import process, scheduler
 from shared_config_manager.sources.base import BaseSource
 
 if TYPE_CHECKING:
@@ -27,7 +28,8 @@ class RcloneSource(BaseSource):
             cmd += ["--exclude=" + exclude for exclude in self._config["excludes"]]
 
         cmd += ["remote:" + self.get_config().get("sub_dir", ""), str(target)]
-        self._exec(*cmd)
+        async with scheduler.stage("network"):
+            await process.run(*cmd)
         if not was_here:
             await target.rename(self.get_path())
 
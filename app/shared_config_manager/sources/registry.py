@@ -9,12 +9,20 @@ from anyio import Path
 from asyncinotify import Inotify, Mask
 from c2casgiutils import broadcast
 from fastapi import HTTPException, Request
-
-from shared_config_manager import broadcast_status, config, configuration
+from prometheus_client import Counter
+
+from shared_config_manager import (
+    broadcast_status,
+    config,
+    configuration,
+    repositories,
+    scheduler,
+    singleflight,
+)
 from shared_config_manager.sources import base, git, mode, rclone, rsync
 
 if TYPE_CHECKING:
-    from collections.abc import Mapping
+    from collections.abc import Iterable, Mapping
 
     from shared_config_manager.security import User
 
@@ -24,6 +32,17 @@ _MASTER_ID = "master"
 MASTER_SOURCE: base.BaseSource | None = None
 _SOURCES: dict[str, base.BaseSource] = {}
 FILTERED_SOURCES: Mapping[str, base.BaseSource] = {}
+# The ids of the git sources by branch and by normalized repository URL, to route the webhooks
+_GIT_SOURCES_INDEX: dict[str, dict[str, set[str]]] = {}
+_REFRESH_FLIGHTS: dict[
+    str, singleflight.SingleFlight[tuple[base.BaseSource, str | None, scheduler.Priority], bool]
+] = {}
+_FETCH_FLIGHTS: dict[str, singleflight.SingleFlight[str, None]] = {}
+_REFRESH_COLLAPSED_COUNTER = Counter(
+    "sharedconfigmanager_source_refresh_collapsed",
+    "Number of refresh requests collapsed with a pending refresh",
+    ["source"],
+)
 
 
 def _create_source(
@@ -49,6 +68,7 @@ async def init(slave: bool) -> None:
     mode.init(slave)
     if slave:
         await broadcast.subscribe("slave_fetch", _slave_fetch)
+        await broadcast.subscribe("slave_rollback", _slave_rollback)
     await update_flag("LOADING")
     await _prepare_ssh()
     if config.settings.master_config:
@@ -90,8 +110,10 @@ async def init(slave: bool) -> None:
         MASTER_SOURCE = _create_source(
             _MASTER_ID, cast("configuration.SourceConfig", content), is_master=True
         )
+        if isinstance(MASTER_SOURCE, git.GitSource):
+            MASTER_SOURCE.use_worktree()
         _LOG.info("Initial loading of the master config")
-        await MASTER_SOURCE.refresh_or_fetch()
+        await scheduler.run(scheduler.Priority.STARTUP, MASTER_SOURCE.refresh_or_fetch, _MASTER_ID)
         _LOG.info("Loading of the master config finished")
         if not MASTER_SOURCE.get_config().get("standalone", False):
             await reload_master_config()
@@ -142,8 +164,9 @@ async def _do_handle_master_config(master_config: configuration.Config) -> tuple
         async with semaphore:
             try:
                 source = _create_source(source_id, source_config)
-                await source.refresh_or_fetch()
+                await scheduler.run(scheduler.Priority.STARTUP, source.refresh_or_fetch, source_id)
                 _SOURCES[source_id] = source
+                _index_source(source)
             except Exception:  # noqa: BLE001
                 _LOG.error("Cannot load the %s config", source_id, exc_info=True)
                 return False
@@ -196,7 +219,43 @@ async def _prepare_ssh() -> None:
 
 async def _delete_source(source_id: str) -> None:
     await _SOURCES[source_id].delete()
+    _unindex_source(_SOURCES[source_id])
     del _SOURCES[source_id]
+    _REFRESH_FLIGHTS.pop(source_id, None)
+    _FETCH_FLIGHTS.pop(source_id, None)
+
+
+def _index_source(source: base.BaseSource) -> None:
+    if isinstance(source, git.GitSource):
+        # Released by the delete of the source
+        source.use_worktree()
+        by_repository = _GIT_SOURCES_INDEX.setdefault(source.get_branch(), {})
+        by_repository.setdefault(repositories.normalize_url(source.get_repo()), set()).add(source.get_id())
+
+
+def _unindex_source(source: base.BaseSource) -> None:
+    if isinstance(source, git.GitSource):
+        by_repository = _GIT_SOURCES_INDEX.get(source.get_branch(), {})
+        repository_url = repositories.normalize_url(source.get_repo())
+        source_ids = by_repository.get(repository_url, set())
+        source_ids.discard(source.get_id())
+        if not source_ids:
+            by_repository.pop(repository_url, None)
+        if not by_repository:
+            _GIT_SOURCES_INDEX.pop(source.get_branch(), None)
+
+
+def get_git_sources(branch: str, repository_urls: Iterable[str] | None = None) -> list[git.GitSource]:
+    """
+    Get the git sources of a branch, without the master source, from the index.
+
+    If given, only the sources of one of the repositories (normalized URLs), whatever the protocol.
+    """
+    by_repository = _GIT_SOURCES_INDEX.get(branch, {})
+    if repository_urls is None:
+        repository_urls = by_repository.keys()
+    source_ids = sorted(source_id for url in repository_urls for source_id in by_repository.get(url, set()))
+    return [cast("git.GitSource", _SOURCES[source_id]) for source_id in source_ids]
 
 
 def _filter_sources(
@@ -214,25 +273,67 @@ def _filter_sources(
     return result, filtered
 
 
-async def refresh(source_id: str, identity: User | None, request: Request) -> None:
+async def refresh_source(
+    source: base.BaseSource,
+    commit: str | None = None,
+    priority: scheduler.Priority = scheduler.Priority.MANUAL,
+) -> bool:
     """
-    Do a refresh.
+    Refresh a source and notify the slaves.
 
-    This is called from the web service to start a refresh.
+    The concurrent requests for the same source are collapsed in one refresh (see `SCM__REFRESH_DEBOUNCE`
+    for the webhooks), pinned to the last requested commit, or to the head of the branch if one of the
+    requests has no commit.
+    The refresh is scheduled with the highest priority of the collapsed requests.
     """
-    source, _ = await get_source_check_auth(source_id, identity, request=request)
-    _LOG.info("Reloading the %s config", source_id)
-    if source is None:
-        message = f"Unknown id {source_id}"
-        raise HTTPException(status_code=404, detail=message)
-    await source.refresh()
+    flight = _REFRESH_FLIGHTS.get(source.get_id())
+    if flight is None:
+        flight = singleflight.SingleFlight(_refresh_source)
+        _REFRESH_FLIGHTS[source.get_id()] = flight
+    elif flight.is_pending():
+        _LOG.info("Collapsing the refresh of %s with a pending one", source.get_id())
+        _REFRESH_COLLAPSED_COUNTER.labels(source.get_id()).inc()
+    debounce = config.settings.refresh_debounce if priority == scheduler.Priority.WEBHOOK else 0
+    return await flight((source, commit, priority), debounce)
+
+
+async def _refresh_source(requests: list[tuple[base.BaseSource, str | None, scheduler.Priority]]) -> bool:
+    return await scheduler.run(
+        min(priority for _, _, priority in requests),
+        lambda: _do_refresh_source(requests),
+        requests[-1][0].get_id(),
+    )
+
+
+async def _do_refresh_source(requests: list[tuple[base.BaseSource, str | None, scheduler.Priority]]) -> bool:
+    # The last source object, in case the configuration was reloaded
+    source = requests[-1][0]
+    commits = [commit for _, commit, _ in requests]
+    if None not in commits and isinstance(source, git.GitSource):
+        commit = commits[-1]
+        assert commit is not None
+        if not await source.refresh_to(commit):
+            return False
+    else:
+        await source.refresh()
     if source.is_master() and (not MASTER_SOURCE or not MASTER_SOURCE.get_config().get("standalone", False)):
         await reload_master_config()
-    await broadcast.broadcast("slave_fetch", params={"source_id": source_id})
+    scheduler.set_phase("broadcast")
+    await broadcast.broadcast("slave_fetch", params={"source_id": source.get_id()})
+    return True
 
 
 async def _slave_fetch(source_id: str) -> None:
-    """Do a refresh on the slave."""
+    """Do a refresh on the slave, the concurrent events of a source are collapsed in one fetch."""
+    flight = _FETCH_FLIGHTS.get(source_id)
+    if flight is None:
+        flight = singleflight.SingleFlight(_do_slave_fetch)
+        _FETCH_FLIGHTS[source_id] = flight
+    await flight(source_id)
+
+
+async def _do_slave_fetch(source_ids: list[str]) -> None:
+    source_id = source_ids[0]
     source, filtered = await get_source_check_auth(source_id, None, check_auth=False)
     if source is None:
         _LOG.error("Unknown id %s", source_id)
@@ -247,6 +348,31 @@ async def _slave_fetch(source_id: str) -> None:
         await reload_master_config()
 
 
+async def rollback(source_id: str, generation: str | None) -> None:
+    """
+    Roll back a source on the slaves.
+
+    This is called from the web service, the slaves publish back a kept generation.
+    """
+    _LOG.info("Rolling back the %s config to the generation %s", source_id, generation or "previous")
+    await broadcast.broadcast("slave_rollback", params={"source_id": source_id, "generation": generation})
+
+
+async def _slave_rollback(source_id: str, generation: str | None) -> None:
+    """Do a rollback on the slave."""
+    source, filtered = await get_source_check_auth(source_id, None, check_auth=False)
+    if source is None:
+        _LOG.error("Unknown id %s", source_id)
+        return
+    if filtered:
+        _LOG.info("The rollback of the %s config is filtered", source_id)
+        return
+    try:
+        await source.rollback(generation)
+    except ValueError as exception:
+        _LOG.warning("Cannot roll back the %s config: %s", source_id, exception)
+
+
 async def get_source_check_auth(
     source_id: str,
     identity: User | None,
@@ -8,4 +8,4 @@ class RsyncSource(SshBaseSource):
     """Source that get files with rsync."""
 
     async def _do_refresh(self) -> None:
-        await self._copy(Path(self._config["source"]))
+        self._changes = await self._copy(Path(self._config["source"]))
@@ -0,0 +1,153 @@
+# Copyright (c) 2026, Camptocamp SA
+"""
+Streaming of the HTTP responses to a blocking consumer.
+
+The chunks received from the network go through a bounded buffer to a consumer running in a thread
+(e.g. a decompression and extraction), the network reading is paused while the buffer is full.
+"""
+
+import asyncio
+import io
+import queue
+import shutil
+import threading
+import time
+from typing import TYPE_CHECKING, BinaryIO
+
+from aiohttp import ClientTimeout
+from prometheus_client import Counter, Gauge
+
+from shared_config_manager import config
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from pathlib import Path
+
+    import aiohttp
+
+_RECEIVED_COUNTER = Counter(
+    "sharedconfigmanager_source_fetch_received_bytes", "Number of bytes received from the master", ["source"]
+)
+_THROUGHPUT_GAUGE = Gauge(
+    "sharedconfigmanager_source_fetch_throughput",
+    "Throughput of the last stream received from the master in bytes per second",
+    ["source"],
+)
+_BUFFER_PEAK_GAUGE = Gauge(
+    "sharedconfigmanager_source_fetch_buffer_peak",
+    "Peak use of the buffer of the last stream received from the master in bytes",
+    ["source"],
+)
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def get_timeout() -> ClientTimeout:
+    """
+    Get the timeout for the streamed requests.
+
+    Without total timeout, the large downloads only fail if no data is received during the idle timeout.
+    """
+    return ClientTimeout(
+        total=None,
+        sock_connect=config.settings.slave.requests_timeout,
+        sock_read=config.settings.slave.idle_timeout,
+    )
+
+
+def save(file: BinaryIO, dest: Path) -> None:
+    """Consumer that saves the stream in a file (blocking)."""
+    with dest.open("wb") as dest_file:
+        shutil.copyfileobj(file, dest_file, _CHUNK_SIZE)
+
+
+class _BufferReader(io.RawIOBase):
+    """Read the chunks from the bounded buffer, None marks the end of the stream."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.chunks: queue.Queue[bytes | None] = queue.Queue(
+            maxsize=max(1, config.settings.slave.buffer_size // _CHUNK_SIZE)
+        )
+        self.size = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+        self._pending = memoryview(b"")
+        self._eof = False
+        self._aborted = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: memoryview) -> int:  # type: ignore[override]
+        while not self._pending:
+            if self._eof or self._aborted:
+                return 0
+            chunk = self.chunks.get()
+            if chunk is None:
+                self._eof = True
+                return 0
+            with self._lock:
+                self.size -= len(chunk)
+            self._pending = memoryview(chunk)
+        length = min(len(buffer), len(self._pending))
+        buffer[:length] = self._pending[:length]
+        self._pending = self._pending[length:]
+        return length
+
+    def added(self, length: int) -> None:
+        with self._lock:
+            self.size += length
+            self.peak = max(self.peak, self.size)
+
+    def put(self, chunk: bytes | None) -> None:
+        """Put a chunk in the buffer, blocking while it's full (blocking)."""
+        while not self._aborted:
+            try:
+                self.chunks.put(chunk, timeout=0.1)
+            except queue.Full:
+                continue
+            return
+
+    def abort(self) -> None:
+        """Stop the consumer and the producer, the next read will be the end of the stream."""
+        self._aborted = True
+        try:
+            # Wake up the consumer
+            self.chunks.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+async def consume[T](source_id: str, content: aiohttp.StreamReader, consumer: Callable[[BinaryIO], T]) -> T:
+    """Stream the content to a blocking consumer, called in a thread with a file like object."""
+    reader = _BufferReader()
+    task = asyncio.create_task(asyncio.to_thread(consumer, io.BufferedReader(reader, _CHUNK_SIZE)))
+    # Unblock the producer waiting on a full buffer if the consumer stops, e.g. on error
+    task.add_done_callback(lambda _: reader.abort())
+    received = 0
+    start = time.monotonic()
+    try:
+        async for chunk in content.iter_chunked(_CHUNK_SIZE):
+            if task.done():
+                # The consumer stopped, e.g. on error
+                break
+            received += len(chunk)
+            _RECEIVED_COUNTER.labels(source_id).inc(len(chunk))
+            reader.added(len(chunk))
+            try:
+                reader.chunks.put_nowait(chunk)
+            except queue.Full:
+                # Backpressure, wait for the consumer
+                await asyncio.to_thread(reader.put, chunk)
+        else:
+            await asyncio.to_thread(reader.put, None)
+    except BaseException:
+        reader.abort()
+        await asyncio.gather(task, return_exceptions=True)
+        raise
+    finally:
+        _BUFFER_PEAK_GAUGE.labels(source_id).set(reader.peak)
+    result = await task
+    _THROUGHPUT_GAUGE.labels(source_id).set(received / max(time.monotonic() - start, 1e-6))
+    return result
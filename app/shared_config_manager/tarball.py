@@ -0,0 +1,382 @@
+# Copyright (c) 2026, Camptocamp SA
+"""Prebuilt source tarballs, served to the slaves."""
+
+import asyncio
+import hashlib
+import logging
+import os
+import pathlib
+import re
+import shlex
+import shutil
+import uuid
+from dataclasses import dataclass
+
+from anyio import Path
+from prometheus_client import Counter, Gauge, Summary
+
+from shared_config_manager import config, delta, index, manifest, process
+
+_LOG = logging.getLogger(__name__)
+_BUILD_SUMMARY = Summary("sharedconfigmanager_tarball_build", "Number of tarball builds", ["source"])
+_CACHE_SIZE_GAUGE = Gauge("sharedconfigmanager_tarball_cache_size", "Size of the tarball cache in bytes")
+_EVICTION_COUNTER = Counter("sharedconfigmanager_tarball_eviction", "Number of evicted tarballs")
+_DELTA_BUILD_SUMMARY = Summary(
+    "sharedconfigmanager_tarball_delta_build", "Number of delta tarball builds", ["source"]
+)
+_COMPRESS_SUMMARY = Summary(
+    "sharedconfigmanager_tarball_compress", "Number of tarball compressions", ["source", "compression"]
+)
+_SIZE_GAUGE = Gauge(
+    "sharedconfigmanager_tarball_size",
+    "Size of the current tarball in bytes, 'none' for the uncompressed content",
+    ["source", "compression"],
+)
+_SENT_COUNTER = Counter(
+    "sharedconfigmanager_tarball_sent_bytes",
+    "Number of tarball bytes sent to the slaves",
+    ["source", "compression"],
+)
+
+# The supported compressions, with their media type, the first one is used to build the tarballs, the gzip
+# one keeps the media type historically returned to the clients
+MEDIA_TYPES = {"gzip": "application/x-gtar", "zstd": "application/zstd"}
+
+_GITSTATS = ".gitstats"
+_EXTENSION = ".tar.gz"
+_EXTENSIONS = {"gzip": _EXTENSION, "zstd": ".tar.zst"}
+# Suffixes of the ETags by compression, the bytes of the tarballs differ, the gzip ETag is the version, for the
+# older slaves
+_ETAG_SUFFIXES = {"gzip": "", "zstd": "-zst"}
+_MANIFEST_EXTENSION = ".manifest.json"
+# The versions are hexadecimal digests (git object ids or SHA-256)
+_VERSION_RE = re.compile(r"[0-9a-f]{4,64}")
+
+
+@dataclass(frozen=True)
+class Tarball:
+    """A prebuilt tarball of a source."""
+
+    version: str
+    path: Path
+
+
+_CURRENT: dict[str, Tarball] = {}
+_LOCKS: dict[str, asyncio.Lock] = {}
+
+
+def get(source_id: str) -> Tarball | None:
+    """Get the current tarball of a source, if already built."""
+    return _CURRENT.get(source_id)
+
+
+async def build(source_id: str, root: Path, version: str | None) -> Tarball:
+    """
+    Build the tarball of a source.
+
+    The archive is deterministic (sorted entries, normalized mtimes and owners) and keyed by the
+    version of the source, an already built version is reused. Without version, the digest of the
+    archive is used.
+    """
+    async with _LOCKS.setdefault(source_id, asyncio.Lock()):
+        source_dir = config.settings.tarball.cache_dir / source_id
+        await source_dir.mkdir(parents=True, exist_ok=True)
+
+        if version is not None:
+            path = source_dir / f"{version}{_EXTENSION}"
+            manifest_path = source_dir / f"{version}{_MANIFEST_EXTENSION}"
+            if await path.is_file() and await manifest_path.is_file():
+                _LOG.debug("Reusing the tarball %s for the source %s", path, source_id)
+                # Mark them as recently used for the eviction
+                await path.touch()
+                await manifest_path.touch()
+                _CURRENT[source_id] = Tarball(version, path)
+                return _CURRENT[source_id]
+
+        tmp_path = source_dir / f".{uuid.uuid4().hex}.tmp"
+        try:
+            with _BUILD_SUMMARY.labels(source_id).time():
+                await _create(root, tmp_path)
+            if version is None:
+                version = await asyncio.to_thread(_digest, tmp_path)
+            known_hashes = await asyncio.to_thread(index.get_hashes, index.get_path(source_id))
+            # The signatures of the blocks of the unchanged large files are reused
+            previous = _CURRENT.get(source_id)
+            previous_manifest = None if previous is None else await get_manifest(source_id, previous.version)
+            source_manifest = await asyncio.to_thread(
+                manifest.build,
+                pathlib.Path(root),
+                config.settings.tarball.block_size,
+                config.settings.tarball.block_threshold,
+                known_hashes,
+                previous_manifest,
+            )
+            await asyncio.to_thread(
+                manifest.write, source_manifest, pathlib.Path(source_dir / f"{version}{_MANIFEST_EXTENSION}")
+            )
+            path = source_dir / f"{version}{_EXTENSION}"
+            await tmp_path.rename(path)
+        finally:
+            if await tmp_path.exists():
+                await tmp_path.unlink()
+
+        _LOG.info("Built the tarball %s for the source %s", path, source_id)
+        _SIZE_GAUGE.labels(source_id, "none").set(
+            sum(entry.get("size", 0) for entry in source_manifest.values())
+        )
+        _SIZE_GAUGE.labels(source_id, "gzip").set((await path.stat()).st_size)
+        _CURRENT[source_id] = Tarball(version, path)
+        await _evict()
+        return _CURRENT[source_id]
+
+
+async def get_or_build(source_id: str, root: Path, version: str | None) -> Tarball:
+    """Get the current tarball of a source, build it if it's missing or outdated."""
+    tarball = _CURRENT.get(source_id)
+    if tarball is not None and version in (None, tarball.version) and await tarball.path.is_file():
+        return tarball
+    return await build(source_id, root, version)
+
+
+def get_compressed_path(source_tarball: Tarball, compression: str) -> Path:
+    """Get the path of the tarball of a source with the given compression, it may not be built yet."""
+    if compression == "gzip":
+        return source_tarball.path
+    return source_tarball.path.with_name(f"{source_tarball.version}{_EXTENSIONS[compression]}")
+
+
+async def get_compressed(source_id: str, source_tarball: Tarball, compression: str) -> Path:
+    """
+    Get the tarball of a source with the given compression.
+
+    The tarballs other than gzip are transcoded from the gzip one on the first request.
+    """
+    path = get_compressed_path(source_tarball, compression)
+    if compression == "gzip":
+        return path
+    async with _LOCKS.setdefault(source_id, asyncio.Lock()):
+        if await path.is_file():
+            return path
+        tmp_path = path.with_name(f".{uuid.uuid4().hex}.tmp")
+        try:
+            with _COMPRESS_SUMMARY.labels(source_id, compression).time():
+                await _transcode(source_tarball.path, tmp_path, compression)
+            await tmp_path.rename(path)
+        finally:
+            if await tmp_path.exists():
+                await tmp_path.unlink()
+
+    _LOG.info("Built the tarball %s for the source %s", path, source_id)
+    _SIZE_GAUGE.labels(source_id, compression).set((await path.stat()).st_size)
+    await _evict()
+    return path
+
+
+def count_sent(source_id: str, compression: str, size: int) -> None:
+    """Count the bytes of a tarball sent to a slave."""
+    _SENT_COUNTER.labels(source_id, compression).inc(size)
+
+
+def get_etag(version: str, compression: str = "gzip") -> str:
+    """Get the (strong) ETag of the tarball of a version with the given compression."""
+    return f'"{version}{_ETAG_SUFFIXES[compression]}"'
+
+
+def get_etag_version(etag: str) -> str:
+    """Get the version from the ETag of a tarball."""
+    return etag.removeprefix("W/").strip('"').partition("-")[0]
+
+
+def is_version(version: str) -> bool:
+    """Check that a version received from a client has the format of the versions, used in the paths."""
+    return _VERSION_RE.fullmatch(version) is not None
+
+
+async def get_manifest(source_id: str, version: str) -> manifest.Manifest | None:
+    """Get the manifest of a version of a source, if still available."""
+    path = config.settings.tarball.cache_dir / source_id / f"{version}{_MANIFEST_EXTENSION}"
+    if not await path.is_file():
+        return None
+    return await asyncio.to_thread(manifest.read, pathlib.Path(path))
+
+
+async def get_or_build_delta(
+    source_id: str,
+    root: Path,
+    base: str,
+    current: Tarball,
+    compression: str = "gzip",
+) -> Path | None:
+    """
+    Get the delta tarball between the base version and the current version of a source.
+
+    Returns None if the base version is unknown.
+    """
+    if not is_version(base):
+        return None
+    async with _LOCKS.setdefault(source_id, asyncio.Lock()):
+        source_dir = config.settings.tarball.cache_dir / source_id
+        path = source_dir / f"{current.version}.from-{base}{_EXTENSIONS[compression]}"
+        if await path.is_file():
+            await path.touch()
+            return path
+
+        base_manifest = await get_manifest(source_id, base)
+        current_manifest = await get_manifest(source_id, current.version)
+        if base_manifest is None or current_manifest is None:
+            return None
+        changed, deleted = manifest.diff(base_manifest, current_manifest)
+        # The large files already present at the base version are transferred by blocks, the signatures of
+        # the blocks are looked for in the copy of the slave
+        patched = {
+            path: current_manifest[path]
+            for path in changed
+            if "blocks" in current_manifest[path] and base_manifest.get(path, {}).get("type") == "file"
+        }
+        changed = [path for path in changed if path not in patched]
+
+        tmp_path = source_dir / f".{uuid.uuid4().hex}.tmp"
+        try:
+            with _DELTA_BUILD_SUMMARY.labels(source_id).time():
+                await asyncio.to_thread(
+                    delta.build,
+                    pathlib.Path(root),
+                    pathlib.Path(tmp_path),
+                    {
+                        "base": base,
+                        "version": current.version,
+                        "deleted": deleted,
+                        "patched": patched,
+                        "block_size": config.settings.tarball.block_size,
+                    },
+                    changed,
+                    compression,
+                    config.settings.tarball.zstd_level,
+                    threads(),
+                )
+            await tmp_path.rename(path)
+        finally:
+            if await tmp_path.exists():
+                await tmp_path.unlink()
+
+    _LOG.info(
+        "Built the delta tarball %s for the source %s, %i changed, %i patched, %i deleted",
+        path,
+        source_id,
+        len(changed),
+        len(patched),
+        len(deleted),
+    )
+    await _evict()
+    return path
+
+
+async def delete(source_id: str) -> None:
+    """Delete all the tarballs of a source."""
+    _CURRENT.pop(source_id, None)
+    source_dir = config.settings.tarball.cache_dir / source_id
+    if await source_dir.is_dir():
+        async for path in source_dir.iterdir():
+            await path.unlink()
+        await source_dir.rmdir()
+
+
+async def _create(root: Path, dest: Path) -> None:
+    files = sorted([file.name async for file in root.iterdir()])
+    if _GITSTATS in files:
+        # put .gitstats at the end, that way, it is updated last at the destination
+        files.remove(_GITSTATS)
+        files.append(_GITSTATS)
+
+    args = [
+        "tar",
+        "--create",
+        "--format=gnu",
+        "--sort=name",
+        "--mtime=@0",
+        "--owner=0",
+        "--group=0",
+        "--numeric-owner",
+        f"--use-compress-program={shlex.join([*gzip_program(), '--no-name'])}",
+        f"--file={dest}",
+        "--null",
+        "--files-from=-",
+    ]
+    await process.run(*args, cwd=root, input_="".join(f"{file}\0" for file in files).encode("utf-8"))
+
+
+def threads() -> int:
+    """Get the number of threads used to compress the tarballs."""
+    return config.settings.tarball.threads or os.process_cpu_count() or 1
+
+
+def gzip_program() -> list[str]:
+    """
+    Get the gzip compression program.
+
+    pigz, if available, compresses in parallel blocks, in a standard gzip stream.
+    """
+    if shutil.which("pigz") is not None:
+        return ["pigz", f"--processes={threads()}"]
+    return ["gzip"]
+
+
+def zstd_program() -> list[str]:
+    """Get the zstd compression program, multithreaded, in a standard zstd stream."""
+    return ["zstd", f"--threads={threads()}"]
+
+
+async def _transcode(source: Path, dest: Path, compression: str) -> None:
+    assert compression == "zstd"
+    decompress_args = [*gzip_program(), "--decompress", "--stdout", str(source)]
+    compress_args = [
+        *zstd_program(),
+        "--quiet",
+        f"-{config.settings.tarball.zstd_level}",
+        "-o",
+        str(dest),
+    ]
+    # The errors are logged by the process module
+    await process.run_pipeline(decompress_args, compress_args)
+
+
+def _digest(path: Path) -> str:
+    with open(path, "rb") as file:  # noqa: PTH123
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+
+async def _evict() -> None:
+    """
+    Evict the least recently used tarballs, keeping the current ones, to respect the max size.
+
+    The manifests, needed to build the deltas, are evicted after the tarballs.
+    """
+    current = set()
+    for tarball in _CURRENT.values():
+        current.add(tarball.path.with_name(f"{tarball.version}{_MANIFEST_EXTENSION}"))
+        for extension in _EXTENSIONS.values():
+            current.add(tarball.path.with_name(f"{tarball.version}{extension}"))
+    entries = await asyncio.to_thread(_list_cache)
+    total = sum(size for _, size, _ in entries)
+    entries.sort(key=lambda entry: (entry[0].name.endswith(_MANIFEST_EXTENSION), entry[2]))
+    for path, size, _ in entries:
+        if total <= config.settings.tarball.cache_max_size:
+            break
+        if path in current:
+            continue
+        _LOG.info("Evicting the tarball %s", path)
+        await path.unlink(missing_ok=True)
+        _EVICTION_COUNTER.inc()
+        total -= size
+    _CACHE_SIZE_GAUGE.set(total)
+
+
+def _list_cache() -> list[tuple[Path, int, float]]:
+    result = []
+    for dirpath, _, filenames in os.walk(config.settings.tarball.cache_dir):
+        for filename in filenames:
+            if filename.endswith((*_EXTENSIONS.values(), _MANIFEST_EXTENSION)):
+                path = Path(dirpath) / filename
+                stat = os.stat(path)  # noqa: PTH116
+                result.append((path, stat.st_size, stat.st_mtime))
+    return result
@@ -1,13 +1,21 @@
 # Copyright (c) 2026, Camptocamp SA
+import asyncio
+import filecmp
+import hashlib
+import json
 import logging
 import os
-from typing import TYPE_CHECKING, cast
+import pathlib
+import uuid
+from typing import TYPE_CHECKING, TypedDict, cast
 
 from prometheus_client import Counter, Gauge
 
 from shared_config_manager import config
 
 if TYPE_CHECKING:
+    from collections.abc import Mapping
+
     from anyio import Path
 
     from shared_config_manager.configuration import (
@@ -22,6 +30,26 @@ _ERROR_COUNTER = Counter(
     ["source", "type"],
 )
 _ERROR_GAUGE = Gauge("sharedconfigmanager_template_error_status", "Template in error", ["source", "type"])
+_CACHE_COUNTER = Counter(
+    "sharedconfigmanager_template_cache",
+    "Number of templates looked up in the render cache",
+    ["source", "type", "result"],
+)
+
+
+class CacheEntry(TypedDict):
+    """The render cache entry of a template."""
+
+    # Hash of the template, of the data and of the dependencies
+    key: str
+    # The included or inherited templates, relative to the root directory
+    dependencies: list[str]
+    # Size, modification time and inode of the output, to detect a modified or missing output
+    output: list[int]
+
+
+# The entries by template, relative to the root directory
+type RenderCache = dict[str, CacheEntry]
 
 
 class BaseEngine:
@@ -37,7 +65,20 @@ class BaseEngine:
         else:
             self._data = config.get("data", {})
 
-    async def evaluate(self, root_dir: Path, files: list[Path]) -> None:
+    async def evaluate(
+        self,
+        root_dir: Path,
+        files: list[Path],
+        cache: RenderCache | None = None,
+        known_hashes: Mapping[str, str] | None = None,
+    ) -> list[Path]:
+        """
+        Evaluate the templates of the given files, returns the created files.
+
+        With a render cache, the templates are evaluated only if the template, the data, one of the
+        dependencies (included or inherited templates) or the output changed, the cache is updated. The known
+        hashes (sha256, relative to the root directory) of the unchanged files are not computed again.
+        """
         dest_dir = self._get_dest_dir(root_dir)
         _LOG.info(
             "Evaluating templates %s -> %s with data keys: %s",
@@ -46,44 +87,168 @@ class BaseEngine:
             ", ".join(self._data.keys()),
         )
 
+        previous_cache = dict(cache or {})
+        if cache is not None:
+            cache.clear()
+        hashes: dict[str, str | None] = dict(known_hashes or {})
+        outputs = []
+        # The templates to evaluate, with their source and destination paths
+        templates: list[tuple[str, Path, Path]] = []
         for sub_path in files:
             src_path = root_dir / sub_path
             dest_path = dest_dir / sub_path
             await dest_path.parent.mkdir(parents=True, exist_ok=True)
             if src_path.suffix == "." + self._extension:
                 dest_path = dest_path.parent / dest_path.stem
+                template = sub_path.as_posix()
+                entry = previous_cache.get(template)
+                if cache is not None and entry is not None:
+                    key = await self._get_cache_key(root_dir, template, entry["dependencies"], hashes)
+                    if key == entry["key"] and await _get_output_stat(dest_path) == entry["output"]:
+                        _CACHE_COUNTER.labels(self._source_id, self.get_type(), "hit").inc()
+                        cache[template] = entry
+                        outputs.append(dest_path)
+                        continue
                 _LOG.debug("Evaluating template: %s -> %s", src_path, dest_path)
+                templates.append((template, src_path, dest_path))
+            elif src_path != dest_path and not await src_path.is_dir():
+                outputs.append(dest_path)
+                if await dest_path.exists():
+                    if await dest_path.samefile(src_path):
+                        continue
+                    # The source file has been replaced since the last evaluation (by a delta)
+                    await dest_path.unlink()
+                await dest_path.hardlink_to(src_path)
+
+        results = await self._write(root_dir, [(src_path, dest_path) for _, src_path, dest_path in templates])
+        # In the files order, for the error status
+        for (template, src_path, dest_path), result in zip(templates, results, strict=True):
+            error = None
+            if isinstance(result, Exception):
+                error = result
+            else:
                 try:
-                    await self._evaluate_file(src_path, dest_path)
+                    dependencies = sorted(result)
+                    outputs.append(dest_path)
+                    if cache is not None:
+                        _CACHE_COUNTER.labels(self._source_id, self.get_type(), "miss").inc()
+                        output_stat = await _get_output_stat(dest_path)
+                        assert output_stat is not None
+                        cache[template] = {
+                            "key": await self._get_cache_key(root_dir, template, dependencies, hashes),
+                            "dependencies": dependencies,
+                            "output": output_stat,
+                        }
                     _ERROR_GAUGE.labels(source=self._source_id, type=self.get_type()).set(0)
-                except Exception:  # noqa: BLE001
-                    _LOG.warning(
-                        "Failed applying the %s template: %s",
-                        self._config["type"],
-                        src_path,
-                        exc_info=True,
-                    )
-                    _ERROR_COUNTER.labels(source=self._source_id, type=self.get_type()).inc()
-                    _ERROR_GAUGE.labels(source=self._source_id, type=self.get_type()).set(1)
-            elif src_path != dest_path and not await src_path.is_dir() and not await dest_path.exists():
-                await dest_path.hardlink_to(src_path)
+                except Exception as exception:  # noqa: BLE001
+                    error = exception
+            if error is not None:
+                _LOG.warning(
+                    "Failed applying the %s template: %s",
+                    self._config["type"],
+                    src_path,
+                    exc_info=error,
+                )
+                _ERROR_COUNTER.labels(source=self._source_id, type=self.get_type()).inc()
+                _ERROR_GAUGE.labels(source=self._source_id, type=self.get_type()).set(1)
+        return outputs
+
+    async def _write(self, root_dir: Path, templates: list[tuple[Path, Path]]) -> list[set[str] | Exception]:
+        """Evaluate the templates to their destination files, returns their dependencies or errors."""
+        # Evaluated next to the destination and renamed only if changed, that way an unchanged file keeps
+        # its inode and mtime, and a file shared (hard linked) with another generation is never modified.
+        tmp_paths = [
+            dest_path.with_name(f".{dest_path.name}.{uuid.uuid4().hex}.tmp") for _, dest_path in templates
+        ]
+        try:
+            results = await self._evaluate_files(
+                root_dir,
+                [(src_path, tmp_path) for (src_path, _), tmp_path in zip(templates, tmp_paths, strict=True)],
+            )
+            for index, ((_, dest_path), tmp_path) in enumerate(zip(templates, tmp_paths, strict=True)):
+                if isinstance(results[index], Exception):
+                    continue
+                try:
+                    if (
+                        await dest_path.is_file()
+                        and not await dest_path.is_symlink()
+                        and await asyncio.to_thread(filecmp.cmp, tmp_path, dest_path, shallow=False)
+                    ):
+                        continue
+                    await tmp_path.rename(dest_path)
+                except Exception as exception:  # noqa: BLE001
+                    results[index] = exception
+            return results
+        finally:
+            for tmp_path in tmp_paths:
+                await tmp_path.unlink(missing_ok=True)
+
+    async def _get_cache_key(
+        self, root_dir: Path, template: str, dependencies: list[str], hashes: dict[str, str | None]
+    ) -> str:
+        """Get the render cache key of a template, the hashes of the files are shared by the templates."""
+        key = hashlib.sha256(
+            json.dumps([self._config, self._data], sort_keys=True, default=str).encode("utf-8")
+        )
+        for path in [template, *dependencies]:
+            if path not in hashes:
+                hashes[path] = await asyncio.to_thread(_hash_file, pathlib.Path(root_dir / path))
+            key.update(f"\0{path}\0{hashes[path]}".encode())
+        return key.hexdigest()
 
     def _get_dest_dir(self, root_dir: Path) -> Path:
         if "dest_sub_dir" in self._config:
             return root_dir / self._config["dest_sub_dir"]
         return root_dir
 
-    async def _evaluate_file(self, src_path: Path, dst_path: Path) -> None:
-        pass
+    async def _evaluate_files(
+        self, root_dir: Path, templates: list[tuple[Path, Path]]
+    ) -> list[set[str] | Exception]:
+        """
+        Evaluate the templates (source and destination paths), returns their dependencies or errors.
+
+        One by one by default, an error doesn't prevent the evaluation of the other templates.
+        """
+        results: list[set[str] | Exception] = []
+        for src_path, dst_path in templates:
+            try:
+                results.append(await self._evaluate_file(root_dir, src_path, dst_path))
+            except Exception as exception:  # noqa: BLE001
+                results.append(exception)
+        return results
+
+    async def _evaluate_file(self, root_dir: Path, src_path: Path, dst_path: Path) -> set[str]:
+        """Evaluate a template, returns its dependencies (included or inherited templates)."""
+        del root_dir, src_path, dst_path
+        return set()
 
     def get_type(self) -> str:
         return self._config["type"]
 
+    def get_data(self) -> dict[str, str]:
+        """Get the data given to the templates, with the environment variables if enabled."""
+        return dict(self._data)
+
     def get_stats(self, stats: TemplateEnginesStatus) -> None:
         if self._config.get("environment_variables", False):
             stats.environment_variables = _filter_env(cast("dict[str, str]", os.environ))
 
 
+def _hash_file(path: pathlib.Path) -> str | None:
+    try:
+        with path.open("rb") as file:
+            return hashlib.file_digest(file, "sha256").hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+async def _get_output_stat(path: Path) -> list[int] | None:
+    if await path.is_symlink() or not await path.is_file():
+        return None
+    stat = await path.stat()
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
 def _filter_env(env: dict[str, str]) -> dict[str, str]:
     return {
         key: value
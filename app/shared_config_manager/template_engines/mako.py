@@ -1,9 +1,30 @@
 # Copyright (c) 2026, Camptocamp SA
+"""
+Mako template engine.
 
-from typing import TYPE_CHECKING
+The compiled templates are cached as Python modules in `SCM__TEMPLATE__MODULE_DIR`, named by the hash of the
+template and of its URI, that way they are reused across the refreshes, the generations, the sources and the
+restarts, and a changed template gets a new module.
 
+The templates are rendered in batches by a pool of processes, see `SCM__TEMPLATE__PROCESSES`, that way the
+rendering doesn't block the event loop and uses all the cores.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import hashlib
+import multiprocessing
+import pathlib
+import traceback
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, Any
+
+import mako.lookup  # pylint: disable=no-name-in-module,import-error
+import mako.runtime  # pylint: disable=no-name-in-module,import-error
 import mako.template  # pylint: disable=no-name-in-module,import-error
 
+from shared_config_manager import config
 from shared_config_manager.template_engines.base import BaseEngine
 
 if TYPE_CHECKING:
@@ -11,6 +32,91 @@ if TYPE_CHECKING:
 
     from shared_config_manager.configuration import TemplateEnginesConfig
 
+# Number of templates rendered by a process at once
+_BATCH_SIZE = 20
+_EXECUTOR: concurrent.futures.ProcessPoolExecutor | None = None
+
+
+class _RenderError(Exception):
+    """Error rendering a template in a worker process, with its traceback (not all Mako errors pickle)."""
+
+
+class _TemplateLookup(mako.lookup.TemplateLookup):  # pylint: disable=no-member
+    """Lookup of the templates of the source, recording the included or inherited templates."""
+
+    def __init__(self, root_dir: str, module_dir: str | None) -> None:
+        super().__init__(
+            directories=[root_dir],
+            input_encoding="utf-8",
+            modulename_callable=(
+                None if module_dir is None else functools.partial(_get_module_path, module_dir)
+            ),
+        )
+        self.dependencies: set[str] = set()
+
+    def get_template(self, uri: str) -> mako.template.Template:  # pylint: disable=no-member
+        self.dependencies.add(uri.lstrip("/"))
+        return super().get_template(uri)
+
+
+def _get_module_path(module_dir: str, filename: str, uri: str) -> str:
+    # The URI is compiled in the module, for the relative includes
+    with pathlib.Path(filename).open("rb") as file:
+        hash_ = hashlib.file_digest(file, "sha256")
+    hash_.update(f"\0{uri}".encode())
+    digest = hash_.hexdigest()
+    return str(pathlib.Path(module_dir) / digest[:2] / f"{digest}.py")
+
+
+def render(
+    root_dir: str, template: str, dst_path: str, data: dict[str, Any], module_dir: str | None
+) -> set[str]:
+    """
+    Render a template of the root directory, streamed to the destination file.
+
+    Returns the included or inherited templates.
+    """
+    # Only the modules are reused, the templates are loaded again from them
+    lookup = _TemplateLookup(root_dir, module_dir)
+    # The relative paths of the includes and the inherits are relative to the template
+    template_ = lookup.get_template(template)
+    lookup.dependencies.clear()
+    with pathlib.Path(dst_path).open("w", encoding="utf-8") as output:
+        template_.render_context(mako.runtime.Context(output, **data), **data)  # pylint: disable=no-member
+    return lookup.dependencies
+
+
+def _render_batch(
+    root_dir: str, templates: list[tuple[str, str]], data: dict[str, Any], module_dir: str | None
+) -> list[set[str] | Exception]:
+    """Render some templates in a worker process, returns their dependencies or errors."""
+    results: list[set[str] | Exception] = []
+    for template, dst_path in templates:
+        try:
+            results.append(render(root_dir, template, dst_path, data, module_dir))
+        except Exception:  # noqa: BLE001
+            results.append(_RenderError(traceback.format_exc()))
+    return results
+
+
+def _get_executor() -> concurrent.futures.ProcessPoolExecutor:
+    global _EXECUTOR  # noqa: PLW0603
+    if _EXECUTOR is None:
+        _EXECUTOR = concurrent.futures.ProcessPoolExecutor(
+            max_workers=config.settings.template.processes or None,
+            # Not forked from the threads of the application
+            mp_context=multiprocessing.get_context("forkserver"),
+        )
+    return _EXECUTOR
+
+
+def shutdown() -> None:
+    """Shut down the pool of processes rendering the templates, if started (blocking)."""
+    global _EXECUTOR  # noqa: PLW0603
+    if _EXECUTOR is not None:
+        _EXECUTOR.shutdown(cancel_futures=True)
+        _EXECUTOR = None
+
 
 class MakoEngine(BaseEngine):
     """Mako template engine."""
@@ -18,7 +124,41 @@ class MakoEngine(BaseEngine):
     def __init__(self, source_id: str, config: TemplateEnginesConfig) -> None:
         super().__init__(source_id, config, "mako")
 
-    async def _evaluate_file(self, src_path: Path, dst_path: Path) -> None:
-        content = await src_path.read_text(encoding="utf-8")
-        template = mako.template.Template(text=content)  # noqa: S702 # pylint: disable=no-member
-        await dst_path.write_text(template.render(**self._data), encoding="utf-8")
+    async def _evaluate_files(
+        self, root_dir: Path, templates: list[tuple[Path, Path]]
+    ) -> list[set[str] | Exception]:
+        global _EXECUTOR  # noqa: PLW0603
+        if not templates:
+            return []
+        module_dir = config.settings.template.module_dir
+        executor = _get_executor()
+        loop = asyncio.get_running_loop()
+        batches = [templates[index : index + _BATCH_SIZE] for index in range(0, len(templates), _BATCH_SIZE)]
+        batch_results = await asyncio.gather(
+            *[
+                loop.run_in_executor(
+                    executor,
+                    _render_batch,
+                    str(root_dir),
+                    [(src.relative_to(root_dir).as_posix(), str(dst)) for src, dst in batch],
+                    self._data,
+                    None if module_dir is None else str(module_dir),
+                )
+                for batch in batches
+            ],
+            return_exceptions=True,
+        )
+        results: list[set[str] | Exception] = []
+        for batch, batch_result in zip(batches, batch_results, strict=True):
+            if isinstance(batch_result, BrokenProcessPool) and _EXECUTOR is executor:
+                # A worker died (e.g. killed), the pool is created again for the next evaluations
+                _EXECUTOR = None
+                executor.shutdown(wait=False)
+            if isinstance(batch_result, Exception):
+                # Only the templates of the batch are in error
+                results.extend([batch_result] * len(batch))
+            elif isinstance(batch_result, BaseException):
+                raise batch_result
+            else:
+                results.extend(batch_result)
+        return results
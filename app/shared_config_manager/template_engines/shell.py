@@ -16,7 +16,8 @@ class ShellEngine(BaseEngine):
     def __init__(self, source_id: str, config: TemplateEnginesConfig) -> None:
         super().__init__(source_id, config, "tmpl")
 
-    async def _evaluate_file(self, src_path: Path, dst_path: Path) -> None:
+    async def _evaluate_file(self, root_dir: Path, src_path: Path, dst_path: Path) -> set[str]:
+        del root_dir
         content = await src_path.read_text(encoding="utf-8")
         proc = await asyncio.create_subprocess_exec(
             "envsubst",
@@ -30,3 +31,4 @@ class ShellEngine(BaseEngine):
             msg = f"envsubst failed with return code {proc.returncode}: {stderr.decode('utf-8')}"
             raise RuntimeError(msg)
         await dst_path.write_text(stdout.decode("utf-8"), encoding="utf-8")
+        return set()
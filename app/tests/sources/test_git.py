@@ -6,6 +6,7 @@ from pathlib import Path
 
 import pytest
 
+from shared_config_manager import index, process, tarball
 from shared_config_manager.sources import base, registry
 
 TEMP_DIR = tempfile.gettempdir()
@@ -135,6 +136,130 @@ async def test_git_sub_dir_no_sparse(repo) -> None:
         await git.delete()
 
 
+@pytest.mark.asyncio
+async def test_git_templates(repo) -> None:
+    await base.init()
+    (Path(repo) / "toto" / "hello.mako").write_text("Hello ${param}")
+    subprocess.check_call(["git", "add", "--all"], cwd=repo, stderr=subprocess.STDOUT)
+    subprocess.check_call(["git", "commit", "-m", "Template"], cwd=repo, stderr=subprocess.STDOUT)
+    git = registry._create_source(
+        "test_git",
+        {
+            "type": "git",
+            "repo": str(repo),
+            "template_engines": [{"type": "mako", "data": {"param": "world"}}],
+        },
+    )
+    try:
+        await git.refresh()
+        output = Path("/config/test_git/toto/hello")
+        assert output.read_text() == "Hello world"
+        stat = output.stat()
+
+        (Path(repo) / "toto" / "test").write_text("Good bye")
+        subprocess.check_call(["git", "commit", "-a", "-m", "Other"], cwd=repo, stderr=subprocess.STDOUT)
+        await git.refresh()
+        # The output of the unchanged template is kept, with its render cache
+        assert Path("/config/test_git/toto/test").read_text() == "Good bye"
+        assert output.stat().st_ino == stat.st_ino
+        assert output.stat().st_mtime_ns == stat.st_mtime_ns
+        assert await base._get_templates_cache_path("test_git").is_file()
+    finally:
+        await git.delete()
+    assert not await base._get_templates_cache_path("test_git").exists()
+
+
+@pytest.mark.asyncio
+async def test_git_unchanged(repo, monkeypatch) -> None:
+    await base.init()
+    git = registry._create_source("test_git", {"type": "git", "repo": str(repo)})
+    try:
+        await git.refresh()
+        assert git._changes is not None
+        assert git._changes.changed
+
+        # Nothing copied, the tarball isn't built again
+        async def build(*args: object) -> None:
+            raise AssertionError(args)
+
+        await git.refresh()
+        assert git._changes == index.Changes()
+        monkeypatch.setattr(tarball, "build", build)
+        await git.refresh()
+    finally:
+        await git.delete()
+
+
+@pytest.mark.asyncio
+async def test_git_shared_worktree(repo) -> None:
+    await base.init()
+    git = registry._create_source("test_git", {"type": "git", "repo": str(repo)})
+    other = registry._create_source("test_other", {"type": "git", "repo": str(repo)})
+    git.use_worktree()
+    other.use_worktree()
+    await git.refresh()
+    await other.refresh()
+    worktree = Path(git._clone_dir())
+    assert worktree == Path(other._clone_dir())
+
+    # The worktree is kept while another source uses it
+    await git.delete()
+    assert (worktree / ".git").is_file()
+    await other.refresh()
+    assert Path("/config/test_other/toto/test").is_file()
+
+    await other.delete()
+    assert not worktree.exists()
+
+
+@pytest.mark.asyncio
+async def test_git_refresh_to(repo, monkeypatch) -> None:
+    fetches = []
+    run = process.run
+
+    async def count_run(*args, **kwargs) -> str:
+        if args[:2] == ("git", "fetch"):
+            fetches.append(args)
+        return await run(*args, **kwargs)
+
+    monkeypatch.setattr(process, "run", count_run)
+    await base.init()
+    git = registry._create_source("test_git", {"type": "git", "repo": str(repo)})
+    await git.refresh()
+    first = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repo).decode().strip()
+    # Redelivered webhook
+    assert not await git.refresh_to(first)
+
+    with (Path(repo) / "toto" / "test").open("w") as file:
+        file.write("Good bye")
+    subprocess.check_call(
+        ["git", "commit", "-a", "-m", "Second commit"],
+        cwd=repo,
+        stderr=subprocess.STDOUT,
+    )
+    second = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repo).decode().strip()
+    fetches.clear()
+    try:
+        assert await git.refresh_to(second)
+        assert await git.get_commit() == second
+        # The checkout reuses the fetched head
+        assert len(fetches) == 1
+        with Path("/config/test_git/toto/test").open() as file:
+            assert file.read() == "Good bye"
+        # Out of order webhook
+        assert not await git.refresh_to(first)
+        assert await git.get_commit() == second
+
+        # Branch reset to an older commit (force push)
+        subprocess.check_call(["git", "reset", "--quiet", "--hard", first], cwd=repo)
+        assert await git.refresh_to(first)
+        assert await git.get_commit() == first
+        with Path("/config/test_git/toto/test").open() as file:
+            assert file.read() == "Hello world"
+    finally:
+        await git.delete()
+
+
 @pytest.mark.skipif(os.environ.get("PRIVATE_SSH_KEY") is not None, reason="We needs to have the key")
 @pytest.mark.asyncio
 async def test_git_with_key() -> None:
@@ -155,3 +280,64 @@ async def test_git_with_key() -> None:
 
     await git.refresh()
     assert Path("/config/test_key/README.md").is_file()
+
+
+@pytest.mark.asyncio
+async def test_git_sub_dir_version(repo) -> None:
+    await base.init()
+    git = registry._create_source("test_git", {"type": "git", "repo": str(repo), "sub_dir": "toto"})
+    await git.refresh()
+    version = await git.get_version()
+    tree = subprocess.check_output(["git", "rev-parse", "HEAD:toto"], cwd=repo).decode().strip()
+    assert (await git._read_stats())["tree"] == tree
+    assert version == git._get_version(tree)
+    assert tarball.get("test_git").version == version
+    # The config and the template data are part of the version
+    other = registry._create_source(
+        "test_git",
+        {
+            "type": "git",
+            "repo": str(repo),
+            "sub_dir": "toto",
+            "template_engines": [{"type": "shell", "data": {"key": "value"}}],
+        },
+    )
+    assert other._get_version(tree) != version
+
+    # Commit outside of the sub directory
+    with (Path(repo) / "other").open("w") as file:
+        file.write("other")
+    subprocess.check_call(["git", "add", "other"], cwd=repo, stderr=subprocess.STDOUT)
+    subprocess.check_call(
+        ["git", "commit", "-m", "Other commit"],
+        cwd=repo,
+        stderr=subprocess.STDOUT,
+    )
+    commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repo).decode().strip()
+    try:
+        # Only recorded
+        assert not await git.refresh_to(commit)
+        assert await git.get_commit() == commit
+        assert await git.get_version() == version
+    finally:
+        await git.delete()
+
+
+def test_is_touched() -> None:
+    git = registry._create_source(
+        "test_git",
+        {
+            "type": "git",
+            "repo": "https://example.com/repo.git",
+            "sub_dir": "toto",
+            "excludes": ["*.md", "tmp/"],
+        },
+    )
+    assert git.is_touched(["toto/test"])
+    assert git.is_touched(["other", "toto/sub/test"])
+    assert not git.is_touched(["other", "toto2/test"])
+    assert not git.is_touched(["toto/README.md", "toto/tmp/test"])
+    assert not git.is_touched([])
+
+    git = registry._create_source("test_git", {"type": "git", "repo": "https://example.com/repo.git"})
+    assert git.is_touched(["other"])
@@ -3,8 +3,8 @@ import asyncio
 
 import pytest
 
-from shared_config_manager import config, configuration
-from shared_config_manager.sources import registry
+from shared_config_manager import config, configuration, repositories
+from shared_config_manager.sources import base, git, mode, registry
 
 
 class _ConcurrencyProbe:
@@ -71,3 +71,95 @@ async def test_do_handle_master_config_loads_sources_concurrently(monkeypatch: p
     assert success == 5
     assert errors == 0
     assert probe.max_active == 2
+
+
+class _DummyGitSource(git.GitSource):
+    async def refresh_or_fetch(self) -> None:
+        pass
+
+    async def delete(self) -> None:
+        pass
+
+
+@pytest.mark.asyncio
+async def test_git_sources_index(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(registry, "_SOURCES", {})
+    monkeypatch.setattr(registry, "FILTERED_SOURCES", {})
+    monkeypatch.setattr(registry, "_GIT_SOURCES_INDEX", {})
+    monkeypatch.setattr(config.settings.slave, "tag_filter", None)
+    monkeypatch.setattr(
+        registry,
+        "_create_source",
+        lambda source_id, source_config, is_master=False: _DummyGitSource(
+            source_id, source_config, is_master
+        ),
+    )
+
+    sources: dict[str, configuration.SourceConfig] = {
+        "first": {"type": "git", "repo": "git@github.com:camptocamp/first.git"},
+        "other_branch": {"type": "git", "repo": "git@github.com:camptocamp/first.git", "branch": "other"},
+        "second": {"type": "git", "repo": "https://github.com/camptocamp/second"},
+    }
+    await registry._do_handle_master_config({"sources": sources})
+
+    def get_ids(branch: str, repository_urls: list[str] | None = None) -> list[str]:
+        return [source.get_id() for source in registry.get_git_sources(branch, repository_urls)]
+
+    assert get_ids("master") == ["first", "second"]
+    assert get_ids("master", ["github.com/camptocamp/first"]) == ["first"]
+    assert get_ids("other", ["github.com/camptocamp/first"]) == ["other_branch"]
+    assert get_ids("master", ["github.com/camptocamp/unknown"]) == []
+
+    # Moved to another repository
+    sources["first"] = {"type": "git", "repo": "https://github.com/camptocamp/second.git"}
+    del sources["other_branch"]
+    await registry._do_handle_master_config({"sources": sources})
+    assert get_ids("master", ["github.com/camptocamp/first"]) == []
+    assert get_ids("master", ["github.com/camptocamp/second"]) == ["first", "second"]
+    assert {"master": {"github.com/camptocamp/second": {"first", "second"}}} == registry._GIT_SOURCES_INDEX
+
+
+class _FailingGitSource(git.GitSource):
+    async def refresh_or_fetch(self) -> None:
+        if self.get_id() == "failing":
+            raise RuntimeError
+
+
+@pytest.mark.asyncio
+async def test_git_worktree_users(monkeypatch: pytest.MonkeyPatch) -> None:
+    removed = []
+
+    async def remove_worktree(repository: object, path: object) -> None:
+        del repository
+        removed.append(path)
+
+    async def delete(self: base.BaseSource) -> None:
+        del self
+
+    monkeypatch.setattr(registry, "_SOURCES", {})
+    monkeypatch.setattr(registry, "FILTERED_SOURCES", {})
+    monkeypatch.setattr(registry, "_GIT_SOURCES_INDEX", {})
+    monkeypatch.setattr(repositories, "_WORKTREE_USERS", {})
+    monkeypatch.setattr(repositories, "_remove_worktree", remove_worktree)
+    monkeypatch.setattr(base.BaseSource, "delete", delete)
+    monkeypatch.setattr(mode, "is_master", lambda: True)
+    monkeypatch.setattr(config.settings.slave, "tag_filter", None)
+    monkeypatch.setattr(
+        registry,
+        "_create_source",
+        lambda source_id, source_config, is_master=False: _FailingGitSource(
+            source_id, source_config, is_master
+        ),
+    )
+
+    source_config: configuration.SourceConfig = {"type": "git", "repo": "https://github.com/camptocamp/first"}
+    path = repositories.get_worktree_path(source_config["repo"], "master")
+    # The worktree isn't used by the source that failed to load
+    await registry._do_handle_master_config({"sources": {"ok": source_config, "failing": source_config}})
+    assert {path: 1} == repositories._WORKTREE_USERS
+    await registry._do_handle_master_config({"sources": {"ok": source_config, "failing": source_config}})
+    assert {path: 1} == repositories._WORKTREE_USERS
+
+    await registry._do_handle_master_config({"sources": {}})
+    assert not repositories._WORKTREE_USERS
+    assert removed == [path]
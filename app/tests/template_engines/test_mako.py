@@ -5,7 +5,7 @@ import pathlib
 import pytest
 from anyio import Path as AnyioPath
 
-from shared_config_manager import template_engines
+from shared_config_manager import config, template_engines
 
 
 @pytest.mark.asyncio
@@ -21,3 +21,149 @@ async def test_ok(temp_dir) -> None:
 
     with file_path.open() as input_:
         assert input_.read() == "Hello world\n"
+
+
+@pytest.mark.asyncio
+async def test_unchanged(temp_dir) -> None:
+    engine = template_engines.create_engine("test", {"type": "mako", "data": {"param": "world"}})
+
+    file_path = pathlib.Path(temp_dir) / "file1"
+    file_path.with_suffix(".mako").write_text("Hello ${param}\n")
+    files = [AnyioPath("file1.mako")]
+    outputs = await engine.evaluate(AnyioPath(temp_dir), files)
+    assert outputs == [AnyioPath(temp_dir) / "file1"]
+    stat = file_path.stat()
+
+    # An unchanged result is not written
+    await engine.evaluate(AnyioPath(temp_dir), files)
+    assert file_path.stat().st_ino == stat.st_ino
+    assert file_path.stat().st_mtime_ns == stat.st_mtime_ns
+
+
+@pytest.mark.asyncio
+async def test_cache(temp_dir) -> None:
+    root = pathlib.Path(temp_dir)
+    (root / "layouts").mkdir()
+    (root / "layouts" / "base.html").write_text("<html>${self.body()}</html>")
+    (root / "layouts" / "header.html").write_text("header")
+    (root / "page.mako").write_text(
+        '<%inherit file="layouts/base.html"/><%include file="layouts/header.html"/>'
+    )
+    (root / "other.mako").write_text("Hello ${param}")
+    files = [AnyioPath(p.relative_to(root)) for p in root.glob("**/*") if p.is_file()]
+    evaluated: list[str] = []
+
+    def create_engine(param: str) -> template_engines.base.BaseEngine:
+        engine = template_engines.create_engine("test", {"type": "mako", "data": {"param": param}})
+        evaluate_files = engine._evaluate_files
+
+        async def count_evaluate_files(root_dir, templates) -> list[set[str] | Exception]:
+            evaluated.extend(src_path.name for src_path, _ in templates)
+            return await evaluate_files(root_dir, templates)
+
+        engine._evaluate_files = count_evaluate_files  # type: ignore[method-assign]
+        return engine
+
+    async def evaluate(engine: template_engines.base.BaseEngine) -> list[str]:
+        evaluated.clear()
+        await engine.evaluate(AnyioPath(temp_dir), files, cache)
+        return sorted(evaluated)
+
+    engine = create_engine("world")
+    cache: template_engines.base.RenderCache = {}
+    assert await evaluate(engine) == ["other.mako", "page.mako"]
+    assert (root / "page").read_text() == "<html>header</html>"
+    assert cache["page.mako"]["dependencies"] == ["layouts/base.html", "layouts/header.html"]
+    assert cache["other.mako"]["dependencies"] == []
+
+    # Unchanged
+    assert await evaluate(engine) == []
+
+    # Only the dependents of a changed layout are evaluated again
+    (root / "layouts" / "header.html").write_text("new header")
+    assert await evaluate(engine) == ["page.mako"]
+    assert (root / "page").read_text() == "<html>new header</html>"
+
+    # A modified or a deleted output is evaluated again
+    (root / "other").write_text("modified")
+    (root / "page").unlink()
+    assert await evaluate(engine) == ["other.mako", "page.mako"]
+    assert (root / "other").read_text() == "Hello world"
+
+    # The data changed
+    assert await evaluate(create_engine("you")) == ["other.mako", "page.mako"]
+    assert (root / "other").read_text() == "Hello you"
+
+    # The known hashes are used instead of reading the files
+    evaluated.clear()
+    await create_engine("you").evaluate(AnyioPath(temp_dir), files, cache, {"layouts/header.html": "wrong"})
+    assert evaluated == ["page.mako"]
+
+    # A deleted template is removed from the cache
+    assert await engine.evaluate(AnyioPath(temp_dir), [AnyioPath("other.mako")], cache)
+    assert list(cache) == ["other.mako"]
+
+
+@pytest.mark.asyncio
+async def test_processes(temp_dir, monkeypatch) -> None:
+    monkeypatch.setattr(template_engines.mako, "_BATCH_SIZE", 2)
+    root = pathlib.Path(temp_dir)
+    (root / "pid.mako").write_text("<% import os %>${os.getpid()}")
+    (root / "error.mako").write_text("${undefined.value}")
+    (root / "syntax.mako").write_text("% for\n")
+    (root / "ok.mako").write_text("Hello ${param}")
+    files = [AnyioPath("pid.mako"), AnyioPath("error.mako"), AnyioPath("syntax.mako"), AnyioPath("ok.mako")]
+    engine = template_engines.create_engine("test", {"type": "mako", "data": {"param": "world"}})
+
+    outputs = await engine.evaluate(AnyioPath(temp_dir), files)
+    # Rendered out of the event loop process, the errors don't affect the other templates
+    assert int((root / "pid").read_text()) != os.getpid()
+    assert (root / "ok").read_text() == "Hello world"
+    assert sorted(output.name for output in outputs) == ["ok", "pid"]
+    assert not (root / "error").exists()
+    assert not (root / "syntax").exists()
+    assert not list(root.glob(".*.tmp"))
+
+
+@pytest.mark.asyncio
+async def test_module_dir(temp_dir, monkeypatch) -> None:
+    root = pathlib.Path(temp_dir) / "root"
+    module_dir = pathlib.Path(temp_dir) / "modules"
+    monkeypatch.setattr(config.settings.template, "module_dir", AnyioPath(module_dir))
+    root.mkdir()
+    (root / "file.mako").write_text("% for i in range(3):\n${param}${i}\n% endfor\n")
+    engine = template_engines.create_engine("test", {"type": "mako", "data": {"param": "a"}})
+
+    await engine.evaluate(AnyioPath(root), [AnyioPath("file.mako")])
+    assert (root / "file").read_text() == "a0\na1\na2\n"
+    modules = list(module_dir.glob("*/*.py"))
+    assert len(modules) == 1
+
+    # The compiled module is reused
+    os.utime(modules[0], ns=(0, 2**62))
+    engine = template_engines.create_engine("test", {"type": "mako", "data": {"param": "b"}})
+    await engine.evaluate(AnyioPath(root), [AnyioPath("file.mako")])
+    assert (root / "file").read_text() == "b0\nb1\nb2\n"
+    assert list(module_dir.glob("*/*.py")) == modules
+    assert modules[0].stat().st_mtime_ns == 2**62
+
+    # A changed template gets a new module
+    (root / "file.mako").write_text("${param}")
+    await engine.evaluate(AnyioPath(root), [AnyioPath("file.mako")])
+    assert (root / "file").read_text() == "b"
+    assert len(list(module_dir.glob("*/*.py"))) == 2
+
+
+@pytest.mark.asyncio
+async def test_shutdown(temp_dir) -> None:
+    engine = template_engines.create_engine("test", {"type": "mako", "data": {"param": "world"}})
+    file_path = pathlib.Path(temp_dir) / "file1"
+    file_path.with_suffix(".mako").write_text("Hello ${param}\n")
+    await engine.evaluate(AnyioPath(temp_dir), [AnyioPath("file1.mako")])
+
+    template_engines.mako.shutdown()
+    assert template_engines.mako._EXECUTOR is None
+    # The pool is created again for the next evaluations
+    file_path.unlink()
+    await engine.evaluate(AnyioPath(temp_dir), [AnyioPath("file1.mako")])
+    assert file_path.read_text() == "Hello world\n"
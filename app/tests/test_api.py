@@ -0,0 +1,42 @@
+# Copyright (c) 2026, Camptocamp SA
+from shared_config_manager import api, tarball
+
+
+def test_payload_changed_paths() -> None:
+    payload = api.SourceRefPayload(
+        ref="refs/heads/master",
+        commits=[
+            api.PushCommit(added=["a"], modified=["b"]),
+            api.PushCommit(removed=["c"]),
+        ],
+    )
+    assert payload.get_changed_paths() == {"a", "b", "c"}
+    # Truncated
+    assert api.SourceRefPayload(commits=[api.PushCommit()] * 20).get_changed_paths() is None
+    assert api.SourceRefPayload(commits=[api.PushCommit()], total_commits_count=2).get_changed_paths() is None
+    assert api.SourceRefPayload().get_changed_paths() is None
+
+
+def test_payload_commit() -> None:
+    assert api.SourceRefPayload(after="a" * 40).get_commit() == "a" * 40
+    assert api.SourceRefPayload(after="0" * 40).get_commit() is None
+    assert api.SourceRefPayload(after="master").get_commit() is None
+
+
+def test_repository_matches() -> None:
+    repository = api.PushRepository(
+        clone_url="https://github.com/camptocamp/test_git.git",
+        ssh_url="git@github.com:camptocamp/test_git.git",
+    )
+    assert repository.matches("git@github.com:camptocamp/test_git.git")
+    assert repository.matches("ssh://git@github.com/camptocamp/test_git")
+    assert repository.matches("https://github.com/Camptocamp/test_git")
+    assert not repository.matches("git@github.com:camptocamp/other.git")
+
+
+def test_etag_matches_compression() -> None:
+    assert api._etag_matches('"abcd"', tarball.get_etag("abcd"))
+    assert not api._etag_matches('"abcd"', tarball.get_etag("abcd", "zstd"))
+    assert api._etag_matches('"abcd", W/"abcd-zst"', tarball.get_etag("abcd", "zstd"))
+    assert tarball.get_etag_version(tarball.get_etag("abcd", "zstd")) == "abcd"
+    assert tarball.get_etag_version('W/"abcd"') == "abcd"
@@ -0,0 +1,99 @@
+# Copyright (c) 2026, Camptocamp SA
+import io
+import os
+import time
+from typing import TYPE_CHECKING
+
+from shared_config_manager import blocks, manifest
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+def _patch(tmp_path: Path, old: bytes, new: bytes, block_size: int) -> list[int]:
+    """Patch the old copy like a slave, returns the missing blocks."""
+    (tmp_path / "old").write_bytes(old)
+    (tmp_path / "new").write_bytes(new)
+    offsets = blocks.match(
+        tmp_path / "old", len(new), block_size, blocks.signatures(io.BytesIO(new), block_size)
+    )
+    missing = [index for index, offset in enumerate(offsets) if offset < 0]
+    sent = b"".join(blocks.stream(tmp_path / "new", len(new), block_size, missing))
+    result = bytearray()
+    position = 0
+    for index, offset in enumerate(offsets):
+        length = blocks.block_length(len(new), block_size, index)
+        if offset < 0:
+            result += sent[position : position + length]
+            position += length
+        else:
+            result += old[offset : offset + length]
+    assert position == len(sent)
+    assert result == new
+    return missing
+
+
+def test_match(tmp_path: Path) -> None:
+    old = b"a" * 4 + b"b" * 4 + b"c" * 4 + b"d" * 2
+    new = b"a" * 4 + b"x" * 4 + b"c" * 4 + b"b" * 4 + b"d" * 2
+    assert _patch(tmp_path, old, new, 4) == [1]
+
+
+def test_match_insertion(tmp_path: Path) -> None:
+    old = os.urandom(64 * 1024)
+    # The blocks following an insertion or a deletion are found at their new offset
+    assert _patch(tmp_path, old, b"inserted" + old, 1024) == [0]
+    assert _patch(tmp_path, old, old[:1000] + old[1010:], 1024) == [0]
+
+
+def test_match_changed(tmp_path: Path) -> None:
+    old = os.urandom(64 * 1024)
+    new = old[: 16 * 1024] + os.urandom(16 * 1024) + old[32 * 1024 + 5 :]
+    # The rolling is bounded on the changed content, at most the skipped blocks are fetched again
+    missing = _patch(tmp_path, old, new, 1024)
+    assert missing[:16] == list(range(16, 32))
+    assert len(missing) <= 16 + blocks._SKIPPED_BLOCKS
+
+
+def test_match_large(tmp_path: Path) -> None:
+    block_size = 64 * 1024
+    old = os.urandom(32 * 1024 * 1024)
+    # Modified in place, the unchanged blocks are compared at their offset
+    new = bytearray(old)
+    for offset in (0, 5 * 1024 * 1024, 20 * 1024 * 1024 + 10):
+        new[offset : offset + 100] = os.urandom(100)
+    start = time.monotonic()
+    assert _patch(tmp_path, old, bytes(new), block_size) == [0, 80, 320]
+    # Completely changed, the rolling is limited
+    new = os.urandom(len(old))
+    assert len(_patch(tmp_path, old, new, block_size)) == len(old) // block_size
+    assert time.monotonic() - start < 10
+
+
+def test_match_without_old(tmp_path: Path) -> None:
+    assert _patch(tmp_path, b"", b"0123456789", 4) == [0, 1, 2]
+    assert blocks.match(tmp_path / "missing", 10, 4, ["00000000"] * 3) == [-1, -1, -1]
+
+
+def test_manifest_blocks(tmp_path: Path) -> None:
+    (tmp_path / "small").write_bytes(b"small")
+    (tmp_path / "large").write_bytes(b"0123456789")
+    source_manifest = manifest.build(tmp_path, 4, 8)
+    assert "blocks" not in source_manifest["small"]
+    assert source_manifest["large"]["blocks"] == blocks.signatures(io.BytesIO(b"0123456789"), 4)
+    assert source_manifest["large"]["hash"] == manifest.build(tmp_path)["large"]["hash"]
+
+
+def test_manifest_reuse_blocks(tmp_path: Path) -> None:
+    (tmp_path / "large").write_bytes(b"0123456789")
+    stat = (tmp_path / "large").stat()
+    previous = manifest.build(tmp_path, 4, 8)
+    previous["large"]["blocks"] = ["reused"] * 3
+    known_hashes = {"large": ([stat.st_size, stat.st_mtime_ns, stat.st_ino], previous["large"]["hash"])}
+
+    # The blocks of an unchanged file are not computed again
+    assert manifest.build(tmp_path, 4, 8, known_hashes, previous)["large"]["blocks"] == ["reused"] * 3
+    # Unless the block size changed
+    assert manifest.build(tmp_path, 2, 8, known_hashes, previous)["large"]["blocks"] == blocks.signatures(
+        io.BytesIO(b"0123456789"), 2
+    )
@@ -0,0 +1,126 @@
+# Copyright (c) 2026, Camptocamp SA
+import tarfile
+from typing import TYPE_CHECKING
+
+from shared_config_manager import delta, manifest
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+def _write(path: Path, content: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+def test_diff(tmp_path) -> None:
+    _write(tmp_path / "same", "same")
+    _write(tmp_path / "changed", "before")
+    _write(tmp_path / "deleted" / "file", "deleted")
+    base = manifest.build(tmp_path)
+    assert base["same"]["type"] == "file"
+    assert base["deleted"]["type"] == "dir"
+
+    _write(tmp_path / "changed", "after")
+    _write(tmp_path / "added", "added")
+    (tmp_path / "deleted" / "file").unlink()
+    (tmp_path / "deleted").rmdir()
+    current = manifest.build(tmp_path)
+
+    changed, deleted = manifest.diff(base, current)
+    assert changed == ["added", "changed"]
+    assert deleted == ["deleted"]
+
+
+def test_build_apply(tmp_path) -> None:
+    master = tmp_path / "master"
+    slave = tmp_path / "slave"
+    for root in (master, slave):
+        _write(root / "same", "same")
+        _write(root / "changed", "before")
+        _write(root / "dir" / "deleted", "deleted")
+        _write(root / ".gitstats", '{"hash": "1"}')
+    base = manifest.build(master)
+    same_inode = (slave / "same").stat().st_ino
+
+    _write(master / "changed", "after")
+    _write(master / "new" / "added", "added")
+    _write(master / ".gitstats", '{"hash": "2"}')
+    (master / "dir" / "deleted").unlink()
+    changed, deleted = manifest.diff(base, manifest.build(master))
+
+    archive = tmp_path / "delta.tar.gz"
+    delta.build(master, archive, {"base": "1", "version": "2", "deleted": deleted}, changed)
+    info = delta.apply(archive, slave)
+
+    assert info["version"] == "2"
+    assert manifest.build(slave) == manifest.build(master)
+    assert (slave / "same").stat().st_ino == same_inode
+    assert not (slave / delta.DELTA_MEMBER).exists()
+
+
+def test_extract(tmp_path) -> None:
+    master = tmp_path / "master"
+    slave = tmp_path / "slave"
+    for root in (master, slave):
+        _write(root / "same", "same")
+        _write(root / "changed", "before")
+        _write(root / "dir" / "deleted", "deleted")
+    _write(master / "new" / "added", "added")
+    _write(master / "changed", "after")
+    (master / "dir" / "deleted").unlink()
+    same_stat = (slave / "same").stat()
+
+    archive = tmp_path / "full.tar.gz"
+    with tarfile.open(archive, "w:gz") as tar:
+        for path in sorted(master.iterdir()):
+            tar.add(path, arcname=path.name)
+    with archive.open("rb") as file:
+        stats = delta.extract(file, slave)
+
+    assert manifest.build(slave) == manifest.build(master)
+    assert (slave / "same").stat().st_ino == same_stat.st_ino
+    assert (slave / "same").stat().st_mtime_ns == same_stat.st_mtime_ns
+    assert stats == {"written": 3, "unchanged": 2, "deleted": 1}
+
+
+def test_extract_mode(tmp_path) -> None:
+    master = tmp_path / "master"
+    slave = tmp_path / "slave"
+    _write(master / "file", "same")
+    (master / "file").chmod(0o755)
+    _write(slave / "file", "same")
+    (slave / "file").chmod(0o644)
+    # Shared with a previous generation
+    (tmp_path / "previous").hardlink_to(slave / "file")
+
+    archive = tmp_path / "full.tar.gz"
+    with tarfile.open(archive, "w:gz") as tar:
+        tar.add(master / "file", arcname="file")
+    with archive.open("rb") as file:
+        stats = delta.extract(file, slave)
+
+    assert stats["written"] == 1
+    assert (slave / "file").stat().st_mode & 0o777 == 0o755
+    assert (tmp_path / "previous").stat().st_mode & 0o777 == 0o644
+
+
+def test_extract_keep(tmp_path) -> None:
+    master = tmp_path / "master"
+    slave = tmp_path / "slave"
+    _write(master / "file", "file")
+    _write(slave / "file", "file")
+    _write(slave / "rendered", "rendered")
+    _write(slave / "dest" / "rendered", "rendered")
+    _write(slave / "dest" / "deleted", "deleted")
+
+    archive = tmp_path / "full.tar.gz"
+    with tarfile.open(archive, "w:gz") as tar:
+        tar.add(master / "file", arcname="file")
+    with archive.open("rb") as file:
+        stats = delta.extract(file, slave, keep={"rendered", "dest/rendered"})
+
+    assert stats == {"written": 0, "unchanged": 1, "deleted": 1}
+    assert (slave / "rendered").is_file()
+    assert (slave / "dest" / "rendered").is_file()
+    assert not (slave / "dest" / "deleted").exists()
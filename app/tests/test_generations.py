@@ -0,0 +1,63 @@
+# Copyright (c) 2026, Camptocamp SA
+import errno
+
+import pytest
+from anyio import Path as AnyioPath
+
+from shared_config_manager import generations
+
+
+@pytest.mark.asyncio
+async def test_generations(tmp_path) -> None:
+    path = AnyioPath(tmp_path / "target")
+    await path.mkdir()
+    await (path / "same").write_text("same")
+    same_inode = (await (path / "same").stat()).st_ino
+
+    # The content extracted in place becomes the first generation
+    first = await generations.create(path)
+    assert await path.is_symlink()
+    assert await generations.get_current(path) == "000000"
+    assert first.name == "000001"
+    assert (await (first / "same").stat()).st_ino == same_inode
+
+    await generations.publish(path, first)
+    assert await generations.get_current(path) == "000001"
+    assert await (path / "same").read_text() == "same"
+
+    second = await generations.create(path)
+    await generations.publish(path, second)
+    await generations.prune(path, 1)
+    assert await generations.get_names(path) == ["000001", "000002"]
+
+    assert await generations.rollback(path) == "000001"
+    assert await generations.get_current(path) == "000001"
+    assert await generations.rollback(path, "000002") == "000002"
+    with pytest.raises(ValueError, match="Unknown generation"):
+        await generations.rollback(path, "../other")
+
+    await generations.delete(path)
+    assert not await path.exists()
+    assert not await generations.get_dir(path).exists()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("exchange", [True, False])
+async def test_migrate(tmp_path, monkeypatch, exchange: bool) -> None:
+    if not exchange:
+
+        def not_supported(*args: object) -> None:
+            raise OSError(errno.ENOSYS, "Not supported")
+
+        monkeypatch.setattr(generations, "_exchange", not_supported)
+    path = AnyioPath(tmp_path / "target")
+    await (path / "sub").mkdir(parents=True)
+    await (path / "sub" / "file").write_text("file")
+    # Left by an interrupted migration
+    await (generations.get_dir(path) / "000000").mkdir(parents=True)
+
+    await generations.create(path)
+    assert await generations.get_current(path) == "000000"
+    assert await (path / "sub" / "file").read_text() == "file"
+    # Without the temporary names
+    assert sorted(child.name for child in tmp_path.iterdir()) == [".target.generations", "target"]
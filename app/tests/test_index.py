@@ -0,0 +1,111 @@
+# Copyright (c) 2026, Camptocamp SA
+import os
+
+from anyio import Path as AnyioPath
+
+from shared_config_manager import config, index, manifest
+
+
+def test_copy(tmp_path) -> None:
+    source = tmp_path / "source"
+    target = tmp_path / "target"
+    (source / "sub").mkdir(parents=True)
+    (source / "same").write_text("same")
+    (source / "changed").write_text("old")
+    (source / "deleted").write_text("deleted")
+    (source / "sub" / "file").write_text("file")
+    (source / "link").symlink_to("same")
+    (source / ".git").mkdir()
+    (source / ".git" / "HEAD").write_text("ref")
+
+    changes = index.copy(source, target, tmp_path / "index.json", [".git"])
+    assert sorted(changes.changed) == ["changed", "deleted", "link", "same", "sub", "sub/file"]
+    assert not (target / ".git").exists()
+    assert (target / "link").readlink().as_posix() == "same"
+    assert (tmp_path / "index.json").is_file()
+
+    same_inode = (target / "same").stat().st_ino
+    (target / "rendered").write_text("rendered")
+    (source / "changed").write_text("new")
+    (source / "deleted").unlink()
+
+    changes = index.copy(source, target, tmp_path / "index.json", [".git", "/rendered"])
+    assert changes.changed == ["changed"]
+    assert changes.deleted == ["deleted"]
+    assert (target / "changed").read_text() == "new"
+    assert (target / "same").stat().st_ino == same_inode
+    # Excluded, not deleted
+    assert (target / "rendered").is_file()
+
+    # Only the metadata changed
+    os.utime(source / "same", ns=(0, 0))
+    assert index.copy(source, target, tmp_path / "index.json", [".git", "/rendered"]).changed == []
+
+    # The copied file was modified
+    (target / "sub" / "file").write_text("modified")
+    assert index.copy(source, target, tmp_path / "index.json", [".git", "/rendered"]).changed == ["sub/file"]
+    assert (target / "sub" / "file").read_text() == "file"
+
+    index.delete(tmp_path / "index.json")
+    assert not (tmp_path / "index.json").exists()
+
+
+def test_copy_oids(tmp_path) -> None:
+    source = tmp_path / "source"
+    target = tmp_path / "target"
+    source.mkdir()
+    (source / "file").write_text("file")
+    index.copy(source, target, tmp_path / "index.json", [], {"file": "1234"})
+
+    # Touched by a checkout, but same object
+    (source / "file").write_text("file")
+    os.utime(source / "file", ns=(0, 0))
+    assert index.copy(source, target, tmp_path / "index.json", [], {"file": "1234"}).changed == []
+    (source / "file").write_text("new")
+    assert index.copy(source, target, tmp_path / "index.json", [], {"file": "5678"}).changed == ["file"]
+    assert (target / "file").read_text() == "new"
+
+
+def test_manifest_known_hashes(tmp_path) -> None:
+    source = tmp_path / "source"
+    target = tmp_path / "target"
+    source.mkdir()
+    (source / "file").write_text("file")
+    index.copy(source, target, tmp_path / "index.json", [])
+    known_hashes = index.get_hashes(tmp_path / "index.json")
+    assert manifest.build(target, known_hashes=known_hashes) == manifest.build(target)
+    # The hash is taken from the index
+    known_hashes["file"] = (known_hashes["file"][0], "known")
+    assert manifest.build(target, known_hashes=known_hashes)["file"]["hash"] == "known"
+
+
+def test_copy_modes(tmp_path) -> None:
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "file").write_text("file")
+    (source / "file").chmod(0o640)
+
+    for mode in ("copy", "reflink", "hardlink"):
+        target = tmp_path / mode
+        assert index.copy(source, target, tmp_path / "index.json", [], mode=mode).changed == ["file"]
+        assert (target / "file").read_text() == "file"
+        assert (target / "file").stat().st_mode & 0o777 == 0o640
+        assert index.copy(source, target, tmp_path / "index.json", [], mode=mode).changed == []
+    assert (tmp_path / "hardlink" / "file").samefile(source / "file")
+    assert not (tmp_path / "copy" / "file").samefile(source / "file")
+
+    # Replaced in the source, the link is broken
+    (source / "file").unlink()
+    (source / "file").write_text("new")
+    assert index.copy(
+        source, tmp_path / "hardlink", tmp_path / "hardlink.json", [], mode="hardlink"
+    ).changed == ["file"]
+    assert (tmp_path / "hardlink" / "file").read_text() == "new"
+
+
+def test_get_path(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(config.settings, "index_dir", AnyioPath(tmp_path / "indexes"))
+    # Not next to the target directory, possibly not writable
+    assert index.get_path("master") == tmp_path / "indexes" / "master.json"
+    index.copy(tmp_path, tmp_path / "target", index.get_path("master"), ["/target", "/indexes"])
+    assert index.get_path("master").is_file()
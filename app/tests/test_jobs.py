@@ -0,0 +1,58 @@
+# Copyright (c) 2026, Camptocamp SA
+import asyncio
+
+import pytest
+
+from shared_config_manager import jobs, scheduler
+
+
+@pytest.mark.asyncio
+async def test_job() -> None:
+    release = asyncio.Event()
+
+    async def refresh(source_id: str) -> str | None:
+        if source_id == "error":
+            message = "Error"
+            raise ValueError(message)
+        if source_id == "ignored":
+            return "Already up to date"
+        await scheduler.run(scheduler.Priority.MANUAL, release.wait, source_id)
+        return None
+
+    job = jobs.start(["refreshed", "ignored", "error"], refresh)
+    assert jobs.get(job.id) is job
+    assert not await job.wait(0.01)
+    assert job.get_status() == "running"
+    assert job.get_phases() == {"refreshed": "running", "ignored": "ignored", "error": "error"}
+
+    release.set()
+    assert await job.wait(1)
+    assert job.get_status() == "error"
+    assert job.get_phases() == {"refreshed": "refreshed", "ignored": "ignored", "error": "error"}
+    assert job.refreshed == {"refreshed"}
+    assert job.ignored == {"ignored": "Already up to date"}
+    assert str(job.errors["error"]) == "Error"
+    # Fixed once finished
+    assert job.get_duration() == job.get_duration()
+
+
+@pytest.mark.asyncio
+async def test_evict(monkeypatch) -> None:
+    monkeypatch.setattr(jobs, "_MAX_JOBS", 2)
+    monkeypatch.setattr(jobs, "_JOBS", {})
+    release = asyncio.Event()
+
+    async def refresh(source_id: str) -> None:
+        if source_id == "running":
+            await release.wait()
+
+    running = jobs.start(["running"], refresh)
+    finished = jobs.start(["finished"], refresh)
+    await finished.wait(1)
+    last = jobs.start(["finished"], refresh)
+    # The oldest finished job is evicted, not the running one
+    assert jobs.get(running.id) is running
+    assert jobs.get(finished.id) is None
+    assert jobs.get(last.id) is last
+    release.set()
+    await running.wait(1)
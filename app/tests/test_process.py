@@ -0,0 +1,59 @@
+# Copyright (c) 2026, Camptocamp SA
+import asyncio
+import subprocess
+import time
+
+import pytest
+
+from shared_config_manager import config, process
+
+
+@pytest.mark.asyncio
+async def test_run(tmp_path) -> None:
+    assert await process.run("echo", "Hello", cwd=tmp_path) == "Hello"
+    assert await process.run("cat", input_=b"input") == "input"
+
+
+@pytest.mark.asyncio
+async def test_error() -> None:
+    with pytest.raises(subprocess.CalledProcessError) as exception:
+        await process.run("sh", "-c", "echo error; exit 2")
+    assert exception.value.returncode == 2
+    assert exception.value.output == b"error\n"
+
+
+@pytest.mark.asyncio
+async def test_timeout() -> None:
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        await process.run("sleep", "10", max_duration=0.1)
+    assert time.monotonic() - start < 5
+
+
+@pytest.mark.asyncio
+async def test_cancel() -> None:
+    task = asyncio.create_task(process.run("sleep", "10"))
+    await asyncio.sleep(0.1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+@pytest.mark.asyncio
+async def test_max_output_size(monkeypatch) -> None:
+    monkeypatch.setattr(config.settings.command, "max_output_size", 10)
+    assert await process.run("sh", "-c", "seq 1000") == "999\n1000"
+
+
+@pytest.mark.asyncio
+async def test_pipeline() -> None:
+    assert await process.run_pipeline(["echo", "Hello"], ["tr", "a-z", "A-Z"]) == "HELLO"
+    assert await process.run_pipeline(["cat"], ["wc", "-c"], input_=b"input") == "5"
+    with pytest.raises(subprocess.CalledProcessError) as exception:
+        await process.run_pipeline(["sh", "-c", "echo error >&2; exit 2"], ["cat"])
+    assert exception.value.returncode == 2
+    assert exception.value.output == b"error\n"
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        await process.run_pipeline(["sleep", "10"], ["cat"], max_duration=0.1)
+    assert time.monotonic() - start < 5
@@ -0,0 +1,94 @@
+# Copyright (c) 2026, Camptocamp SA
+import asyncio
+import subprocess
+from pathlib import Path
+
+import pytest
+from anyio import Path as AnyioPath
+
+from shared_config_manager import process, repositories
+
+
+def _git(*args: str, cwd: Path) -> None:
+    subprocess.check_call(
+        ["git", "-c", "user.email=you@example.com", "-c", "user.name=Your Name", *args], cwd=cwd
+    )
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch) -> Path:
+    monkeypatch.setattr(repositories, "STORES_DIR", AnyioPath(tmp_path / "stores"))
+    monkeypatch.setattr(repositories, "WORKTREES_DIR", AnyioPath(tmp_path / "worktrees"))
+    repo_path = tmp_path / "repo"
+    (repo_path / "sub").mkdir(parents=True)
+    (repo_path / "sub" / "file").write_text("sub")
+    (repo_path / "other").mkdir()
+    (repo_path / "other" / "file").write_text("other")
+    (repo_path / "root").write_text("root")
+    _git("init", "--quiet", "--initial-branch=master", cwd=tmp_path / "repo")
+    _git("add", ".", cwd=repo_path)
+    _git("commit", "--quiet", "--message=Initial commit", cwd=repo_path)
+    _git("branch", "other", cwd=repo_path)
+    # Needed to serve the partial clones
+    _git("config", "uploadpack.allowFilter", "true", cwd=repo_path)
+    return repo_path
+
+
+@pytest.mark.asyncio
+async def test_checkout(repo, monkeypatch) -> None:
+    fetches = []
+    run = process.run
+
+    async def count_run(*args, **kwargs) -> str:
+        if args[:2] == ("git", "fetch"):
+            fetches.append(args)
+        return await run(*args, **kwargs)
+
+    monkeypatch.setattr(process, "run", count_run)
+    url = str(repo)
+
+    async def checkout(branch: str, sparse_dir: str | None) -> list[str]:
+        async with repositories.checkout(url, branch, sparse_dir) as path:
+            return sorted(
+                path_.relative_to(path).as_posix()
+                for path_ in Path(path).rglob("*")
+                if ".git" not in path_.parts
+            )
+
+    results = await asyncio.gather(
+        checkout("master", None), checkout("other", None), checkout("master", "sub")
+    )
+    full = ["other", "other/file", "root", "sub", "sub/file"]
+    # The cone mode includes the files of the root directory
+    assert results == [full, full, ["root", "sub", "sub/file"]]
+    # One fetch for the first request, one for the requests received during the first fetch
+    assert len(fetches) <= 2
+
+    (repo / "sub" / "file").write_text("new")
+    _git("commit", "--quiet", "--all", "--message=Update", cwd=repo)
+    async with repositories.checkout(url, "master", "sub") as path:
+        assert await (path / "sub" / "file").read_text() == "new"
+
+    # A broken worktree is recreated
+    await (repositories.get_worktree_path(url, "master") / ".git").write_text("broken")
+    assert await checkout("master", None) == full
+
+    await repositories.remove_worktree(url, "master")
+    assert not await repositories.get_worktree_path(url, "master").exists()
+
+
+@pytest.mark.asyncio
+async def test_get_remote_heads(repo) -> None:
+    head = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repo).decode().strip()
+    heads = await repositories.get_remote_heads(str(repo), ["master", "other", "unknown"])
+    assert heads == {"master": head, "other": head}
+
+
+@pytest.mark.asyncio
+async def test_get_changed_paths(repo) -> None:
+    before = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repo).decode().strip()
+    (repo / "sub" / "file").write_text("new")
+    (repo / "root").unlink()
+    _git("commit", "--quiet", "--all", "--message=Update", cwd=repo)
+    after = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repo).decode().strip()
+    assert await repositories.get_changed_paths(str(repo), "master", before, after) == {"root", "sub/file"}
@@ -0,0 +1,66 @@
+# Copyright (c) 2026, Camptocamp SA
+import asyncio
+
+import pytest
+
+from shared_config_manager import scheduler
+
+
+@pytest.mark.asyncio
+async def test_priority(monkeypatch) -> None:
+    monkeypatch.setattr(scheduler, "_POOLS", {"network": scheduler._Pool("network", 1)})
+    order: list[str] = []
+    release = asyncio.Event()
+
+    async def job(name: str) -> None:
+        async with scheduler.stage("network"):
+            order.append(name)
+            if name == "first":
+                await release.wait()
+
+    first = asyncio.create_task(scheduler.run(scheduler.Priority.STARTUP, lambda: job("first")))
+    await asyncio.sleep(0)
+    others = []
+    for name, priority in (
+        ("startup", scheduler.Priority.STARTUP),
+        ("periodic", scheduler.Priority.PERIODIC),
+        ("webhook", scheduler.Priority.WEBHOOK),
+        ("manual", scheduler.Priority.MANUAL),
+    ):
+        others.append(asyncio.create_task(scheduler.run(priority, lambda name=name: job(name))))
+        await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(first, *others)
+    assert order == ["first", "webhook", "manual", "periodic", "startup"]
+
+
+@pytest.mark.asyncio
+async def test_cancel(monkeypatch) -> None:
+    monkeypatch.setattr(scheduler, "_POOLS", {"disk": scheduler._Pool("disk", 1)})
+    release = asyncio.Event()
+
+    async def hold() -> None:
+        async with scheduler.stage("disk"):
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    release.set()
+    await holder
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    # The slot isn't lost
+    async with asyncio.timeout(1), scheduler.stage("disk"):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_run() -> None:
+    async def get_priority() -> scheduler.Priority:
+        return scheduler.get_priority()
+
+    assert await scheduler.run(scheduler.Priority.WEBHOOK, get_priority) == scheduler.Priority.WEBHOOK
+    assert scheduler.get_priority() == scheduler.Priority.MANUAL
@@ -0,0 +1,78 @@
+# Copyright (c) 2026, Camptocamp SA
+import asyncio
+
+import pytest
+
+from shared_config_manager import singleflight
+
+
+@pytest.mark.asyncio
+async def test_collapse() -> None:
+    runs: list[list[int]] = []
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def function(arguments: list[int]) -> int:
+        runs.append(arguments)
+        started.set()
+        await release.wait()
+        return len(runs)
+
+    flight = singleflight.SingleFlight(function)
+    first = asyncio.create_task(flight(1))
+    await started.wait()
+    # Received during the run, collapsed in one following run
+    assert not flight.is_pending()
+    others = [asyncio.create_task(flight(argument)) for argument in (2, 3, 4)]
+    await asyncio.sleep(0)
+    assert flight.is_pending()
+    release.set()
+    assert await first == 1
+    assert await asyncio.gather(*others) == [2, 2, 2]
+    assert runs == [[1], [2, 3, 4]]
+
+
+@pytest.mark.asyncio
+async def test_debounce() -> None:
+    runs: list[list[int]] = []
+
+    async def function(arguments: list[int]) -> None:
+        runs.append(arguments)
+
+    flight = singleflight.SingleFlight(function)
+    tasks = [asyncio.create_task(flight(1, 0.05))]
+    await asyncio.sleep(0.01)
+    tasks.append(asyncio.create_task(flight(2, 0.05)))
+    await asyncio.gather(*tasks)
+    assert runs == [[1, 2]]
+
+
+@pytest.mark.asyncio
+async def test_debounce_undelayed() -> None:
+    runs: list[list[int]] = []
+
+    async def function(arguments: list[int]) -> None:
+        runs.append(arguments)
+
+    flight = singleflight.SingleFlight(function)
+    tasks = [asyncio.create_task(flight(1, 10))]
+    await asyncio.sleep(0.01)
+    # A call without delay doesn't wait for the end of the debounce delay
+    tasks.append(asyncio.create_task(flight(2)))
+    await asyncio.wait_for(asyncio.gather(*tasks), 1)
+    assert runs == [[1, 2]]
+
+
+@pytest.mark.asyncio
+async def test_error() -> None:
+    async def function(arguments: list[int]) -> None:
+        del arguments
+        message = "failed"
+        raise ValueError(message)
+
+    flight = singleflight.SingleFlight(function)
+    results = await asyncio.gather(flight(1), flight(2), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    # Not stuck after an error
+    with pytest.raises(ValueError, match="failed"):
+        await flight(3)
@@ -0,0 +1,81 @@
+# Copyright (c) 2026, Camptocamp SA
+import asyncio
+import functools
+import io
+import os
+import tarfile
+from typing import TYPE_CHECKING, BinaryIO
+
+import pytest
+
+from shared_config_manager import config, delta, streaming
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator
+
+
+class _Content:
+    """Content of a response, received by small chunks."""
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    async def iter_chunked(self, size: int) -> AsyncIterator[bytes]:
+        for index in range(0, len(self.data), size):
+            yield self.data[index : index + size]
+
+
+def _archive(files: dict[str, bytes]) -> bytes:
+    result = io.BytesIO()
+    with tarfile.open(fileobj=result, mode="w:gz") as tar:
+        for name, content in files.items():
+            member = tarfile.TarInfo(name)
+            member.size = len(content)
+            tar.addfile(member, io.BytesIO(content))
+    return result.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_extract(tmp_path, monkeypatch) -> None:
+    # Smaller than the content, to have some backpressure
+    monkeypatch.setattr(config.settings.slave, "buffer_size", 128 * 1024)
+    large = os.urandom(2 * 1024 * 1024)
+    data = _archive({"dir/file": b"Hello", "large": large})
+
+    await streaming.consume(
+        "test", _Content(data), functools.partial(delta.extract, dest=tmp_path, compression="gzip")
+    )
+    assert (tmp_path / "dir" / "file").read_bytes() == b"Hello"
+    assert (tmp_path / "large").read_bytes() == large
+
+
+@pytest.mark.asyncio
+async def test_save(tmp_path) -> None:
+    data = os.urandom(1024 * 1024)
+    await streaming.consume("test", _Content(data), functools.partial(streaming.save, dest=tmp_path / "file"))
+    assert (tmp_path / "file").read_bytes() == data
+
+
+@pytest.mark.asyncio
+async def test_consumer_error(tmp_path) -> None:
+    with pytest.raises(tarfile.ReadError):
+        await streaming.consume(
+            "test",
+            _Content(os.urandom(1024 * 1024)),
+            functools.partial(delta.extract, dest=tmp_path, compression="gzip"),
+        )
+
+
+@pytest.mark.asyncio
+async def test_consumer_error_full_buffer(monkeypatch) -> None:
+    monkeypatch.setattr(config.settings.slave, "buffer_size", streaming._CHUNK_SIZE)
+
+    def consumer(file: BinaryIO) -> None:
+        file.read(10)
+        message = "Corrupted"
+        raise ValueError(message)
+
+    # The producer waiting for a free slot in the full buffer is stopped
+    async with asyncio.timeout(10):
+        with pytest.raises(ValueError, match="Corrupted"):
+            await streaming.consume("test", _Content(os.urandom(1024 * 1024)), consumer)
@@ -0,0 +1,106 @@
+# Copyright (c) 2026, Camptocamp SA
+import subprocess
+from pathlib import Path
+
+import pytest
+from anyio import Path as AnyioPath
+
+from shared_config_manager import config, tarball
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    cache = tmp_path / "cache"
+    monkeypatch.setattr(config.settings.tarball, "cache_dir", AnyioPath(cache))
+    monkeypatch.setattr(tarball, "_CURRENT", {})
+    return cache
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    root = tmp_path / "source"
+    (root / "sub").mkdir(parents=True)
+    (root / "sub" / "file").write_text("Hello world")
+    (root / ".gitstats").write_text("{}")
+    return root
+
+
+@pytest.mark.asyncio
+async def test_build_deterministic(cache_dir, source_dir) -> None:
+    first = await tarball.build("test", AnyioPath(source_dir), None)
+    content = Path(first.path).read_bytes()
+    await tarball.delete("test")
+
+    (source_dir / "sub" / "file").touch()
+    second = await tarball.build("test", AnyioPath(source_dir), None)
+    assert second.version == first.version
+    assert Path(second.path).read_bytes() == content
+
+    members = (
+        subprocess.check_output(["tar", "--list", "--gzip", "--file", str(second.path)]).decode().split()
+    )
+    assert members[-1] == ".gitstats"
+
+
+@pytest.mark.asyncio
+async def test_build_threads(cache_dir, source_dir, monkeypatch) -> None:
+    monkeypatch.setattr(config.settings.tarball, "threads", 1)
+    first = await tarball.build("test", AnyioPath(source_dir), None)
+    content = Path(first.path).read_bytes()
+    await tarball.delete("test")
+
+    # The parallel compression produces the same standard archive
+    monkeypatch.setattr(config.settings.tarball, "threads", 4)
+    second = await tarball.build("test", AnyioPath(source_dir), None)
+    assert Path(second.path).read_bytes() == content
+
+
+@pytest.mark.asyncio
+async def test_build_reuse_version(cache_dir, source_dir) -> None:
+    first = await tarball.build("test", AnyioPath(source_dir), "v1")
+    assert Path(first.path).name == "v1.tar.gz"
+
+    (source_dir / "sub" / "file").write_text("Good bye")
+    second = await tarball.build("test", AnyioPath(source_dir), "v1")
+    assert second.path == first.path
+    assert tarball.get("test") == first
+
+    third = await tarball.get_or_build("test", AnyioPath(source_dir), "v2")
+    assert Path(third.path).name == "v2.tar.gz"
+
+
+@pytest.mark.asyncio
+async def test_evict(cache_dir, source_dir, monkeypatch) -> None:
+    monkeypatch.setattr(config.settings.tarball, "cache_max_size", 1)
+
+    first = await tarball.build("test", AnyioPath(source_dir), "v1")
+    second = await tarball.build("test", AnyioPath(source_dir), "v2")
+    assert not Path(first.path).exists()
+    # The current version is never evicted
+    assert Path(second.path).exists()
+
+
+@pytest.mark.asyncio
+async def test_get_compressed(cache_dir, source_dir) -> None:
+    source_tarball = await tarball.build("test", AnyioPath(source_dir), "v1")
+    assert await tarball.get_compressed("test", source_tarball, "gzip") == source_tarball.path
+
+    path = await tarball.get_compressed("test", source_tarball, "zstd")
+    assert Path(path).name == "v1.tar.zst"
+    members = subprocess.check_output(["tar", "--list", "--zstd", "--file", str(path)]).decode().split()
+    assert members[-1] == ".gitstats"
+    assert "sub/file" in members
+
+
+@pytest.mark.asyncio
+async def test_delta_invalid_base(cache_dir, source_dir) -> None:
+    other = await tarball.build("other", AnyioPath(source_dir), "0123abcd")
+    current = await tarball.build("test", AnyioPath(source_dir), "4567cdef")
+    assert await tarball.get_or_build_delta("test", AnyioPath(source_dir), "0123abcd", current) is None
+    # The base can't reference the versions of another source
+    assert await tarball.get_manifest("other", other.version) is not None
+    assert (
+        await tarball.get_or_build_delta("test", AnyioPath(source_dir), "../other/0123abcd", current) is None
+    )
+    assert not tarball.is_version("../other/0123abcd")
+    assert tarball.is_version(current.version)